@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+"""
+    Load test for pynetworktables2js. It starts a NetworkTables server that
+    stands in for the robot and publishes values at a fixed rate, then for
+    each websocket backend starts a pynetworktables2js server connected to
+    it and attaches synthetic websocket clients. It reports throughput,
+    server CPU and memory, and publish-to-client latency, and can write the
+    results as JSON so that they can be compared between releases.
+
+    Run it from the root of the repository::
+
+        python benchmarks/nt_load.py --keys 100 --rate 50 --clients 20
+
+    Each value is an array of numbers whose first element is the time it
+    was published, so latency includes NetworkTables, the pynetworktables2js
+    server, and the client's decoding. All processes run on this machine, so
+    they share a clock.
+"""
+
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+from os.path import abspath, dirname
+
+root = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, root)
+
+import logging
+
+logger = logging.getLogger("nt_load")
+
+#: Ratio between the bounds of adjacent latency histogram buckets
+BUCKET_RATIO = 1.02
+
+BACKENDS = ("tornado", "aiohttp")
+
+
+class Histogram(object):
+    """Latency histogram with logarithmic buckets, mergeable across processes"""
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or {}
+        self.count = sum(self.buckets.values())
+        self.max = 0.0
+
+    def add(self, ms):
+        bucket = int(math.log(max(ms, 0.01) / 0.01, BUCKET_RATIO))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        if ms > self.max:
+            self.max = ms
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                # upper bound of the bucket, which can be above anything seen
+                return min(0.01 * BUCKET_RATIO ** (bucket + 1), self.max)
+        return self.max
+
+    def to_json(self):
+        return {"buckets": self.buckets, "max": self.max}
+
+    @classmethod
+    def from_json(cls, data):
+        h = cls({int(k): v for k, v in data["buckets"].items()})
+        h.max = data["max"]
+        return h
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("nothing is listening on port %d" % port)
+
+
+#
+# Robot stand-in
+#
+
+
+def run_robot(options):
+    from networktables import NetworkTables
+
+    NetworkTables.startServer(
+        persistFilename=os.devnull, listenAddress="127.0.0.1", port=options.nt_port
+    )
+    NetworkTables.setUpdateRate(0.01)
+
+    entries = [NetworkTables.getEntry("/bench/%d" % i) for i in range(options.keys)]
+    padding = [0.0] * (options.value_size - 1)
+    interval = 1.0 / options.rate
+    due = time.monotonic()
+
+    while True:
+        for entry in entries:
+            entry.setDoubleArray([time.time()] + padding)
+        NetworkTables.flush()
+
+        due += interval
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            due = time.monotonic()
+
+
+#
+# pynetworktables2js server
+#
+
+
+def run_server(options):
+    from networktables import NetworkTables
+
+    NetworkTables.startClient(("127.0.0.1", options.nt_port))
+    while not NetworkTables.isConnected():
+        time.sleep(0.05)
+
+    if options.backend == "tornado":
+        import tornado.web
+        from tornado.ioloop import IOLoop
+        from pynetworktables2js import get_handlers
+
+        app = tornado.web.Application(
+            get_handlers(
+                flush_interval=options.flush_interval, compress=options.compress
+            )
+        )
+        app.listen(options.port, "127.0.0.1")
+        IOLoop.current().start()
+    else:
+        from functools import partial
+        from aiohttp import web
+        from pynetworktables2js import networktables_websocket
+
+        app = web.Application()
+        app.router.add_get(
+            "/networktables/ws",
+            partial(
+                networktables_websocket,
+                flush_interval=options.flush_interval,
+                compress=options.compress,
+            ),
+        )
+        web.run_app(app, host="127.0.0.1", port=options.port, print=None)
+
+
+class ProcessSampler(object):
+    """Samples the CPU time and memory use of a process"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.rss = []
+        self.start = self.cpu_seconds()
+        self.start_time = time.monotonic()
+
+    def cpu_seconds(self):
+        try:
+            with open("/proc/%d/stat" % self.pid) as fp:
+                fields = fp.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def sample(self):
+        try:
+            with open("/proc/%d/status" % self.pid) as fp:
+                for line in fp:
+                    if line.startswith("VmRSS:"):
+                        self.rss.append(int(line.split()[1]) / 1024.0)
+        except OSError:
+            pass
+
+    def result(self):
+        end = self.cpu_seconds()
+        elapsed = time.monotonic() - self.start_time
+        cpu = None
+        if end is not None and self.start is not None:
+            cpu = round(100 * (end - self.start) / elapsed, 1)
+        return {
+            "cpu_percent": cpu,
+            "rss_mb": round(max(self.rss), 1) if self.rss else None,
+        }
+
+
+#
+# Synthetic websocket clients
+#
+
+
+def value_time(value):
+    # RFC 8746 little endian float64 typed array
+    if getattr(value, "tag", None) == 86:
+        return struct.unpack_from("<d", value.value)[0]
+    if isinstance(value, list) and value:
+        return value[0]
+
+
+async def run_client(url, options, histogram, totals):
+    import cbor2
+    from tornado.websocket import websocket_connect
+
+    start = time.monotonic()
+    conn = await websocket_connect(url, max_message_size=64 * 1024 * 1024)
+    totals["connect_ms"].append((time.monotonic() - start) * 1000)
+
+    measure_from = start + options.warmup
+    end = measure_from + options.duration
+    ids = []
+
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            msg = await asyncio.wait_for(conn.read_message(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if msg is None:
+            totals["disconnects"] += 1
+            break
+
+        now = time.time()
+        measuring = time.monotonic() >= measure_from
+        for m in cbor2.loads(msg):
+            if "k" in m and "i" not in m:
+                key = m["k"]
+                ids.append(key)
+            elif "i" in m:
+                key = ids[m["i"]]
+            else:
+                continue
+            if "v" not in m or not measuring:
+                continue
+            t = value_time(m["v"])
+            if t is not None:
+                histogram.add((now - t) * 1000)
+                totals["updates"] += 1
+
+        if measuring:
+            totals["frames"] += 1
+            totals["bytes"] += len(msg)
+
+    conn.close()
+
+
+def run_clients(options):
+    url = "ws://127.0.0.1:%d/networktables/ws" % options.port
+    if options.query:
+        url += "?" + options.query
+
+    histogram = Histogram()
+    totals = {"updates": 0, "frames": 0, "bytes": 0, "disconnects": 0}
+    totals["connect_ms"] = []
+
+    async def main():
+        await asyncio.gather(
+            *[
+                run_client(url, options, histogram, totals)
+                for _ in range(options.clients)
+            ]
+        )
+
+    asyncio.run(main())
+    totals["latency"] = histogram.to_json()
+    json.dump(totals, sys.stdout)
+
+
+#
+# Harness
+#
+
+
+def spawn(mode, options, *args):
+    argv = [sys.executable, abspath(__file__), mode] + list(args)
+    for name in (
+        "keys",
+        "rate",
+        "value_size",
+        "clients",
+        "nt_port",
+        "port",
+        "duration",
+    ):
+        argv += ["--" + name.replace("_", "-"), str(getattr(options, name))]
+    argv += ["--warmup", str(options.warmup), "--query", options.query]
+    argv += ["--flush-interval", str(options.flush_interval)]
+    if options.compress:
+        argv.append("--compress")
+    return subprocess.Popen(argv, stdout=subprocess.PIPE if mode == "clients" else None)
+
+
+def run_backend(options, backend):
+    options.port = free_port()
+    server = spawn("server", options, "--backend", backend)
+    try:
+        wait_for_port(options.port)
+        sampler = ProcessSampler(server.pid)
+
+        # spread the clients across processes so that decoding doesn't
+        # become the bottleneck
+        procs = []
+        per_proc = int(math.ceil(options.clients / float(options.client_procs)))
+        remaining = options.clients
+        while remaining > 0:
+            count = min(per_proc, remaining)
+            remaining -= count
+            saved, options.clients = options.clients, count
+            procs.append(spawn("clients", options))
+            options.clients = saved
+
+        while any(p.poll() is None for p in procs):
+            sampler.sample()
+            time.sleep(0.5)
+        server_stats = sampler.result()
+
+        histogram = Histogram()
+        totals = {"updates": 0, "frames": 0, "bytes": 0, "disconnects": 0}
+        connect_ms = []
+        for p in procs:
+            out = json.loads(p.stdout.read())
+            histogram.merge(Histogram.from_json(out.pop("latency")))
+            connect_ms += out.pop("connect_ms")
+            for k in totals:
+                totals[k] += out[k]
+    finally:
+        server.terminate()
+        server.wait()
+
+    duration = float(options.duration)
+    offered = options.keys * options.rate
+    per_client = totals["updates"] / duration / max(options.clients, 1)
+
+    return {
+        "backend": backend,
+        "updates_per_sec": round(totals["updates"] / duration, 1),
+        "updates_per_client_per_sec": round(per_client, 1),
+        "delivery_ratio": round(per_client / offered, 3) if offered else None,
+        "frames_per_sec": round(totals["frames"] / duration, 1),
+        "bytes_per_sec": round(totals["bytes"] / duration),
+        "disconnects": totals["disconnects"],
+        "connect_ms_max": round(max(connect_ms), 1) if connect_ms else None,
+        "latency_ms": {
+            "p50": _round(histogram.percentile(50)),
+            "p90": _round(histogram.percentile(90)),
+            "p99": _round(histogram.percentile(99)),
+            "max": _round(histogram.max),
+        },
+        "server": server_stats,
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def run(options):
+    try:
+        from pynetworktables2js.version import __version__
+    except ImportError:
+        __version__ = "__master__"
+
+    options.nt_port = free_port()
+    robot = spawn("robot", options)
+    try:
+        wait_for_port(options.nt_port)
+        results = []
+        for backend in options.backends.split(","):
+            logger.info("Running %s with %d clients", backend, options.clients)
+            result = run_backend(options, backend)
+            logger.info(
+                "%s: %s updates/s, latency p50 %sms p99 %sms, server cpu %s%% rss %sMB",
+                backend,
+                result["updates_per_sec"],
+                result["latency_ms"]["p50"],
+                result["latency_ms"]["p99"],
+                result["server"]["cpu_percent"],
+                result["server"]["rss_mb"],
+            )
+            results.append(result)
+    finally:
+        robot.terminate()
+        robot.wait()
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "keys": options.keys,
+            "rate": options.rate,
+            "value_size": options.value_size,
+            "clients": options.clients,
+            "duration": options.duration,
+            "warmup": options.warmup,
+            "query": options.query,
+            "flush_interval": options.flush_interval,
+            "compress": options.compress,
+        },
+        "results": results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+        logger.info("Wrote results to %s", options.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [run|robot|server|clients]")
+    parser.add_option(
+        "--keys", type="int", default=50, help="Number of keys to publish"
+    )
+    parser.add_option(
+        "--rate", type="float", default=20, help="Updates per second of each key"
+    )
+    parser.add_option(
+        "--value-size",
+        type="int",
+        default=1,
+        help="Number of elements in each published array of numbers",
+    )
+    parser.add_option(
+        "--clients", type="int", default=10, help="Number of websocket clients"
+    )
+    parser.add_option(
+        "--client-procs",
+        type="int",
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Number of processes to run the clients in",
+    )
+    parser.add_option(
+        "--duration", type="float", default=10, help="Seconds to measure for"
+    )
+    parser.add_option(
+        "--warmup",
+        type="float",
+        default=2,
+        help="Seconds to wait after connecting before measuring",
+    )
+    parser.add_option(
+        "--backends",
+        default=",".join(BACKENDS),
+        help="Comma separated websocket backends to test",
+    )
+    parser.add_option(
+        "--query",
+        default="",
+        help="Query string of the websocket URL, to enable protocol options (e.g. ids=1&ta=1)",
+    )
+    parser.add_option("--flush-interval", type="float", default=0)
+    parser.add_option("--compress", default=False, action="store_true")
+    parser.add_option("-o", "--output", help="Write JSON results to this file")
+
+    # used by the processes that the harness starts
+    parser.add_option("--backend", default="tornado", help="(internal)")
+    parser.add_option("--nt-port", type="int", default=1735, help="(internal)")
+    parser.add_option("--port", type="int", default=8888, help="(internal)")
+
+    options, args = parser.parse_args()
+    mode = args[0] if args else "run"
+
+    logging.basicConfig(
+        datefmt="%H:%M:%S",
+        format="%(asctime)s %(levelname)-8s: %(name)-10s: %(message)s",
+        level=logging.INFO if mode == "run" else logging.WARNING,
+    )
+
+    if options.value_size < 1:
+        parser.error("--value-size must be at least 1")
+
+    modes = {
+        "run": run,
+        "robot": run_robot,
+        "server": run_server,
+        "clients": run_clients,
+    }
+    if mode not in modes:
+        parser.error("unknown mode %r" % mode)
+
+    try:
+        modes[mode](options)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,15 @@ import asyncio
 from aiohttp import web
 
 from networktables import NetworkTables
-from pynetworktables2js import nt2js_static_resources, networktables_websocket
+from pynetworktables2js import (
+    camera_relay,
+    camera_stats,
+    networktables_stats,
+    networktables_values_handler,
+    nt2js_static_handler,
+    nt2js_static_resources,
+    networktables_websocket,
+)
 
 import logging
 
@@ -74,6 +82,13 @@ if __name__ == "__main__":
         help="Use this instead of --robot to receive the IP from the driver station. WARNING: It will not work if you are not on the same host as the DS!",
     )
 
+    parser.add_option(
+        "--production",
+        default=False,
+        action="store_true",
+        help="Serve the nt2js javascript minified and precompressed, with caching enabled",
+    )
+
     options, args = parser.parse_args()
 
     # Setup logging
@@ -94,7 +109,14 @@ if __name__ == "__main__":
 
     # Add nt2js handlers
     app.router.add_route("GET", "/networktables/ws", networktables_websocket)
-    app.router.add_static("/networktables", nt2js_static_resources())
+    app.router.add_get("/networktables/values", networktables_values_handler())
+    app.router.add_get("/networktables/stats", networktables_stats)
+    app.router.add_get("/networktables/camera/stats", camera_stats)
+    app.router.add_get(r"/networktables/camera/{port:\d+}/{path:.*}", camera_relay)
+    if options.production:
+        app.router.add_get("/networktables/{name}", nt2js_static_handler())
+    else:
+        app.router.add_static("/networktables", nt2js_static_resources())
 
     # Add static route for dashboard files
     app.router.add_route("GET", "/", forward_request)
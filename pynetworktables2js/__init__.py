@@ -9,8 +9,15 @@ except ImportError as e:
     logger.info("Could not import tornado, disabling support.")
 else:
     from .tornado_handlers import (
+        AssetHandler,
+        CameraRelayHandler,
+        CameraStatsHandler,
         NetworkTablesWebSocket,
         NonCachingStaticFileHandler,
+        ReplayHandler,
+        RevalidatingStaticFileHandler,
+        StatsHandler,
+        ValuesHandler,
         get_handlers,
     )
 
@@ -20,7 +27,15 @@ except ImportError as e:
     logger.info(e)
     logger.info("Could not import aiohttp, disabling support.")
 else:
-    from .aiohttp_handlers import networktables_websocket, nt2js_static_resources
+    from .aiohttp_handlers import (
+        camera_relay,
+        camera_stats,
+        networktables_stats,
+        networktables_values_handler,
+        networktables_websocket,
+        nt2js_static_handler,
+        nt2js_static_resources,
+    )
 
 try:
     from .version import __version__
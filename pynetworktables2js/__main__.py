@@ -19,7 +19,10 @@ import tornado.web
 from networktables import NetworkTables
 from tornado.ioloop import IOLoop
 
-from . import get_handlers, NonCachingStaticFileHandler
+from . import get_handlers, NonCachingStaticFileHandler, RevalidatingStaticFileHandler
+from .assets import Assets
+from .nt_hub import get_hub
+from .recording import Recorder, Replay
 
 try:
     from .version import __version__
@@ -85,6 +88,74 @@ def main():
         help="Identity to broadcast to remote NT clients",
     )
 
+    parser.add_option(
+        "--flush-interval",
+        type="float",
+        default=0,
+        help="Minimum time in seconds between websocket frames sent to each client (e.g. 0.02); updates are coalesced in between",
+    )
+
+    parser.add_option(
+        "--compress",
+        default=False,
+        action="store_true",
+        help="Compress websocket frames with permessage-deflate, useful over slow links",
+    )
+
+    parser.add_option(
+        "--compress-min-size",
+        type="int",
+        default=128,
+        help="With --compress, send websocket frames smaller than this many bytes uncompressed",
+    )
+
+    parser.add_option(
+        "--max-setups",
+        type="int",
+        default=4,
+        help="Maximum number of websockets that may connect and receive the initial values at once; others wait their turn (0 for no limit)",
+    )
+
+    parser.add_option(
+        "--production",
+        default=False,
+        action="store_true",
+        help="Serve the nt2js javascript minified and precompressed, and let browsers cache files instead of reloading them each time",
+    )
+
+    parser.add_option(
+        "--record",
+        metavar="FILE",
+        help="Record every NetworkTables update to FILE, which can be served later with --replay",
+    )
+
+    parser.add_option(
+        "--replay",
+        metavar="FILE",
+        help="Serve the updates recorded in FILE instead of connecting to NetworkTables. The replay is controlled at /networktables/replay",
+    )
+
+    parser.add_option(
+        "--replay-speed",
+        type="float",
+        default=1.0,
+        help="With --replay, play back this many times faster than recorded (0 for as fast as possible)",
+    )
+
+    parser.add_option(
+        "--replay-start",
+        type="float",
+        default=0,
+        help="With --replay, start this many seconds into the recording",
+    )
+
+    parser.add_option(
+        "--replay-loop",
+        default=False,
+        action="store_true",
+        help="With --replay, start over at the end of the recording. With a high --replay-speed this is a load test for dashboards",
+    )
+
     options, args = parser.parse_args()
 
     # Setup logging
@@ -97,8 +168,37 @@ def main():
     if options.team and options.robot != "127.0.0.1":
         parser.error("--robot and --team are mutually exclusive")
 
-    # Setup NetworkTables
-    init_networktables(options)
+    hub = get_hub()
+    recorder = None
+
+    if options.replay:
+        if options.record:
+            parser.error("--record and --replay are mutually exclusive")
+        try:
+            hub.source = Replay(
+                options.replay,
+                speed=options.replay_speed,
+                start=options.replay_start,
+                loop=options.replay_loop,
+            )
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        logger.info("Replaying %s", options.replay)
+    else:
+        if options.record:
+            try:
+                recorder = Recorder(options.record)
+            except OSError as e:
+                parser.error(str(e))
+            hub.recorder = recorder
+            logger.info("Recording to %s", options.record)
+
+        # Setup NetworkTables
+        init_networktables(options)
+
+        if recorder is not None:
+            # record even when no dashboards are connected
+            hub.open()
 
     # setup tornado application with static handler + networktables support
     www_dir = abspath(os.getcwd())
@@ -111,11 +211,28 @@ def main():
     if not exists(index_html):
         logger.warning("%s not found", index_html)
 
+    if options.production:
+        # pages refer to the nt2js javascript by its hashed names
+        assets = Assets()
+        static_handler = RevalidatingStaticFileHandler
+        static_opts = {"assets": assets}
+    else:
+        assets = None
+        static_handler = NonCachingStaticFileHandler
+        static_opts = {}
+
     app = tornado.web.Application(
-        get_handlers()
+        get_handlers(
+            flush_interval=options.flush_interval,
+            compress=options.compress,
+            compress_min_size=options.compress_min_size,
+            max_setups=options.max_setups,
+            production=options.production,
+            assets=assets,
+        )
         + [
-            (r"/()", NonCachingStaticFileHandler, {"path": index_html}),
-            (r"/(.*)", NonCachingStaticFileHandler, {"path": www_dir}),
+            (r"/()", static_handler, dict(static_opts, path=index_html)),
+            (r"/(.*)", static_handler, dict(static_opts, path=www_dir)),
         ]
     )
 
@@ -123,7 +240,11 @@ def main():
     logger.info("Listening on http://localhost:%s/", options.port)
 
     app.listen(options.port)
-    IOLoop.current().start()
+    try:
+        IOLoop.current().start()
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
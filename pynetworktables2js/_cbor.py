@@ -0,0 +1,241 @@
+"""
+Helpers for assembling CBOR messages from pieces that have already been
+encoded, so that a value only has to be encoded once no matter how many
+clients it is sent to.
+"""
+
+import array
+import struct
+import sys
+
+import cbor2
+
+#: RFC 8746 tag for a little endian array of float64
+TAG_FLOAT64_LE = 86
+
+#: Arrays shorter than this are always sent in full
+PATCH_MIN_LENGTH = 32
+
+#: Arrays are sent in full if more than this fraction of their elements changed
+PATCH_MAX_FRACTION = 0.25
+
+_TRUE = b"\xf5"
+_FALSE = b"\xf4"
+
+# map keys, each a one character text string
+_K = b"\x61k"
+_I = b"\x61i"
+_V = b"\x61v"
+_N = b"\x61n"
+_Q = b"\x61q"
+_D = b"\x61d"
+_L = b"\x61l"
+_E = b"\x61e"
+
+
+def header(major, length):
+    """Returns the CBOR header for an item of ``major`` type and ``length``"""
+    major <<= 5
+    if length < 24:
+        return struct.pack(">B", major | length)
+    elif length < 0x100:
+        return struct.pack(">BB", major | 24, length)
+    elif length < 0x10000:
+        return struct.pack(">BH", major | 25, length)
+    elif length < 0x100000000:
+        return struct.pack(">BI", major | 26, length)
+    return struct.pack(">BQ", major | 27, length)
+
+
+def array_header(length):
+    """Returns the CBOR header for an array of ``length`` items"""
+    return header(4, length)
+
+
+def seq_msg(seq):
+    """Returns an encoded ``{"q": seq}`` message"""
+    return b"\xa1" + _Q + header(0, seq)
+
+
+def latency_msg(stamp, age):
+    """Returns an encoded ``{"l": [stamp, age]}`` message"""
+    return b"\xa1" + _L + struct.pack(">BBdBd", 0x82, 0xFB, stamp, 0xFB, age)
+
+
+def echo_msg(sent):
+    """Returns an encoded ``{"e": sent}`` message"""
+    return b"\xa1" + _E + struct.pack(">Bd", 0xFB, sent)
+
+
+def typed_value(value):
+    """
+    Returns ``value`` as an RFC 8746 little endian float64 typed array if it
+    is a non-empty array of floats, otherwise returns ``value`` unchanged.
+    """
+    if isinstance(value, (tuple, list)) and value and type(value[0]) is float:
+        try:
+            a = array.array("d", value)
+        except TypeError:
+            return value
+        if sys.byteorder == "big":
+            a.byteswap()
+        return cbor2.CBORTag(TAG_FLOAT64_LE, a.tobytes())
+    return value
+
+
+def patchable(value):
+    """Returns True if ``value`` is an array that may be sent as a patch"""
+    return isinstance(value, (tuple, list)) and len(value) >= PATCH_MIN_LENGTH
+
+
+def diff(old, new):
+    """
+    Compares two arrays of the same length.
+
+    :returns: a tuple of (indices, values) of the elements of ``new`` that
+              differ from ``old``, or None if the arrays can't be compared
+              or too many elements changed for a patch to be worthwhile
+    """
+    if len(old) != len(new) or not patchable(new):
+        return None
+
+    limit = int(len(new) * PATCH_MAX_FRACTION)
+    indices = []
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            if len(indices) == limit:
+                return None
+            indices.append(i)
+    return indices, [new[i] for i in indices]
+
+
+class Snapshot(object):
+    """
+    An encoded snapshot message, along with the values that it contains.
+    """
+
+    __slots__ = ("data", "values")
+
+    def __init__(self, data, values):
+        self.data = data
+        self.values = values
+
+
+class Update(object):
+    """
+    A NetworkTables value change, encoded once and rendered into a message
+    for each client that it is sent to.
+
+    The message is a map of ``{"k": key, "v": value, "n": isNew}``. Clients
+    that use key IDs receive ``{"i": id, "v": value, "n": isNew}`` instead.
+    Clients that support typed arrays receive arrays of floats as a typed
+    array. Each variant of the value is encoded at most once.
+
+    Large arrays may instead be sent as a patch against the value that the
+    client already has, ``{"k": key, "d": [indices, values, length], "n":
+    isNew}``, where ``length`` is the length of the array before and after
+    the patch so that the client can check that it has the right one.
+    """
+
+    __slots__ = (
+        "key",
+        "value",
+        "isNew",
+        "_key",
+        "_tail",
+        "_body",
+        "_typed_body",
+        "_msg",
+        "_typed_msg",
+        "_patch_base",
+        "_patch",
+        "_patch_bodies",
+    )
+
+    def __init__(self, key, value, isNew):
+        self.key = key
+        self.value = value
+        self.isNew = isNew
+        self._key = None
+        self._tail = _N + (_TRUE if isNew else _FALSE)
+        self._body = None
+        self._typed_body = None
+        self._msg = None
+        self._typed_msg = None
+        self._patch_base = None
+        self._patch = None
+        self._patch_bodies = None
+
+    def _head(self, key_id):
+        # the encoded "k" or "i" entry of the message
+        if key_id is not None:
+            return _I + header(0, key_id)
+        if self._key is None:
+            self._key = _K + cbor2.dumps(self.key)
+        return self._key
+
+    def body(self, typed=False):
+        """The encoded ``"v"`` and ``"n"`` entries of the message"""
+        if typed:
+            body = self._typed_body
+            if body is None:
+                value = typed_value(self.value)
+                if value is self.value:
+                    body = self.body()
+                else:
+                    body = _V + cbor2.dumps(value) + self._tail
+                self._typed_body = body
+        else:
+            body = self._body
+            if body is None:
+                body = self._body = _V + cbor2.dumps(self.value) + self._tail
+        return body
+
+    def render(self, key_id=None, typed=False):
+        """
+        Returns the encoded message
+
+        :param key_id: if not None, send this in place of the key
+        :param typed: encode arrays of floats as typed arrays
+        """
+        if key_id is not None:
+            return b"\xa3" + self._head(key_id) + self.body(typed)
+
+        msg = self._typed_msg if typed else self._msg
+        if msg is None:
+            msg = b"\xa3" + self._head(None) + self.body(typed)
+            if typed:
+                self._typed_msg = msg
+            else:
+                self._msg = msg
+        return msg
+
+    def patch(self, base, key_id=None, typed=False):
+        """
+        Returns the message encoded as a patch against ``base``, or None if
+        the whole value should be sent instead.
+
+        Clients that are up to date have all been sent the same ``base``, so
+        the most recent comparison is reused as long as it is against the
+        same object.
+
+        :param base: the value of the key that was last sent to the client
+        :param key_id: if not None, send this in place of the key
+        :param typed: encode arrays of floats as typed arrays
+        """
+        if base is not self._patch_base:
+            self._patch_base = base
+            self._patch = diff(base, self.value)
+            self._patch_bodies = {}
+
+        if self._patch is None:
+            return None
+
+        body = self._patch_bodies.get(typed)
+        if body is None:
+            indices, values = self._patch
+            if typed:
+                values = typed_value(values)
+            body = _D + cbor2.dumps([indices, values, len(base)]) + self._tail
+            self._patch_bodies[typed] = body
+        return b"\xa3" + self._head(key_id) + body
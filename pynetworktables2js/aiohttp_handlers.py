@@ -1,13 +1,25 @@
 import asyncio
 import logging
-from functools import partial
-from aiohttp import web
+import time
+from aiohttp import web, WSMsgType
 from os.path import abspath, dirname, join
-from .nt_serial import NTSerial
+from .assets import Assets
+from .camera import CONTENT_TYPE, CameraViewer, get_relay, split_query
+from .nt_client import CompressionStats, NTClient, client_options
+from .nt_hub import get_hub
+from .values import ValueCache
 
 logger = logging.getLogger("net2js")
 
-__all__ = ["nt2js_static_resources", "networktables_websocket"]
+__all__ = [
+    "camera_relay",
+    "camera_stats",
+    "networktables_stats",
+    "networktables_values_handler",
+    "nt2js_static_handler",
+    "nt2js_static_resources",
+    "networktables_websocket",
+]
 
 
 def nt2js_static_resources():
@@ -17,30 +29,368 @@ def nt2js_static_resources():
     return abspath(join(dirname(__file__), "js"))
 
 
-@asyncio.coroutine
-def networktables_websocket(request):
-    # Setup websocket
-    ws = web.WebSocketResponse()
-    ws.start(request)
+def nt2js_static_handler(assets=None):
+    """
+    Returns a handler that serves the nt2js static resources from memory,
+    minified, precompressed, and with caching enabled. Files requested by
+    their hashed name are cached by the browser indefinitely, and files
+    requested by their plain name are revalidated. The files are loaded
+    when this is called.
+
+    Use it in production instead of serving :func:`nt2js_static_resources`::
+
+        app.router.add_get("/networktables/{name}", nt2js_static_handler())
+
+    Pages only benefit from indefinite caching if they use the hashed names.
+    Pass an :class:`.Assets` and use the same instance to serve your pages
+    with :meth:`.Assets.rewrite`, or to generate them with
+    :meth:`.Assets.url`.
+
+    :param assets: The :class:`.Assets` to serve, loaded here if None
+    """
+    if assets is None:
+        assets = Assets()
+
+    async def handler(request):
+        asset, hashed = assets.get(request.match_info["name"])
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        status, headers, body = asset.respond(
+            hashed,
+            request.headers.get("Accept-Encoding", ""),
+            request.headers.get("If-None-Match", ""),
+        )
+        return web.Response(status=status, headers=headers, body=body or None)
+
+    return handler
+
+
+def networktables_values_handler():
+    """
+    Returns a handler for the current values of NetworkTables keys as JSON
+    or CBOR, for scripts that poll values instead of opening a websocket.
+    See :meth:`.ValueCache.respond` for the query arguments. Responses have
+    an ETag, so polls of values that haven't changed are answered with a
+    304::
+
+        app.router.add_get("/networktables/values", networktables_values_handler())
+    """
+    cache = ValueCache()
+
+    # NetworkTables sends the current values asynchronously once the hub is
+    # listening, so start now rather than on the first request
+    get_hub().open()
+
+    async def handler(request):
+        try:
+            status, headers, body = cache.respond(
+                lambda name: request.query.getall(name, []),
+                request.headers.get("Accept", ""),
+                request.headers.get("If-None-Match", ""),
+            )
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.Response(status=status, headers=headers, body=body or None)
+
+    return handler
+
+
+class _MeasuredCompressor(object):
+    """Wraps aiohttp's permessage-deflate compressor to record statistics"""
+
+    def __init__(self, compressor, stats):
+        self.compressor = compressor
+        self.stats = stats
+        self._pending = None
+
+    def compress_sync(self, data):
+        start = time.perf_counter()
+        compressed = self.compressor.compress_sync(data)
+        self._pending = len(data), len(compressed), time.perf_counter() - start
+        return compressed
+
+    async def compress(self, data):
+        start = time.perf_counter()
+        compressed = await self.compressor.compress(data)
+        self._pending = len(data), len(compressed), time.perf_counter() - start
+        return compressed
+
+    def flush(self, *args):
+        start = time.perf_counter()
+        flushed = self.compressor.flush(*args)
+        if self._pending is not None:
+            size, compressed, seconds = self._pending
+            self._pending = None
+            self.stats.add(
+                size, compressed + len(flushed), seconds + time.perf_counter() - start
+            )
+        return flushed
+
+
+def _measure_compression(ws, min_size):
+    # aiohttp has no API for compression statistics or for sending a message
+    # uncompressed, so this wraps its websocket writer's private compressor.
+    # If a different aiohttp doesn't have one, messages are sent normally
+    # without statistics
+    if not ws.compress:
+        return None
+    writer = getattr(ws, "_writer", None)
+    compressor = None
+    if all(hasattr(writer, name) for name in ("compress", "_compressobj")):
+        try:
+            compressor = writer._get_compressor(None)
+        except (AttributeError, TypeError):
+            pass
+    if compressor is None:
+        logger.debug("Can't measure websocket compression with this aiohttp")
+        return None
+    stats = CompressionStats(min_size)
+    writer._compressobj = _MeasuredCompressor(compressor, stats)
+    return stats
+
+
+class _AiohttpClient(NTClient):
+    """NTClient that writes to an aiohttp websocket"""
+
+    def __init__(self, ws, compress_min_size=0, **options):
+        super(_AiohttpClient, self).__init__(**options)
+        self.ws = ws
+        self.event_loop = asyncio.get_event_loop()
+
+        self.compression = _measure_compression(ws, compress_min_size)
+
+    def _call_soon_threadsafe(self, callback):
+        self.event_loop.call_soon_threadsafe(callback)
+
+    def _call_later(self, delay, callback):
+        self.event_loop.call_later(delay, callback)
+
+    def _write(self, msg):
+        if self.ws.closed:
+            self.close()
+            return None
+
+        # send_bytes waits for the transport to drain when its buffer is
+        # full, so don't write anything else until it's done
+        return asyncio.ensure_future(self._send(msg))
+
+    async def _send(self, msg):
+        if self.compression is None or len(msg) >= self.compression.min_size:
+            await self.ws.send_bytes(msg)
+            return
+
+        # permessage-deflate allows any message to be sent uncompressed, but
+        # aiohttp only decides that per socket
+        self.compression.skipped += 1
+        writer = self.ws._writer
+        level, writer.compress = writer.compress, 0
+        try:
+            await self.ws.send_bytes(msg)
+        finally:
+            writer.compress = level
+
+
+# semaphores that limit how many websockets are set up at once, by limit
+_setups = {}
+
+
+async def _begin_setup(max_setups):
+    # Setting up a websocket includes sending it the current state of
+    # NetworkTables, so when many pages connect at once (such as when the
+    # server restarts) make the excess ones wait before the handshake.
+    # Returns a function that ends this websocket's setup
+    if not max_setups:
+        return lambda: None
+
+    setups = _setups.get(max_setups)
+    if setups is None:
+        setups = _setups[max_setups] = asyncio.Semaphore(max_setups)
+    await setups.acquire()
 
-    event_loop = asyncio.get_event_loop()
+    released = []
 
-    def send_message(msg):
-        # Schedule msg to be sent from the event loop's thread
-        event_loop.call_soon_threadsafe(partial(ws.send_bytes, msg))
+    def end_setup():
+        if not released:
+            released.append(True)
+            setups.release()
 
-    # Setup nt_serial
-    nt_serial = NTSerial(send_message)
+    return end_setup
+
+
+async def networktables_websocket(
+    request, flush_interval=0, compress=False, compress_min_size=128, max_setups=4
+):
+    """
+    aiohttp handler for the NetworkTables websocket. Use
+    :func:`functools.partial` to set the options when adding the route.
+
+    :param flush_interval: Minimum time in seconds between websocket frames
+                           sent to the client; updates that arrive within the
+                           interval are coalesced into a single frame.
+    :param compress: Compress websocket frames with permessage-deflate when
+                     the browser supports it
+    :param compress_min_size: Frames smaller than this many bytes are sent
+                              uncompressed
+    :param max_setups: Maximum number of websockets that may be in the process
+                       of connecting and receiving the initial state of
+                       NetworkTables at once; others wait their turn. 0 means
+                       no limit.
+    """
+
+    end_setup = await _begin_setup(max_setups)
+    try:
+        # Setup websocket
+        ws = web.WebSocketResponse(compress=compress)
+        await ws.prepare(request)
+
+        # Attach to the shared NetworkTables hub
+        client = _AiohttpClient(
+            ws,
+            flush_interval=flush_interval,
+            compress_min_size=compress_min_size,
+            **client_options(lambda name: request.query.getall(name, []))
+        )
+        hub = get_hub()
+        hub.attach(client)
+    except BaseException:
+        end_setup()
+        raise
+
+    client.add_flush_callback(end_setup)
 
     # Message listener loop
     try:
-        while True:
-            msg = yield from ws.receive_str()
-            nt_serial.process_update(msg)
-            if ws.closing:
-                break
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                hub.process_update(msg.data, client)
     except Exception as e:
         logger.error(e)
     finally:
-        logger.info("NetworkTables Websocket Disconnected")
-        return ws
+        end_setup()
+        hub.detach(client)
+        client.close()
+        logger.info(
+            "NetworkTables Websocket Disconnected (sent %d, overwritten %d, dropped %d)",
+            client.sent,
+            client.overwritten,
+            client.dropped,
+        )
+        if client.compression is not None:
+            logger.info("NetworkTables Websocket %s", client.compression)
+
+    return ws
+
+
+class _AiohttpViewer(CameraViewer):
+    """CameraViewer that writes to an aiohttp streaming response"""
+
+    def __init__(self, request, response):
+        super(_AiohttpViewer, self).__init__()
+        self.request = request
+        self.response = response
+        self.event_loop = asyncio.get_event_loop()
+        self.done = self.event_loop.create_future()
+
+    def _call_soon_threadsafe(self, callback):
+        self.event_loop.call_soon_threadsafe(callback)
+
+    def _write(self, data):
+        return asyncio.ensure_future(self._send(data))
+
+    async def _send(self, data):
+        if not self.response.prepared:
+            await self.response.prepare(self.request)
+        await self.response.write(data)
+
+    def _on_close(self):
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+async def camera_relay(request, timeout=5.0):
+    """
+    aiohttp handler that relays an MJPEG stream from a camera on the robot.
+    However many browsers view a camera, only one connection is made to it,
+    and slow browsers skip frames instead of falling behind. The ``fps``,
+    ``scale`` and ``quality`` query arguments reduce the frame rate,
+    resolution and JPEG quality of the frames sent to the browser (see
+    :class:`.Profile`). Add it with a route that matches the camera's port
+    and the path of its stream::
+
+        app.router.add_get(
+            r"/networktables/camera/{port:\\d+}/{path:.*}", camera_relay
+        )
+
+    :param timeout: Seconds to wait for the camera before giving up
+    """
+    path = request.match_info["path"]
+    try:
+        profile, query = split_query(request.query_string)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    if query:
+        path += "?" + query
+
+    relay = get_relay()
+    url = relay.robot_url(int(request.match_info["port"]), path)
+    if url is None:
+        raise web.HTTPServiceUnavailable(text="robot is not connected")
+
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": CONTENT_TYPE,
+            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+        }
+    )
+    viewer = _AiohttpViewer(request, response)
+    stream = relay.attach(url, viewer, timeout, profile)
+    try:
+        try:
+            await asyncio.wait_for(asyncio.shield(viewer.done), timeout)
+        except asyncio.TimeoutError:
+            if not viewer.sent:
+                raise web.HTTPGatewayTimeout(text="camera is not responding")
+            await viewer.done
+    finally:
+        relay.detach(stream, viewer)
+        viewer.close()
+        logger.info(
+            "Camera viewer disconnected from %s (sent %d, dropped %d)",
+            url,
+            viewer.sent,
+            viewer.dropped,
+        )
+
+    return response
+
+
+async def camera_stats(request):
+    """
+    aiohttp handler that reports the frame rate and byte counters of each
+    relayed camera as JSON
+    """
+    return web.json_response(
+        {"cameras": get_relay().stats()},
+        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"},
+    )
+
+
+async def networktables_stats(request):
+    """
+    aiohttp handler that reports statistics about the server as JSON, for
+    finding out where time is spent when dashboards fall behind. This
+    includes each websocket's queue depth, traffic, and the time taken by
+    each stage of sending it a frame, the time taken by the NetworkTables
+    listener, the most frequently updated keys, and the relayed cameras.
+    The ``top`` query argument sets how many keys are included.
+    """
+    try:
+        top = int(request.query.get("top", "20"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="top must be an integer")
+
+    return web.json_response(
+        {"hub": get_hub().stats(top), "cameras": get_relay().stats()},
+        headers={"Cache-Control": "no-store, no-cache, must-revalidate, max-age=0"},
+    )
@@ -0,0 +1,206 @@
+"""
+    In-memory copies of the nt2js javascript for production use. Each file
+    is minified, named after a hash of its contents, and compressed once at
+    startup, so requests are answered without touching the disk or
+    compressing anything.
+
+    Minification requires the optional ``rjsmin`` package, and brotli
+    compression requires the optional ``brotli`` package; without them the
+    files are served unminified and with gzip only.
+
+    Browsers only cache the files indefinitely when pages refer to them by
+    their hashed names. :meth:`Assets.rewrite` changes the plain names in a
+    page to the hashed ones, which the production static file handler does
+    for every HTML page it serves.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from os.path import abspath, dirname, join, splitext
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import logging
+
+logger = logging.getLogger("net2js")
+
+__all__ = ["Asset", "Assets", "parse_etags"]
+
+#: Cache-Control for hashed names, whose contents never change
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+
+#: Cache-Control for plain names: the browser keeps a copy, but checks that
+#: it is still current with the ETag before using it
+CACHE_REVALIDATE = "no-cache"
+
+
+def _accepted(accept_encoding):
+    """Returns the set of codings allowed by an Accept-Encoding header"""
+    codings = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+def parse_etags(if_none_match):
+    """
+    Returns the set of entity tags in an If-None-Match header. Weak tags
+    are returned without their ``W/`` prefix, since a 304 only needs a
+    weak match.
+    """
+    return {
+        tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+        for tag in if_none_match.split(",")
+    }
+
+
+class Asset(object):
+    """A static file and its precompressed variants"""
+
+    def __init__(self, name, data, content_type):
+        if rjsmin is not None and name.endswith(".js"):
+            data = rjsmin.jsmin(data.decode("utf-8")).encode("utf-8")
+
+        self.name = name
+        self.content_type = content_type
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+
+        base, ext = splitext(name)
+        self.hashed_name = "%s.%s%s" % (base, self.digest, ext)
+
+        # preferred coding first; only kept when it's actually smaller
+        self.variants = []
+        if brotli is not None:
+            self._add_variant("br", brotli.compress(data), data)
+        self._add_variant("gzip", gzip.compress(data, 9, mtime=0), data)
+        self.variants.append((None, data))
+
+    def _add_variant(self, coding, compressed, data):
+        if len(compressed) < len(data):
+            self.variants.append((coding, compressed))
+
+    def respond(self, hashed, accept_encoding="", if_none_match=""):
+        """
+        Returns the status, headers, and body of a response to a GET
+        request for this asset
+
+        :param hashed: True if the request used the hashed name
+        :param accept_encoding: The request's Accept-Encoding header
+        :param if_none_match: The request's If-None-Match header
+        """
+        accepted = _accepted(accept_encoding) if accept_encoding else ()
+        for coding, body in self.variants:
+            if coding is None or coding in accepted:
+                break
+
+        etag = '"%s%s"' % (self.digest, "-" + coding if coding else "")
+        headers = {
+            "Cache-Control": CACHE_IMMUTABLE if hashed else CACHE_REVALIDATE,
+            "Content-Type": self.content_type,
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+
+        if if_none_match and (
+            etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+        ):
+            return 304, headers, b""
+
+        if coding:
+            headers["Content-Encoding"] = coding
+        return 200, headers, body
+
+
+class Assets(object):
+    """
+    The nt2js static resources, loaded from disk once
+
+    :param path: Directory to load; defaults to the nt2js javascript
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = abspath(join(dirname(__file__), "js"))
+
+        if rjsmin is None:
+            logger.info("rjsmin is not installed, javascript will not be minified")
+
+        self._assets = {}
+        self._hashed_names = {}
+        for name in sorted(os.listdir(path)):
+            content_type = mimetypes.guess_type(name)[0]
+            if content_type is None:
+                continue
+            if content_type.startswith("text/") or content_type.endswith("javascript"):
+                content_type += "; charset=utf-8"
+
+            with open(join(path, name), "rb") as fp:
+                asset = Asset(name, fp.read(), content_type)
+
+            self._assets[name] = (asset, False)
+            self._assets[asset.hashed_name] = (asset, True)
+            self._hashed_names[name] = asset.hashed_name
+
+        #: Changes whenever any asset changes
+        self.digest = hashlib.sha256(
+            " ".join(sorted(self._hashed_names.values())).encode("utf-8")
+        ).hexdigest()[:12]
+
+    def get(self, name):
+        """
+        Returns a tuple of (asset, hashed) for a plain or hashed name, or
+        (None, False) if there is no such asset
+        """
+        return self._assets.get(name, (None, False))
+
+    def url(self, name, prefix="/networktables/"):
+        """
+        Returns the hashed URL of an asset, for pages that are generated by
+        the server and can refer to it directly
+
+        :param name: Plain name of the asset, such as ``networktables.js``
+        """
+        return prefix + self._assets[name][0].hashed_name
+
+    def rewrite(self, html, prefix="/networktables/"):
+        """
+        Returns a page with the URLs of assets changed to their hashed URLs,
+        so that the browser never has to ask for them again. A page
+        rewritten this way must be revalidated when :attr:`digest` changes.
+
+        :param html: The page, as bytes
+        """
+        hashed_names = self._hashed_names
+        if not hashed_names:
+            return html
+        # re caches the compiled pattern
+        pattern = "%s(%s)(?=[\"'?#])" % (
+            re.escape(prefix),
+            "|".join(re.escape(name) for name in hashed_names),
+        )
+        return re.sub(
+            pattern.encode("utf-8"),
+            lambda m: (prefix + hashed_names[m.group(1).decode("utf-8")]).encode(
+                "utf-8"
+            ),
+            html,
+        )
@@ -0,0 +1,625 @@
+import io
+import re
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from networktables import NetworkTables
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import logging
+
+logger = logging.getLogger("net2js")
+
+__all__ = [
+    "CameraRelay",
+    "CameraStream",
+    "CameraViewer",
+    "MjpegParser",
+    "Profile",
+    "get_relay",
+    "split_query",
+]
+
+#: Multipart boundary used in the streams sent to viewers
+BOUNDARY = "nt2jsframe"
+
+#: Content-Type of the streams sent to viewers
+CONTENT_TYPE = "multipart/x-mixed-replace; boundary=" + BOUNDARY
+
+#: Seconds to wait before reconnecting to a camera after an error
+RETRY_DELAY = 1.0
+
+#: Number of threads used to re-encode frames
+ENCODE_THREADS = 2
+
+#: JPEG quality of re-encoded frames if the viewer doesn't ask for one
+DEFAULT_QUALITY = 75
+
+# Discard unparseable data once this much has been buffered
+_MAX_BUFFER = 8 * 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+_warned_pillow = False
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                ENCODE_THREADS, thread_name_prefix="nt2js encode"
+            )
+        return _executor
+
+
+def part_header(length):
+    """Returns the multipart headers that precede a frame sent to a viewer"""
+    return (
+        "--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
+        % (BOUNDARY, length)
+    ).encode("ascii")
+
+
+class Profile(namedtuple("Profile", ["fps", "scale", "quality"])):
+    """
+    How a viewer wants a camera's frames to be sent to it. Each field is
+    None to leave that aspect of the stream unchanged.
+
+    :param fps: Maximum frames per second
+    :param scale: Fraction of the camera's resolution, up to 1
+    :param quality: JPEG quality from 1 to 100
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, fps=None, scale=None, quality=None):
+        if fps is not None:
+            fps = float(fps)
+            if not fps > 0:
+                raise ValueError("fps must be greater than 0")
+        if scale is not None:
+            scale = float(scale)
+            if not 0 < scale <= 1:
+                raise ValueError("scale must be greater than 0 and at most 1")
+            if scale == 1:
+                scale = None
+        if quality is not None:
+            quality = int(quality)
+            if not 1 <= quality <= 100:
+                raise ValueError("quality must be from 1 to 100")
+        return super(Profile, cls).__new__(cls, fps, scale, quality)
+
+    @property
+    def reencode(self):
+        """True if frames must be decoded and encoded again"""
+        return self.scale is not None or self.quality is not None
+
+
+def split_query(query):
+    """
+    Separates a viewer's profile from the query string of a relay request.
+    The ``fps``, ``scale`` and ``quality`` arguments describe the
+    :class:`Profile`, and everything else is passed on to the camera.
+
+    :returns: a tuple of (profile, query for the camera)
+    :raises ValueError: if the profile is invalid
+    """
+    args = parse_qsl(query, keep_blank_values=True)
+    options = {k: v for k, v in args if k in Profile._fields}
+    if not options:
+        return Profile(), query
+    rest = urlencode([(k, v) for k, v in args if k not in Profile._fields])
+    return Profile(**options), rest
+
+
+def reencode(frame, scale=None, quality=None):
+    """Returns a JPEG frame scaled and encoded with the given quality"""
+    image = Image.open(io.BytesIO(frame))
+    if scale is not None:
+        size = (
+            max(1, round(image.width * scale)),
+            max(1, round(image.height * scale)),
+        )
+        # decode at a reduced size, which is much faster for large reductions
+        image.draft("RGB", size)
+        image = image.resize(size, Image.BILINEAR)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality or DEFAULT_QUALITY)
+    return out.getvalue()
+
+
+class MjpegParser(object):
+    """
+    Splits an MJPEG stream (a ``multipart/x-mixed-replace`` response) into
+    JPEG frames. A part ends after its Content-Length if the camera sends
+    one, otherwise at the next boundary.
+    """
+
+    def __init__(self, content_type):
+        """
+        :param content_type: The Content-Type header of the response
+        """
+        m = re.search(r"boundary=\"?([^\";]+)", content_type or "")
+        if m is None:
+            raise ValueError("not an MJPEG stream: %r" % content_type)
+
+        # some cameras include the leading dashes in the parameter
+        boundary = m.group(1).strip()
+        if not boundary.startswith("--"):
+            boundary = "--" + boundary
+        self.boundary = boundary.encode("latin-1")
+
+        self._buf = bytearray()
+        self._length = None
+        self._scanned = 0
+
+    def feed(self, data):
+        """
+        Add data read from the stream
+
+        :returns: a list of the frames that were completed
+        """
+        buf = self._buf
+        buf += data
+        frames = []
+
+        while True:
+            if self._length is None:
+                # find the next part's headers
+                start = buf.find(self.boundary)
+                if start < 0:
+                    del buf[: -len(self.boundary)]
+                    break
+                end = buf.find(b"\r\n\r\n", start)
+                if end < 0:
+                    del buf[:start]
+                    if len(buf) > _MAX_BUFFER:
+                        del buf[:]
+                    break
+
+                headers = bytes(buf[start + len(self.boundary) : end])
+                m = re.search(rb"content-length:\s*(\d+)", headers, re.I)
+                self._length = int(m.group(1)) if m else -1
+                self._scanned = 0
+                del buf[: end + 4]
+
+            if self._length >= 0:
+                if len(buf) < self._length:
+                    break
+                frame = bytes(buf[: self._length])
+                del buf[: self._length]
+            else:
+                end = buf.find(b"\r\n" + self.boundary, self._scanned)
+                if end < 0:
+                    self._scanned = max(len(buf) - len(self.boundary) - 2, 0)
+                    if len(buf) > _MAX_BUFFER:
+                        del buf[:]
+                        self._length = None
+                    break
+                frame = bytes(buf[:end])
+                del buf[: end + 2]
+
+            self._length = None
+            if frame:
+                frames.append(frame)
+
+        return frames
+
+
+class CameraViewer(object):
+    """
+    Sends the frames of a :class:`CameraStream` to a single browser as a
+    multipart response.
+
+    Only the latest frame is kept: if the browser can't keep up, frames that
+    arrive while a write is in progress replace each other instead of being
+    queued, so a slow viewer sees a lower frame rate rather than a growing
+    delay.
+
+    Subclasses must implement :meth:`_call_soon_threadsafe` and
+    :meth:`_write` for their web framework, and may implement
+    :meth:`_on_close`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self._scheduled = False
+        self.closed = False
+
+        #: Number of frames written
+        self.sent = 0
+        #: Number of frames replaced by a newer frame before being written
+        self.dropped = 0
+        #: Number of bytes written
+        self.bytes = 0
+
+    def send(self, frame):
+        """Queue a frame for sending. May be called from any thread."""
+        with self._lock:
+            if self.closed:
+                return
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._call_soon_threadsafe(self._drain)
+
+    def close(self):
+        """Stop sending frames. Must be called on the event loop thread."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._frame = None
+        self._on_close()
+
+    def _drain(self):
+        # Called on the event loop thread
+        while True:
+            with self._lock:
+                frame, self._frame = self._frame, None
+                if frame is None or self.closed:
+                    self._scheduled = False
+                    return
+
+            part = part_header(len(frame)) + frame + b"\r\n"
+            waiter = self._write(part)
+            if self.closed:
+                return
+            self.sent += 1
+            self.bytes += len(part)
+
+            if waiter is not None:
+                waiter.add_done_callback(self._on_write_done)
+                return
+
+    def _on_write_done(self, f):
+        if f.cancelled() or f.exception() is not None:
+            self.close()
+        self._drain()
+
+    def _call_soon_threadsafe(self, callback):
+        """Schedule ``callback`` to run on the event loop thread"""
+        raise NotImplementedError
+
+    def _write(self, data):
+        """
+        Write part of the response. Called on the event loop thread.
+
+        :returns: None if the connection can accept more data immediately,
+                  otherwise a future that completes when it can
+        """
+        raise NotImplementedError
+
+    def _on_close(self):
+        """Called on the event loop thread when the viewer is closed"""
+
+
+class _Feed(object):
+    """
+    The viewers of a stream that share a :class:`Profile`. Frames are
+    dropped to limit the frame rate and re-encoded once for all of the
+    viewers. Only one frame is re-encoded at a time; frames that arrive in
+    the meantime replace each other.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.interval = 1.0 / profile.fps if profile.fps else 0
+        self.viewers = set()
+        self._lock = threading.Lock()
+        self._due = 0
+        self._encoding = False
+        self._pending = None
+
+        #: The most recent frame sent to the viewers
+        self.frame = None
+        #: Number of frames sent to the viewers
+        self.frames = 0
+        #: Number of frames dropped to limit the frame rate
+        self.skipped = 0
+        #: Number of frames replaced while waiting to be re-encoded
+        self.replaced = 0
+        #: Seconds spent re-encoding
+        self.encode_seconds = 0.0
+
+    def offer(self, frame, now):
+        # Called on the camera thread
+        if self.interval:
+            if now < self._due:
+                self.skipped += 1
+                return
+            # keep the average rate, unless the camera fell behind it
+            self._due = max(self._due + self.interval, now + self.interval / 2)
+
+        if not self.profile.reencode or Image is None:
+            self._deliver(frame)
+            return
+
+        with self._lock:
+            if self._encoding:
+                if self._pending is not None:
+                    self.replaced += 1
+                self._pending = frame
+                return
+            self._encoding = True
+        _get_executor().submit(self._encode, frame)
+
+    def _encode(self, frame):
+        # Called on an encoding thread
+        while frame is not None:
+            start = time.perf_counter()
+            try:
+                encoded = reencode(frame, self.profile.scale, self.profile.quality)
+            except Exception as e:
+                logger.warning("Could not re-encode camera frame: %s", e)
+            else:
+                self.encode_seconds += time.perf_counter() - start
+                self._deliver(encoded)
+
+            with self._lock:
+                frame, self._pending = self._pending, None
+                if frame is None:
+                    self._encoding = False
+
+    def _deliver(self, frame):
+        with self._lock:
+            self.frame = frame
+            self.frames += 1
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            viewer.send(frame)
+
+    def stats(self):
+        with self._lock:
+            viewers = list(self.viewers)
+        return {
+            "fps": self.profile.fps,
+            "scale": self.profile.scale,
+            "quality": self.profile.quality,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "replaced": self.replaced,
+            "encode_ms": round(self.encode_seconds * 1000, 1),
+            "viewers": [
+                {"sent": v.sent, "dropped": v.dropped, "bytes": v.bytes}
+                for v in viewers
+            ],
+        }
+
+
+class CameraStream(object):
+    """
+    A single connection to an MJPEG camera, shared by all of its viewers.
+
+    While any viewers are attached, a thread reads the stream and gives each
+    frame to every viewer. It reconnects if the stream fails, and stops when
+    the last viewer is detached.
+
+    Viewers may ask for a lower frame rate, resolution or quality with a
+    :class:`Profile`. Each distinct profile is processed once, however many
+    viewers use it. Changing the resolution or quality requires Pillow; if
+    it isn't installed, only the frame rate is changed.
+    """
+
+    def __init__(self, url, timeout=5.0):
+        """
+        :param url: URL of the camera's MJPEG stream
+        :param timeout: Seconds to wait when connecting to or reading from
+                        the camera
+        """
+        self.url = url
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._feeds = {}
+        self._thread = None
+        self._fps_start = 0
+        self._fps_frames = 0
+        self._last_frame = 0
+
+        #: The most recent frame, or None
+        self.frame = None
+        #: Frames per second received from the camera
+        self.fps = 0.0
+        #: Number of frames received from the camera
+        self.frames = 0
+        #: Number of bytes received from the camera
+        self.bytes = 0
+        #: Number of times a connection to the camera was made
+        self.connects = 0
+        #: Number of times the connection failed
+        self.errors = 0
+
+    def attach(self, viewer, profile=Profile()):
+        """
+        Start sending frames to a :class:`CameraViewer`, beginning with the
+        most recent frame if there is one
+
+        :param profile: The :class:`Profile` of frames to send to the viewer
+        """
+        global _warned_pillow
+        if profile.reencode and Image is None and not _warned_pillow:
+            _warned_pillow = True
+            logger.warning("Pillow is not installed, camera frames won't be re-encoded")
+
+        with self._lock:
+            feed = self._feeds.get(profile)
+            if feed is None:
+                feed = self._feeds[profile] = _Feed(profile)
+            feed.viewers.add(viewer)
+            frame = feed.frame
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="nt2js camera", daemon=True
+                )
+                self._thread.start()
+        if frame is not None:
+            viewer.send(frame)
+
+    def detach(self, viewer):
+        """
+        Stop sending frames to a viewer
+
+        :returns: True if the stream has no viewers left, and stops
+        """
+        with self._lock:
+            for profile, feed in list(self._feeds.items()):
+                feed.viewers.discard(viewer)
+                if not feed.viewers:
+                    del self._feeds[profile]
+            return not self._feeds
+
+    def stats(self):
+        """Returns a dictionary of statistics about the stream and its viewers"""
+        with self._lock:
+            feeds = list(self._feeds.values())
+            fps = self.fps
+            if time.monotonic() - self._last_frame > 2:
+                fps = 0.0
+        return {
+            "url": self.url,
+            "fps": round(fps, 1),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "connects": self.connects,
+            "errors": self.errors,
+            "profiles": [feed.stats() for feed in feeds],
+        }
+
+    def _run(self):
+        retrying = False
+        while True:
+            with self._lock:
+                if not self._feeds:
+                    self._thread = None
+                    return
+            connects = self.connects
+            try:
+                self._read()
+            except Exception as e:
+                # don't repeat the warning while the camera stays unavailable
+                self.errors += 1
+                if self.connects != connects or not retrying:
+                    logger.warning("Camera %s: %s", self.url, e)
+                else:
+                    logger.debug("Camera %s: %s", self.url, e)
+                retrying = True
+                time.sleep(RETRY_DELAY)
+
+    def _read(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            parser = MjpegParser(response.headers.get("Content-Type"))
+            self.connects += 1
+            logger.info("Connected to camera %s", self.url)
+
+            while True:
+                with self._lock:
+                    if not self._feeds:
+                        return
+                data = response.read1(65536)
+                if not data:
+                    raise EOFError("stream ended")
+                self.bytes += len(data)
+                for frame in parser.feed(data):
+                    self._publish(frame)
+
+    def _publish(self, frame):
+        now = time.monotonic()
+        with self._lock:
+            self.frame = frame
+            self.frames += 1
+            self._last_frame = now
+            self._fps_frames += 1
+            if now - self._fps_start >= 1.0:
+                self.fps = self._fps_frames / (now - self._fps_start)
+                self._fps_start = now
+                self._fps_frames = 0
+            feeds = list(self._feeds.values())
+
+        for feed in feeds:
+            feed.offer(frame, now)
+
+
+class CameraRelay(object):
+    """
+    Process-wide set of camera streams, so that every browser viewing the
+    same camera shares one connection to it.
+
+    Only cameras on the robot can be relayed: a stream is identified by a
+    port and path, and is fetched from the address of the current
+    NetworkTables connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def robot_url(self, port, path):
+        """
+        Returns the URL of ``path`` on ``port`` of the robot, or None if
+        the robot is not connected
+        """
+        host = NetworkTables.getRemoteAddress()
+        if not host:
+            return None
+        return "http://%s:%d/%s" % (host, port, path.lstrip("/"))
+
+    def attach(self, url, viewer, timeout=5.0, profile=Profile()):
+        """
+        Start sending the camera stream at ``url`` to a viewer
+
+        :param profile: The :class:`Profile` of frames to send to the viewer
+
+        :returns: the :class:`CameraStream`, which the viewer must be
+                  detached from with :meth:`detach` when it is done
+        """
+        with self._lock:
+            stream = self._streams.get(url)
+            if stream is None:
+                stream = self._streams[url] = CameraStream(url, timeout)
+            stream.attach(viewer, profile)
+        return stream
+
+    def detach(self, stream, viewer):
+        """
+        Stop sending a camera stream to a viewer. The stream is forgotten
+        once it has no viewers, so that streams that are no longer watched
+        don't accumulate.
+        """
+        with self._lock:
+            if stream.detach(viewer) and self._streams.get(stream.url) is stream:
+                del self._streams[stream.url]
+
+    def stats(self):
+        """Returns a list of the statistics of each stream"""
+        with self._lock:
+            streams = list(self._streams.values())
+        return [stream.stats() for stream in streams]
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def get_relay():
+    """
+    Returns the process-wide :class:`CameraRelay` instance, creating it if
+    needed.
+    """
+    global _relay
+    with _relay_lock:
+        if _relay is None:
+            _relay = CameraRelay()
+        return _relay
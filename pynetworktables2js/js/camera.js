@@ -34,6 +34,13 @@ function $s(elem) {
     :param error_img:   optional image to show when not connected
     :param attrs:       optional attributes to set on svg or img element
     :param nosim:       if true, connect to the webcam in simulation mode
+    :param relay:       if true, view the camera through the pynetworktables2js
+                        server, which only connects to the camera once no
+                        matter how many browsers are viewing it. The camera
+                        must be on the robot, and data_url is not used. May
+                        also be an object with any of fps, scale (0-1) and
+                        quality (1-100) to reduce the frame rate, resolution
+                        or JPEG quality of this view.
     
     For example, to connect to mjpg-streamer on the RoboRIO:
     
@@ -175,7 +182,39 @@ function loadCameraOnConnect(args) {
         }
     }
     
+    function tryRelay() {
+        tid = null;
+        if (!NetworkTables.isRobotConnected())
+            return;
+
+        var relay_url = '/networktables/camera/' + (args.port || 80) + args.image_url;
+        if (typeof args.relay === 'object') {
+            relay_url += (relay_url.indexOf('?') < 0 ? '?' : '&') + $.param(args.relay);
+        }
+        if (errors == 0)
+            console.log(dbg + "loading webcam through relay at " + relay_url);
+
+        // the relay responds with an error if the camera isn't available
+        var img = $('<img>', attrs);
+        img.on('load', function() {
+            errors = 0;
+        });
+        img.on('error', function() {
+            if (NetworkTables.isRobotConnected()) {
+                onError();
+                tid = setTimeout(tryRelay, args.timeout);
+            }
+        });
+        img.attr('src', relay_url);
+        set_container(img);
+    }
+    
     function tryConnect() {
+        if (args.relay) {
+            tryRelay();
+            return;
+        }
+
         if (xhr != null) {
             xhr.abort();
             xhr = null;
@@ -161,7 +161,7 @@
 
 							default:
 									let length;
-									if (Array.isArray(value)) {
+									if (Array.isArray(value) || (ArrayBuffer.isView(value) && !(value instanceof Uint8Array) && !(value instanceof DataView))) {
 											length = value.length;
 											writeTypeAndLength(4, length);
 											for (i = 0; i < length; ++i)
@@ -424,26 +424,523 @@
 	window.CBOR = {
 			encode: encode, decode: decode
 	};
-})(window);
+})(self);
 
 
-const NetworkTables = new function () {
+// true when this script has been started as a worker by NetworkTables, see
+// WorkerConnection
+const isWorker = typeof WorkerGlobalScope !== "undefined" && self instanceof WorkerGlobalScope;
+
+// RFC 8746 typed arrays that the server may send: [type, little endian]
+const typedArrayTags = {
+	81: [Float32Array, false],
+	82: [Float64Array, false],
+	85: [Float32Array, true],
+	86: [Float64Array, true],
+};
+const littleEndianHost = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+
+function decodeTag(value, tag) {
+	const info = typedArrayTags[tag];
+	if (info === undefined || !(value instanceof Uint8Array))
+		return value;
+
+	const ArrayType = info[0];
+	const size = ArrayType.BYTES_PER_ELEMENT;
+	const length = value.byteLength / size;
+
+	if (info[1] === littleEndianHost) {
+		// view the received data directly if it is aligned, otherwise
+		// a single copy is needed
+		if (value.byteOffset % size === 0)
+			return new ArrayType(value.buffer, value.byteOffset, length);
+		return new ArrayType(value.slice().buffer);
+	}
+
+	const view = new DataView(value.buffer, value.byteOffset, value.byteLength);
+	const result = new ArrayType(length);
+	for (let i = 0; i < length; ++i) {
+		result[i] = size === 8 ? view.getFloat64(i * 8, info[1]) : view.getFloat32(i * 4, info[1]);
+	}
+	return result;
+}
+
+// returns true if key starts with one of the prefixes, or prefixes is null
+function matchesPrefixes(prefixes, key) {
+	if (prefixes === null)
+		return true;
+	for (const prefix of prefixes) {
+		if (key.startsWith(prefix))
+			return true;
+	}
+	return false;
+}
+
+// splits a key or table into the names of its parent tables and itself
+function splitKey(key) {
+	if (key.endsWith('/'))
+		key = key.slice(0, -1);
+	return key.split('/');
+}
+
+function newTableNode() {
+	return {children: new Map(), listeners: null, hasValue: false};
+}
+
+// removes the values below node, and any tables that have no listeners.
+// Returns true if node itself can be removed
+function pruneTable(node) {
+	node.hasValue = false;
+	node.children.forEach(function(child, name) {
+		if (pruneTable(child))
+			node.children.delete(name);
+	});
+	return node.listeners === null && node.children.size === 0;
+}
+
+function* keysBelow(node, path) {
+	for (const [name, child] of node.children) {
+		const key = path + '/' + name;
+		if (child.hasValue)
+			yield key;
+		yield* keysBelow(child, key);
+	}
+}
+
+/*
+ * A map of keys to values that also indexes the keys as a tree of tables,
+ * so that the keys in a table, and the listeners for the tables containing
+ * a key, can be found without looking at every key. A node of the tree is
+ * a table, and is also a key if it has a value.
+ */
+class NTCache extends Map {
+	constructor() {
+		super();
+		this.root = newTableNode();
+	}
+
+	set(key, value) {
+		if (!this.has(key))
+			this.find(key, true).hasValue = true;
+		return super.set(key, value);
+	}
+
+	delete(key) {
+		if (!super.delete(key))
+			return false;
+		this.find(key, false).hasValue = false;
+		return true;
+	}
+
+	clear() {
+		super.clear();
+		pruneTable(this.root);
+	}
+
+	// returns the node for a key or table, creating it if create is true
+	find(key, create) {
+		let node = this.root;
+		for (const name of splitKey(key)) {
+			let child = node.children.get(name);
+			if (child === undefined) {
+				if (!create)
+					return undefined;
+				child = newTableNode();
+				node.children.set(name, child);
+			}
+			node = child;
+		}
+		return node;
+	}
+
+	// iterates over the keys in a table and its subtables
+	keysIn(table) {
+		const node = this.find(table, false);
+		if (node === undefined)
+			return [][Symbol.iterator]();
+		return keysBelow(node, splitKey(table).join('/'));
+	}
+}
+
+/*
+ * The most recent latency measurements, in milliseconds
+ */
+class LatencySamples {
+	constructor(size) {
+		this.samples = [];
+		this.size = size || 100;
+		this.next = 0;
+		this.last = null;
+	}
+
+	add(ms) {
+		if (this.samples.length < this.size) {
+			this.samples.push(ms);
+		} else {
+			this.samples[this.next] = ms;
+			this.next = (this.next + 1) % this.size;
+		}
+		this.last = ms;
+	}
+
+	summary() {
+		const sorted = this.samples.slice().sort((a, b) => a - b);
+		const n = sorted.length;
+		const at = p => n ? sorted[Math.min(n - 1, Math.floor(p / 100 * n))] : null;
+		return {
+			count: n,
+			last: this.last,
+			mean: n ? sorted.reduce((a, b) => a + b, 0) / n : null,
+			p50: at(50),
+			p99: at(99),
+			max: n ? sorted[n - 1] : null,
+		};
+	}
+}
+
+/*
+ * The websocket connection to the pynetworktables2js server. It keeps the
+ * state needed to understand what the server sends, applies changes to
+ * `cache`, and reports what happened to `events`:
+ *
+ * - socket(open): the websocket opened or closed
+ * - robot(connected, address): the robot connection state changed
+ * - reset(): the cache was emptied
+ * - value(key, value, isNew): a value in the cache changed
+ * - latency(stats): new latency measurements are available
+ *
+ * This runs on the page, or in a worker when data-nt-worker is set. Arrays
+ * of numbers are Float64Arrays if typedArrays is true, and Arrays otherwise.
+ */
+function NTConnection(address, cache, events, typedArrays) {
+
+	let socket = null;
+	let socketOpen = false;
+
+	// key prefixes that the server should send us, or null for everything
+	let subscriptions = null;
+
+	// keys indexed by the integer IDs assigned by the server
+	let keyIds = [];
+
+	// identifies the server's session, and the sequence number of the
+	// newest update received from it
+	let resumeToken = '';
+	let lastSeq = 0;
+
+	// time to wait before reconnecting, which doubles after each attempt
+	// until the server sends something
+	const minReconnectDelay = 300;
+	const maxReconnectDelay = 10000;
+	let reconnectDelay = minReconnectDelay;
+
+	// the server stamps each frame with its clock and how long the frame
+	// waited to be sent; the newest stamp is echoed back periodically, and
+	// the server echoes our clock back so that we can measure the round trip
+	const echoInterval = 1000;
+	let echoTimer = null;
+	let stamp = null;
+	let stampReceived = 0;
+	let frameStamp = null;
+	const rtt = new LatencySamples();
+	const staleness = new LatencySamples();
+
+	// sends a message to the server, returns false if the socket isn't open
+	this.send = function(msg) {
+		if (!socketOpen)
+			return false;
+		socket.send(CBOR.encode(msg));
+		return true;
+	};
+
+	this.subscribe = function(prefixes) {
+		const narrowing = subscriptions === null;
+		if (narrowing)
+			subscriptions = new Set();
+		prefixes.forEach(p => subscriptions.add(p));
+
+		if (narrowing)
+			pruneCache();
+
+		if (!this.send({'s': prefixes}))
+			// the cache is missing the new keys, so don't resume
+			resumeToken = '';
+	};
+
+	this.unsubscribe = function(prefixes) {
+		if (subscriptions === null)
+			return;
+		prefixes.forEach(p => subscriptions.delete(p));
+		pruneCache();
+
+		this.send({'u': prefixes});
+	};
+
+	// asks the server to connect to another robot
+	this.connect = function(robotAddress) {
+		if (!socketOpen)
+			return false;
+
+		cache.clear();
+		events.reset();
+		resumeToken = '';
+		return this.send({'a': robotAddress});
+	};
+
+	// round trip time, and how long values took from being queued on the
+	// server to being handled here, estimated as the time they waited on
+	// the server plus half the round trip and the time taken to decode them
+	this.latencyStats = function() {
+		return {rtt: rtt.summary(), staleness: staleness.summary()};
+	};
+
+	const sendEcho = () => {
+		if (stamp === null)
+			return;
+		const now = performance.now();
+		this.send({'e': [stamp, now - stampReceived, now, staleness.last]});
+		events.latency(this.latencyStats());
+	};
+
+	// closes the socket, which is then reopened
+	this.close = function() {
+		if (socket) {
+			socket.close();
+		}
+	};
+
+	function pruneCache() {
+		cache.forEach(function(v, k) {
+			if (!matchesPrefixes(subscriptions, k))
+				cache.delete(k);
+		});
+	}
+
+	function socketAddress() {
+		// ids: ask the server to send key IDs instead of repeating keys
+		// resume/seq: only send what changed since our last connection
+		// ta: send arrays of numbers as typed arrays
+		// patch: send changes to large arrays as patches
+		// lat: stamp frames with the time they were sent
+		const params = new URLSearchParams({ids: 1, resume: resumeToken, seq: lastSeq, patch: 1, lat: 1});
+		if (typedArrays)
+			params.set('ta', 1);
+		if (subscriptions !== null)
+			subscriptions.forEach(p => params.append('prefix', p));
+		return `${address}?${params}`;
+	}
+
+	// loads the current value of many keys at once
+	function loadSnapshot(values, started) {
+		const keys = Object.keys(values).filter(k => matchesPrefixes(subscriptions, k));
+
+		// update the cache first so listeners see a consistent table
+		for (const key of keys) {
+			cache.set(key, values[key]);
+		}
+		for (const key of keys) {
+			events.value(key, values[key], true);
+		}
+
+		const elapsed = performance.now() - started;
+		console.info(`Loaded snapshot of ${keys.length} keys in ${elapsed.toFixed(1)}ms`);
+	}
+
+	function handleMessage(data, received) {
+		// robot connection event
+		if (data.r !== undefined) {
+			events.robot(data.r, data.a);
+		} else if (data.s !== undefined) {
+			if (data.t !== undefined) {
+				// first snapshot of a connection
+				resumeToken = data.t;
+				if (!data.p) {
+					// a new session, whose sequence numbers start over
+					lastSeq = 0;
+					cache.clear();
+					events.reset();
+				}
+			}
+			loadSnapshot(data.s, received);
+		} else if (data.q !== undefined) {
+			lastSeq = data.q;
+		} else if (data.l !== undefined) {
+			frameStamp = data.l;
+		} else if (data.e !== undefined) {
+			rtt.add(performance.now() - data.e);
+		} else {
+
+			// data changed on websocket. The first update for a key has the
+			// full key, which is assigned the next ID; after that only the
+			// ID is sent
+			let key = data['k'];
+			if (key === undefined) {
+				key = keyIds[data['i']];
+			} else {
+				keyIds.push(key);
+			}
+			let value = data['v'];
+			const isNew = data['n'];
+
+			// may have been sent before the server saw an unsubscribe
+			if (!matchesPrefixes(subscriptions, key))
+				return;
+
+			// a patch of [indices, values, length] against the array we
+			// already have, applied to a copy so that listeners can keep the
+			// old value. Older servers don't send the length
+			if (value === undefined) {
+				const base = cache.get(key);
+				const indices = data['d'][0];
+				const values = data['d'][1];
+				const length = data['d'][2];
+				const isArray = Array.isArray(base) || ArrayBuffer.isView(base);
+				if (!isArray || (length !== undefined && base.length !== length)) {
+					// our copy isn't the array the patch is against, so get
+					// the whole table again
+					console.warn(`NetworkTables: can't patch ${key}, resynchronizing`);
+					resumeToken = '';
+					socket.close();
+					return;
+				}
+				value = base.slice();
+				for (let i = 0; i < indices.length; ++i) {
+					value[indices[i]] = values[i];
+				}
+			}
+
+			cache.set(key, value);
+			events.value(key, value, isNew);
+		}
+	}
+
+	function createSocket() {
+
+		socket = new WebSocket(socketAddress());
+		keyIds = [];
+		if (socket) {
+			socket.binaryType = "arraybuffer";
+			socket.onopen = function() {
+				console.info("Socket opened");
+
+				socketOpen = true;
+				stamp = null;
+				echoTimer = setInterval(sendEcho, echoInterval);
+				events.socket(true);
+			};
+
+			socket.onmessage = function(msg) {
+				const received = performance.now();
+				reconnectDelay = minReconnectDelay;
+				const data = CBOR.decode(msg.data, decodeTag);
+
+				// the server batches messages into an array
+				if (Array.isArray(data)) {
+					for (let i = 0; i < data.length; ++i) {
+						handleMessage(data[i], received);
+					}
+				} else {
+					handleMessage(data, received);
+				}
+
+				if (frameStamp !== null) {
+					stamp = frameStamp[0];
+					stampReceived = received;
+					const roundTrip = rtt.last !== null ? rtt.last : 0;
+					staleness.add(frameStamp[1] + roundTrip / 2 + performance.now() - received);
+					frameStamp = null;
+				}
+			};
+
+			socket.onclose = function() {
+				clearInterval(echoTimer);
+
+				if (socketOpen) {
+					// the cache is kept: when the socket reconnects, the server
+					// only sends what changed while we were disconnected, or
+					// replaces the cache if the session can't be resumed
+					socketOpen = false;
+					console.info("Socket closed");
+					events.socket(false);
+				}
+
+				// respawn the websocket. The delay is randomized so that pages
+				// that lost their connection at the same time, such as when
+				// the server restarts, don't all reconnect at the same time
+				setTimeout(createSocket, reconnectDelay * (0.5 + Math.random() / 2));
+				reconnectDelay = Math.min(reconnectDelay * 2, maxReconnectDelay);
+			};
+		}
+	}
+
+	this.start = createSocket;
+}
+
+/*
+ * Runs an NTConnection in a worker, so that the websocket and decoding don't
+ * compete with the page for the main thread. The worker posts batches of
+ * changes, with only the latest value of each key, which are passed to
+ * events.values(updates).
+ */
+function WorkerConnection(url, address, events, typedArrays) {
+	const worker = new Worker(url);
+
+	// posted by the worker each time it echoes a latency probe
+	let latencyStats = {rtt: new LatencySamples().summary(), staleness: new LatencySamples().summary()};
+
+	worker.onmessage = function(e) {
+		const msg = e.data;
+		if (msg.v !== undefined) {
+			events.values(msg.v);
+		} else if (msg.o !== undefined) {
+			events.socket(msg.o);
+		} else if (msg.r !== undefined) {
+			events.robot(msg.r, msg.a);
+		} else if (msg.c !== undefined) {
+			events.reset();
+		} else if (msg.l !== undefined) {
+			latencyStats = msg.l;
+		}
+	};
+
+	worker.postMessage({address: address, typedArrays: typedArrays});
+
+	// the page only sends while the socket is open; anything that arrives
+	// after the socket closed is discarded by the worker
+	this.send = function(msg) {
+		worker.postMessage({send: msg});
+		return true;
+	};
+	this.subscribe = p => worker.postMessage({s: p});
+	this.unsubscribe = p => worker.postMessage({u: p});
+	this.connect = function(robotAddress) {
+		worker.postMessage({a: robotAddress});
+		return true;
+	};
+	this.close = () => worker.postMessage({close: true});
+	this.start = () => worker.postMessage({start: true});
+	this.latencyStats = () => latencyStats;
+}
+
+const NetworkTables = isWorker ? null : new function () {
 
 
 	let robotAddress;
 	let robotConnected;
 	let socketOpen;
-	let socket;
 
 	if (!("WebSocket" in window)) {
 		alert("Your browser does not support websockets, this will fail!");
 		return;
 	}
 
+	// must be read while the script is first running
+	const scriptUrl = document.currentScript ? document.currentScript.src : null;
+
 	//
 	// Utility functions
 	//
-	
+
 	/**
 		Creates a new empty map (or hashtable) object and returns it. The map
     	is safe to store NetworkTables keys in.
@@ -451,7 +948,7 @@ const NetworkTables = new function () {
 	this.create_map = function() {
 		return new Map();
 	};
-	
+
 	/**
 		Escapes NetworkTables keys so that they're valid HTML identifiers.
 
@@ -459,7 +956,7 @@ const NetworkTables = new function () {
     	:returns: Escaped value
     */
 	this.keyToId = encodeURIComponent;
-	
+
 	/**
 		Escapes special characters and returns a valid jQuery selector. Useful as
     	NetworkTables does not really put any limits on what keys can be used.
@@ -470,29 +967,40 @@ const NetworkTables = new function () {
 	this.keySelector = function(str) {
 	    return encodeURIComponent(str).replace(/([;&,.+*~':"!^#$%@\[\]()=>|])/g, '\\$1');
 	};
-	
+
 	//
 	// NetworkTables internal variables
 	//
-	
-	
+
+
 	// functions that listen for connection changes
 	const connectionListeners = new Set();
 	const robotConnectionListeners = new Set();
-	
+
 	// functions that listen for everything
 	const globalListeners = new Set();
-	
+
 	// functions that listen for specific keys
 	const keyListeners = new Map();
-	
+
+	// number of functions that listen for tables, which are stored in the
+	// nodes of ntCache
+	let tableListenerCount = 0;
+
 	// contents of everything in NetworkTables that we know about
-	let ntCache = new Map();
-	
+	const ntCache = new NTCache();
+
+	// key prefixes that the server should send us, or null for everything
+	let subscriptions = null;
+
+	function isSubscribed(key) {
+		return matchesPrefixes(subscriptions, key);
+	}
+
 	//
 	// NetworkTables JS API
 	//
-	
+
 	/**
 		Sets a function to be called when the websocket connects/disconnects
 
@@ -504,14 +1012,14 @@ const NetworkTables = new function () {
     */
 	this.addWsConnectionListener = function(f, immediateNotify) {
 		connectionListeners.add(f);
-		
+
 		if (immediateNotify === true) {
 			f(socketOpen);
 		}
 
 		return () => connectionListeners.delete(f);
 	};
-	
+
 	/**
 		Sets a function to be called when the robot connects/disconnects to the
 	    pynetworktables2js server via NetworkTables. It will also be called when
@@ -525,14 +1033,14 @@ const NetworkTables = new function () {
 	*/
 	this.addRobotConnectionListener = function(f, immediateNotify) {
 		robotConnectionListeners.add(f);
-		
+
 		if (immediateNotify === true) {
 			f(robotConnected);
 		}
 
 		return () => robotConnectionListeners.delete(f);
 	};
-	
+
 	/**
 		Set a function that will be called whenever any NetworkTables value is changed
 
@@ -544,7 +1052,7 @@ const NetworkTables = new function () {
     */
 	this.addGlobalListener = function(f, immediateNotify) {
 		globalListeners.add(f);
-		
+
 		if (immediateNotify === true) {
 			ntCache.forEach(function(v, k){
 				f(k, v, true);
@@ -553,7 +1061,7 @@ const NetworkTables = new function () {
 
 		return () => globalListeners.delete(f);
 	};
-	
+
 	/**
 	    Set a function that will be called whenever a value for a particular key is changed in NetworkTables
 
@@ -571,7 +1079,7 @@ const NetworkTables = new function () {
 		} else {
 			listeners.add(f);
 		}
-		
+
 		if (immediateNotify === true) {
 			const v = ntCache.get(key);
 			if (v !== undefined) {
@@ -581,7 +1089,39 @@ const NetworkTables = new function () {
 
 		return () => keyListeners.get(key).delete(f);
 	};
-	
+
+	/**
+	    Set a function that will be called whenever a value in a table, or in
+	    any of its subtables, is changed in NetworkTables. The cost of
+	    notifying table listeners depends on how deeply the key is nested,
+	    not on the number of listeners.
+
+	    :param prefix: The table to listen to, such as ``/SmartDashboard/``
+	    :param f: When a key in the table changes, this function will be called with the following parameters; key: key name
+	              for entry, value: value of entry, isNew: If true, the entry has just been created
+	    :param immediateNotify: If true, the function will be immediately called
+	                            with the current value of all keys in the table
+	 	:returns: a function that will unsubscribe
+	*/
+	this.addPrefixListener = function(prefix, f, immediateNotify) {
+		const node = ntCache.find(prefix, true);
+		if (node.listeners === null)
+			node.listeners = new Set();
+		node.listeners.add(f);
+		tableListenerCount++;
+
+		if (immediateNotify === true) {
+			for (const key of ntCache.keysIn(prefix)) {
+				f(key, ntCache.get(key), true);
+			}
+		}
+
+		return function() {
+			if (node.listeners.delete(f))
+				tableListenerCount--;
+		};
+	};
+
 	/**
 		Returns true/false if key is in NetworkTables
 
@@ -591,20 +1131,26 @@ const NetworkTables = new function () {
 	this.containsKey = function(key) {
 		return ntCache.has(key);
 	};
-	
+
 	/**
-		Returns all the keys in the NetworkTables
-		
+		Returns all the keys in the NetworkTables, or in a table
+
+		:param prefix: If specified, only return keys in this table and its
+		               subtables, such as ``/SmartDashboard/``
+		:returns: an iterator of keys
+
 		.. warning:: This may not return correct results when the websocket is not
                  	 connected
     */
-	this.getKeys = function() {
-		return ntCache.keys();
+	this.getKeys = function(prefix) {
+		if (prefix === undefined)
+			return ntCache.keys();
+		return ntCache.keysIn(prefix);
 	};
-	
+
 	/**
 		Returns the value that the key maps to. If the websocket is not
-	    open, this will always return the default value specified.
+	    open, this returns the last value received before it closed.
 
 	    :param key: A networktables key
 	    :param defaultValue: If the key isn't present in the table, return this instead
@@ -625,12 +1171,12 @@ const NetworkTables = new function () {
 		else
 			return val;
 	};
-	
+
 	// returns null if robot is not connected, string otherwise
 	this.getRobotAddress = function() {
 		return robotAddress;
 	};
-	
+
 	// returns true if robot is connected
 	this.isRobotConnected = function() {
 		return robotConnected;
@@ -643,14 +1189,12 @@ const NetworkTables = new function () {
 
 	// Closes socket and reopens it
 	this.closeSocket = function() {
-		if (socket) {
-			socket.close();
-		}
+		connection.close();
 	};
-	
+
 	/**
 		Sets the value in NetworkTables. If the websocket is not connected, the
-	    value will be discarded.
+	    value is queued and sent when it reconnects (see :func:`setWriteQueue`).
 
 	    :param key: A networktables key
 	    :param value: The value to set (see warnings)
@@ -669,31 +1213,210 @@ const NetworkTables = new function () {
 	                 will be thrown and your robot may crash. You have been warned.
     */
 	this.putValue = function(key, value) {
-		if (!socketOpen)
-			return false;
-		
 		if (value === undefined)
 			throw new Error(key + ": 'undefined' passed to putValue");
 
-		socket.send(CBOR.encode({'k': key, 'v': value}));
-		return true;
+		if (!socketOpen) {
+			queueWrite(key, value);
+			return false;
+		}
+
+		return connection.send({'k': key, 'v': value});
+	};
+
+	/**
+		Sets the value of many keys in NetworkTables at once. They are sent to
+		the server in a single message, which sets all of them before sending
+		them on to the robot together. If the websocket is not connected, the
+		values are queued and sent when it reconnects.
+
+		:param values: An object (or Map) of keys to the values to set
+		:returns: True if the websocket is open, False otherwise
+
+		.. note:: The same warnings as :func:`putValue` apply.
+	*/
+	this.putValues = function(values) {
+		if (values instanceof Map)
+			values = Object.fromEntries(values);
+
+		for (const key in values) {
+			if (values[key] === undefined)
+				throw new Error(key + ": 'undefined' passed to putValues");
+		}
+
+		if (!socketOpen) {
+			for (const key in values) {
+				queueWrite(key, values[key]);
+			}
+			return false;
+		}
+
+		return connection.send({'w': values});
+	};
+
+	/**
+		Configures the queue that holds values put while the websocket is not
+		connected. Only the latest value of each key is kept, and the queue is
+		sent as a single batch when the websocket reconnects. By default,
+		writes are kept for 5 seconds and up to 100 keys are queued.
+
+		:param maxAge: Discard queued writes older than this many
+		               milliseconds. If omitted, writes never expire.
+		:param maxSize: Maximum number of keys to queue; when it is full, the
+		                oldest write is discarded. 0 disables the queue. If
+		                omitted, there is no limit.
+	*/
+	this.setWriteQueue = function(maxAge, maxSize) {
+		writeQueueMaxAge = maxAge === undefined ? Infinity : maxAge;
+		writeQueueMaxSize = maxSize === undefined ? Infinity : maxSize;
+		while (pendingWrites.size > Math.max(writeQueueMaxSize, 0)) {
+			pendingWrites.delete(pendingWrites.keys().next().value);
+		}
+	};
+
+	/**
+		Returns the number of writes waiting for the websocket to reconnect
+	*/
+	this.getPendingWriteCount = function() {
+		expireWrites();
+		return pendingWrites.size;
+	};
+
+	// writes made while the websocket is closed, in the order they were
+	// made, as key -> [value, time]
+	const pendingWrites = new Map();
+	let writeQueueMaxAge = 5000;
+	let writeQueueMaxSize = 100;
+
+	function queueWrite(key, value) {
+		if (writeQueueMaxSize <= 0)
+			return;
+
+		// a newer write replaces the old one, and moves to the end
+		pendingWrites.delete(key);
+		pendingWrites.set(key, [value, performance.now()]);
+		if (pendingWrites.size > writeQueueMaxSize)
+			pendingWrites.delete(pendingWrites.keys().next().value);
+	}
+
+	function expireWrites() {
+		const oldest = performance.now() - writeQueueMaxAge;
+		for (const [key, write] of pendingWrites) {
+			if (write[1] >= oldest)
+				break;
+			pendingWrites.delete(key);
+		}
+	}
+
+	function sendPendingWrites() {
+		expireWrites();
+		if (pendingWrites.size === 0)
+			return;
+
+		const values = {};
+		pendingWrites.forEach((write, key) => values[key] = write[0]);
+		pendingWrites.clear();
+		connection.send({'w': values});
+	}
+
+	/**
+		Only receive keys that start with one of the specified prefixes. By
+		default, every key in NetworkTables is sent to the webpage; once this
+		is called, only keys matching a subscribed prefix are sent. Call this
+		before the page finishes loading to avoid receiving the entire table
+		when the websocket first connects.
+
+		:param prefixes: a key prefix, or an array of key prefixes
+	*/
+	this.subscribe = function(prefixes) {
+		if (typeof prefixes === "string")
+			prefixes = [prefixes];
+
+		const narrowing = subscriptions === null;
+		if (narrowing)
+			subscriptions = new Set();
+		prefixes.forEach(p => subscriptions.add(p));
+
+		if (narrowing)
+			pruneCache();
+
+		connection.subscribe(prefixes);
+	};
+
+	/**
+		Stop receiving keys that start with the specified prefixes. Values for
+		keys that are no longer subscribed to are removed from the cache.
+		This does nothing if subscribe has not been called, because every key
+		is being received.
+
+		:param prefixes: a key prefix, or an array of key prefixes
+	*/
+	this.unsubscribe = function(prefixes) {
+		if (typeof prefixes === "string")
+			prefixes = [prefixes];
+
+		if (subscriptions === null) {
+			console.warn("NetworkTables: ignoring unsubscribe, every key is being received");
+			return;
+		}
+		prefixes.forEach(p => subscriptions.delete(p));
+		pruneCache();
+
+		connection.unsubscribe(prefixes);
+	};
+
+	function pruneCache() {
+		ntCache.forEach(function(v, k) {
+			if (!isSubscribed(k))
+				ntCache.delete(k);
+		});
+	}
+
+	/**
+		Returns measurements of the latency between the server and this page,
+		updated about once a second. Each measurement is summarized over the
+		last 100 samples as ``{count, last, mean, p50, p99, max}`` in
+		milliseconds, with null values until a sample has been taken.
+
+		:returns: ``{rtt, staleness}``
+	*/
+	this.getLatencyStats = function() {
+		return connection.latencyStats();
+	};
+
+	/**
+		Sets whether value listeners are called once per animation frame
+		instead of as soon as each value arrives. Values are still available
+		from getValue immediately.
+
+		:param enabled: If true, listeners are called at most once per key per
+		                frame, with the latest value of the key
+	*/
+	this.setFrameDispatch = function(enabled) {
+		if (enabled) {
+			if (pendingNotifications === null)
+				pendingNotifications = new Map();
+		} else if (pendingNotifications !== null) {
+			// deliver anything still waiting for a frame
+			const pending = pendingNotifications;
+			pendingNotifications = null;
+			pending.forEach((n, key) => dispatchListeners(key, n.value, n.isNew));
+		}
 	};
 
 	/**
 	 * Attempts to connect to another address.
-	 * 
+	 *
 	 * :param address: The NetworkTable server address to connect to
 	 */
 	this.connect = function(address) {
 		if (!socketOpen)
 			return false;
-		
+
 		if (typeof address !== "string")
 			throw new Error("address should be type 'string'");
 
-		ntCache = new Map();
-		socket.send(CBOR.encode({'a': address }));
-		return true;
+		return connection.connect(address);
 	}
 
 	// backwards compatibility; deprecated
@@ -705,79 +1428,218 @@ const NetworkTables = new function () {
 	// construct the websocket URI
 	const loc = window.location;
 	const protocol = "ws:";
-	// If the websocket is being served from a different host allow users 
-	// to add a data-nt-host="" attribute to the script tag loading 
+	// If the websocket is being served from a different host allow users
+	// to add a data-nt-host="" attribute to the script tag loading
 	// Networktables.
 	const ntHostElement = document.querySelector('[data-nt-host]');
 	const host = ntHostElement ? ntHostElement.getAttribute('data-nt-host') : loc.host;
 	const address = `${protocol}//${host}/networktables/ws`;
-	
-	function createSocket() {
-	
-		socket = new WebSocket(address);
-		if (socket) {
-			socket.binaryType = "arraybuffer";
-			socket.onopen = function() {
-				console.info("Socket opened");
-				
-				socketOpen = true;
 
-				connectionListeners.forEach(f => f(true));
-			};
-			
-			socket.onmessage = function(msg) {
-				const data = CBOR.decode(msg.data);
+	// listener notifications waiting for the next animation frame, or null if
+	// listeners are called as soon as values arrive
+	let pendingNotifications = null;
+	let frameRequested = false;
 
-				// robot connection event
-				if (data.r !== undefined) {
-					robotConnected = data.r;
-					robotAddress = data.a;
-					robotConnectionListeners.forEach(f => f(robotConnected))
-				} else {
-				
-					// data changed on websocket
-					const key = data['k'];
-					const value = data['v'];
-					const isNew = data['n'];
-
-					ntCache.set(key, value);
-					
-					// notify global listeners
-					globalListeners.forEach(f => f(key, value, isNew));
-					
-					// notify key-specific listeners
-					const listeners = keyListeners.get(key);
-					if (listeners !== undefined) {
-						listeners.forEach(f => f(key, value, isNew));
-					}
-				}
-			};
-			
-			socket.onclose = function() {
-				
-				if (socketOpen) {
+	function notifyListeners(key, value, isNew) {
+		if (pendingNotifications === null) {
+			dispatchListeners(key, value, isNew);
+			return;
+		}
 
-					connectionListeners.forEach(f => f(false));
+		// only the latest value of a key is delivered, but listeners must
+		// still be told if it was created in the meantime
+		const pending = pendingNotifications.get(key);
+		if (pending !== undefined) {
+			pending.value = value;
+			pending.isNew = pending.isNew || isNew;
+		} else {
+			pendingNotifications.set(key, {value: value, isNew: isNew});
+		}
 
-					robotConnectionListeners.forEach(f => f(false));
-					
-					// clear ntCache, it's no longer valid
-					// TODO: Is this true?
-					ntCache = new Map();
-					
-					socketOpen = false;
-					robotConnected = false;
-					robotAddress = null;
-					console.info("Socket closed");
-				}
-				
-				// respawn the websocket
-				setTimeout(createSocket, 300);
-			};
+		if (!frameRequested) {
+			frameRequested = true;
+			requestAnimationFrame(dispatchPending);
 		}
 	}
-	
-	createSocket();
+
+	function dispatchPending() {
+		frameRequested = false;
+		if (pendingNotifications === null)
+			return;
+		const pending = pendingNotifications;
+		pendingNotifications = new Map();
+		pending.forEach((n, key) => dispatchListeners(key, n.value, n.isNew));
+	}
+
+	function dispatchListeners(key, value, isNew) {
+		// notify global listeners
+		globalListeners.forEach(f => f(key, value, isNew));
+
+		// notify key-specific listeners
+		const listeners = keyListeners.get(key);
+		if (listeners !== undefined) {
+			listeners.forEach(f => f(key, value, isNew));
+		}
+
+		// notify listeners for the tables that contain the key
+		if (tableListenerCount !== 0) {
+			const names = key.split('/');
+			let node = ntCache.root;
+			for (let i = 0; i < names.length - 1; ++i) {
+				node = node.children.get(names[i]);
+				if (node === undefined)
+					break;
+				if (node.listeners !== null)
+					node.listeners.forEach(f => f(key, value, isNew));
+			}
+		}
+	}
+
+	const events = {
+		socket: function(open) {
+			if (open) {
+				socketOpen = true;
+				sendPendingWrites();
+				connectionListeners.forEach(f => f(true));
+			} else {
+				connectionListeners.forEach(f => f(false));
+				robotConnectionListeners.forEach(f => f(false));
+
+				socketOpen = false;
+				robotConnected = false;
+				robotAddress = null;
+			}
+		},
+
+		robot: function(connected, address) {
+			robotConnected = connected;
+			robotAddress = address;
+			robotConnectionListeners.forEach(f => f(robotConnected));
+		},
+
+		reset: function() {
+			ntCache.clear();
+			// values waiting for a frame are from the table that was replaced
+			if (pendingNotifications !== null)
+				pendingNotifications.clear();
+		},
+
+		// the connection has already updated ntCache
+		value: notifyListeners,
+
+		// getLatencyStats asks the connection when it's called
+		latency: function() {},
+
+		// changes from a worker, as [key, value, isNew]
+		values: function(updates) {
+			// update the cache first so listeners see a consistent table
+			for (const update of updates) {
+				ntCache.set(update[0], update[1]);
+			}
+			for (const update of updates) {
+				notifyListeners(update[0], update[1], update[2]);
+			}
+		},
+	};
+
+	// Adding a data-nt-typed-arrays attribute to the script tag loading
+	// NetworkTables asks the server for arrays of numbers as Float64Arrays,
+	// which are faster to decode than Arrays
+	const typedArrays = document.querySelector('[data-nt-typed-arrays]') !== null;
+
+	// Adding a data-nt-worker attribute to the script tag loading
+	// NetworkTables moves the websocket and decoding into a worker
+	let connection;
+	if (document.querySelector('[data-nt-worker]') !== null && typeof Worker !== "undefined" && scriptUrl) {
+		connection = new WorkerConnection(scriptUrl, address, events, typedArrays);
+	} else {
+		connection = new NTConnection(address, ntCache, events, typedArrays);
+	}
+
+	// wait for the page's scripts to run so they can subscribe before
+	// the initial values are sent
+	if (document.readyState === "loading") {
+		document.addEventListener("DOMContentLoaded", connection.start);
+	} else {
+		connection.start();
+	}
 };
 
-window.NetworkTables = NetworkTables;
+if (isWorker) {
+	// Started by WorkerConnection: the page sends the websocket address
+	// first, then commands for the connection
+	let connection = null;
+
+	// changes waiting to be posted to the page, latest value per key
+	let pending = new Map();
+	let scheduled = false;
+
+	const post = function() {
+		scheduled = false;
+		if (pending.size === 0)
+			return;
+		const updates = [];
+		pending.forEach((u, key) => updates.push([key, u.value, u.isNew]));
+		pending = new Map();
+		postMessage({v: updates});
+	};
+
+	const events = {
+		socket: function(open) {
+			post();
+			postMessage({o: open});
+		},
+		robot: function(connected, address) {
+			post();
+			postMessage({r: connected, a: address});
+		},
+		reset: function() {
+			pending.clear();
+			postMessage({c: true});
+		},
+		latency: function(stats) {
+			postMessage({l: stats});
+		},
+		value: function(key, value, isNew) {
+			// posting a view would copy the whole frame it came from
+			if (ArrayBuffer.isView(value) && value.byteLength !== value.buffer.byteLength)
+				value = value.slice();
+
+			const u = pending.get(key);
+			if (u !== undefined) {
+				u.value = value;
+				u.isNew = u.isNew || isNew;
+			} else {
+				pending.set(key, {value: value, isNew: isNew});
+			}
+
+			// messages that have already arrived are handled before this runs,
+			// so their changes are posted together
+			if (!scheduled) {
+				scheduled = true;
+				setTimeout(post, 0);
+			}
+		},
+	};
+
+	self.onmessage = function(e) {
+		const msg = e.data;
+		if (msg.address !== undefined) {
+			connection = new NTConnection(msg.address, new Map(), events, msg.typedArrays);
+		} else if (msg.start !== undefined) {
+			connection.start();
+		} else if (msg.send !== undefined) {
+			connection.send(msg.send);
+		} else if (msg.s !== undefined) {
+			connection.subscribe(msg.s);
+		} else if (msg.u !== undefined) {
+			connection.unsubscribe(msg.u);
+		} else if (msg.a !== undefined) {
+			connection.connect(msg.a);
+		} else if (msg.close !== undefined) {
+			connection.close();
+		}
+	};
+} else {
+	window.NetworkTables = NetworkTables;
+}
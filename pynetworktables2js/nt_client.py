@@ -0,0 +1,487 @@
+import threading
+import time
+
+from ._cbor import (
+    Snapshot,
+    Update,
+    array_header,
+    echo_msg,
+    latency_msg,
+    patchable,
+    seq_msg,
+)
+from .stats import Histogram
+
+import logging
+
+logger = logging.getLogger("net2js")
+
+__all__ = ["NTClient", "CompressionStats"]
+
+#: Queue key used for robot connection state messages
+CONNECTION_KEY = None
+
+#: Queue key used for replies to latency probes
+ECHO_KEY = ("echo",)
+
+
+def client_options(getall):
+    """
+    Converts the query arguments of a websocket request into keyword
+    arguments for :class:`NTClient`. Clients negotiate optional protocol
+    features with these arguments, so older clients that don't send them
+    keep working.
+
+    :param getall: A callable that returns a list of the values given for
+                   a query argument
+    """
+
+    def get(name):
+        values = getall(name)
+        return values[-1] if values else None
+
+    resume = get("resume")
+    if resume is not None:
+        try:
+            resume = resume, int(get("seq"))
+        except (TypeError, ValueError):
+            resume = resume, -1
+
+    return {
+        "prefixes": getall("prefix") or None,
+        "use_ids": get("ids") == "1",
+        "resume": resume,
+        "typed_arrays": get("ta") == "1",
+        "patches": get("patch") == "1",
+        "latency": get("lat") == "1",
+    }
+
+
+class CompressionStats(object):
+    """
+    permessage-deflate statistics for a single websocket. The websocket
+    backends record every message that they compress.
+    """
+
+    def __init__(self, min_size=0):
+        #: Messages smaller than this many bytes are sent uncompressed
+        self.min_size = min_size
+        #: Number of messages compressed
+        self.messages = 0
+        #: Number of messages sent uncompressed because they were too small
+        self.skipped = 0
+        #: Bytes given to the compressor
+        self.bytes_in = 0
+        #: Bytes produced by the compressor
+        self.bytes_out = 0
+        #: Seconds spent compressing
+        self.seconds = 0.0
+
+    @property
+    def ratio(self):
+        """Uncompressed size divided by compressed size"""
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+    def add(self, bytes_in, bytes_out, seconds):
+        self.messages += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.seconds += seconds
+
+    def to_dict(self):
+        return {
+            "messages": self.messages,
+            "skipped": self.skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.ratio, 2),
+            "ms": round(self.seconds * 1000, 1),
+        }
+
+    def __str__(self):
+        return (
+            "compressed %d messages %d -> %d bytes (%.1fx) in %.1fms, %d uncompressed"
+            % (
+                self.messages,
+                self.bytes_in,
+                self.bytes_out,
+                self.ratio,
+                self.seconds * 1000,
+                self.skipped,
+            )
+        )
+
+
+class NTClient(object):
+    """
+    Outbound message queue for a single websocket attached to the
+    :class:`.NTHub`.
+
+    Pending messages are keyed by NetworkTables key, and only the newest
+    message for each key is kept: if a client can't keep up, intermediate
+    values are overwritten instead of piling up in the socket's write
+    buffer.
+
+    Messages may be pushed from any thread, but at most one wakeup of the
+    event loop is outstanding at a time. When the loop runs, everything
+    that is pending is sent as a single frame containing a CBOR array of
+    messages. The queue is only drained while the socket is able to accept
+    more data.
+
+    If the client negotiated key IDs, each key is sent in full the first
+    time and is implicitly assigned the next integer ID, starting at 0.
+    After that, updates for the key carry only the ID.
+
+    Resumable clients are sent a ``{"q": seq}`` message at the end of the
+    first frame, and of each frame after that which contains newer updates,
+    with the hub sequence number of the newest update it contains.
+    Once a client has received that frame, it has every update up to
+    ``seq`` for the keys it is subscribed to.
+
+    If the client supports patches, the last value of each large array
+    sent to it is remembered, and updates to the array that only change a
+    few elements are sent as a patch against that value.
+
+    The time taken by each stage of sending a frame is recorded in
+    histograms: the delay between a push and the event loop starting to
+    drain the queue, rendering the messages, and writing the frame.
+
+    If the client negotiated latency probes, each frame ends with a
+    ``{"l": [stamp, age]}`` message, where ``stamp`` is the server's clock
+    in milliseconds when the frame was sent and ``age`` is how long the
+    oldest message in the frame waited in the queue. The client
+    periodically echoes the newest stamp back (see :meth:`echo`), which
+    gives the round trip time.
+
+    Subclasses must implement :meth:`_call_soon_threadsafe`,
+    :meth:`_call_later` and :meth:`_write` for their web framework.
+    """
+
+    def __init__(
+        self,
+        flush_interval=0,
+        prefixes=None,
+        use_ids=False,
+        resume=None,
+        typed_arrays=False,
+        patches=False,
+        latency=False,
+    ):
+        """
+        :param flush_interval: Minimum time in seconds between frames sent
+                               to this client. Updates that arrive within
+                               the interval are coalesced into the next frame.
+        :param prefixes: Only send keys that start with one of these
+                         prefixes. If None, all keys are sent.
+        :param use_ids: Send integer key IDs instead of repeating keys
+        :param resume: None if the client doesn't support resuming, otherwise
+                       a tuple of (session token, sequence number) from the
+                       client's previous connection. The token is empty if
+                       there was no previous connection.
+        :param typed_arrays: Send arrays of floats as RFC 8746 typed arrays
+        :param patches: Send changes to large arrays as patches
+        :param latency: Stamp each frame with the time it was sent
+        """
+        self.flush_interval = flush_interval or 0
+        self.prefixes = tuple(prefixes) if prefixes is not None else None
+        self._ids = {} if use_ids else None
+        self.resume = resume
+        self.typed_arrays = typed_arrays
+        self._arrays = {} if patches else None
+        # set by reset, the arrays are cleared before the next batch
+        self._forget_arrays = False
+        self.latency = latency
+        self._pending_seq = 0
+        # the first frame always has a sequence number, even if it is still
+        # 0, so that it replaces the one from the client's last session
+        self._sent_seq = -1
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+        self._flush_callbacks = []
+        # number of batches taken from the queue, and written to the socket
+        self._batches_taken = 0
+        self._batches_written = 0
+        self._last_flush = 0
+        self._scheduled_at = 0
+        self._queued_at = 0
+        self._write_start = 0
+        self.closed = False
+
+        #: Number of messages written to the socket
+        self.sent = 0
+        #: Number of websocket frames written to the socket
+        self.frames = 0
+        #: Number of bytes written to the socket, before compression
+        self.bytes = 0
+        #: Number of pending updates that were replaced by a newer value
+        self.overwritten = 0
+        #: Number of pending updates discarded because the socket closed
+        self.dropped = 0
+        #: :class:`CompressionStats` if the socket is compressed, otherwise None
+        self.compression = None
+        #: Delay between a push and the event loop draining the queue
+        self.handoff_time = Histogram()
+        #: Time taken to render the messages in a frame
+        self.encode_time = Histogram()
+        #: Time taken to write a frame, including waiting for the socket
+        self.write_time = Histogram()
+        #: How long the oldest message in each frame waited to be sent
+        self.queue_time = Histogram()
+        #: Round trip time of latency probes
+        self.rtt_time = Histogram()
+        #: Staleness of values reported by the client: the time between a
+        #: value being queued on the server and the client handling it
+        self.staleness_time = Histogram()
+
+    @property
+    def queue_depth(self):
+        """Number of messages waiting to be sent"""
+        return len(self._pending)
+
+    def wants(self, key):
+        """Returns True if the client is subscribed to ``key``"""
+        return self.prefixes is None or key.startswith(self.prefixes)
+
+    def push(self, key, msg, seq=None):
+        """
+        Queue an encoded message for sending. May be called from any thread.
+
+        :param key: NetworkTables key the message is for; a pending message
+                    for the same key is replaced
+        :param msg: encoded message, :class:`.Update` or :class:`.Snapshot`
+        :param seq: hub sequence number of the message, if any
+        """
+        with self._lock:
+            if self.closed:
+                self.dropped += 1
+                return
+            if key in self._pending:
+                self.overwritten += 1
+            elif not self._pending:
+                self._queued_at = time.perf_counter()
+            self._pending[key] = msg
+            if seq is not None:
+                self._pending_seq = seq
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self._scheduled_at = time.perf_counter()
+        self._call_soon_threadsafe(self._drain)
+
+    def stats(self):
+        """Returns a dictionary of statistics about this client"""
+        return {
+            "queue_depth": self.queue_depth,
+            "prefixes": list(self.prefixes) if self.prefixes is not None else None,
+            "sent": self.sent,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "overwritten": self.overwritten,
+            "dropped": self.dropped,
+            "handoff": self.handoff_time.to_dict(),
+            "encode": self.encode_time.to_dict(),
+            "write": self.write_time.to_dict(),
+            "queue": self.queue_time.to_dict(),
+            "rtt": self.rtt_time.to_dict() if self.latency else None,
+            "staleness": self.staleness_time.to_dict() if self.latency else None,
+            "compression": (
+                self.compression.to_dict() if self.compression is not None else None
+            ),
+        }
+
+    def reset(self):
+        """
+        Discard pending messages because the hub replaced its table, which
+        it sends to the client next. Arrays sent before this aren't used
+        for patches. May be called from any thread.
+        """
+        with self._lock:
+            self.overwritten += len(self._pending)
+            self._pending.clear()
+            self._forget_arrays = True
+
+    def echo(self, stamp, held, sent, staleness=None):
+        """
+        Handle a latency probe echoed by the client. Called on the event
+        loop thread.
+
+        :param stamp: The newest frame stamp that the client received
+        :param held: Milliseconds between the client receiving that frame
+                     and sending the echo
+        :param sent: The client's clock when it sent the echo, which is
+                     sent back so that the client can measure the round trip
+        :param staleness: The client's latest estimate of the staleness of
+                          its values in milliseconds, if any
+        """
+        rtt = time.perf_counter() * 1000 - stamp - held
+        if rtt >= 0:
+            self.rtt_time.add(rtt / 1000)
+        if staleness is not None and staleness >= 0:
+            self.staleness_time.add(staleness / 1000)
+        self.push(ECHO_KEY, echo_msg(sent))
+
+    def add_flush_callback(self, callback):
+        """
+        Call ``callback`` on the event loop thread once everything that is
+        currently pending has been written to the socket, or the client is
+        closed. Messages pushed afterwards don't delay the callback. Must be
+        called on the event loop thread.
+        """
+        with self._lock:
+            # the batch that will contain the pending messages, or the batch
+            # being written if nothing is pending
+            batch = self._batches_taken + (1 if self._pending else 0)
+            if batch > self._batches_written and not self.closed:
+                self._flush_callbacks.append((batch, callback))
+                return
+        callback()
+
+    def close(self):
+        """Stop sending messages and discard anything still pending"""
+        with self._lock:
+            self.closed = True
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            callbacks, self._flush_callbacks = self._flush_callbacks, []
+        for _, callback in callbacks:
+            callback()
+
+    def _drain(self):
+        # Called on the event loop thread. Sends everything pending as one
+        # batch, unless the socket's write buffer is full
+        if self._scheduled_at:
+            self.handoff_time.add(time.perf_counter() - self._scheduled_at)
+            self._scheduled_at = 0
+
+        while True:
+            if self.flush_interval:
+                delay = self._last_flush + self.flush_interval - time.monotonic()
+                if delay > 0:
+                    self._call_later(delay, self._drain)
+                    return
+
+            with self._lock:
+                if not self._pending or self.closed:
+                    self._scheduled = False
+                    return
+                msgs = list(self._pending.values())
+                self._pending.clear()
+                self._batches_taken += 1
+                forget_arrays, self._forget_arrays = self._forget_arrays, False
+                seq = self._pending_seq
+                queued_at = self._queued_at
+
+            self._last_flush = time.monotonic()
+
+            if forget_arrays and self._arrays is not None:
+                self._arrays.clear()
+
+            count = len(msgs)
+            start = time.perf_counter()
+            msgs = [self._render(msg) for msg in msgs]
+            if self.resume is not None and seq != self._sent_seq:
+                msgs.append(seq_msg(seq))
+                self._sent_seq = seq
+            now = time.perf_counter()
+            self.queue_time.add(now - queued_at)
+            if self.latency:
+                msgs.append(latency_msg(now * 1000, (now - queued_at) * 1000))
+            frame = array_header(len(msgs)) + b"".join(msgs)
+            self._write_start = time.perf_counter()
+            self.encode_time.add(self._write_start - start)
+
+            waiter = self._write(frame)
+            if self.closed:
+                self.dropped += count
+                return
+            self.sent += count
+            self.frames += 1
+            self.bytes += len(frame)
+
+            if waiter is None:
+                self.write_time.add(time.perf_counter() - self._write_start)
+                self._batch_written()
+            else:
+                # Socket is backed up, resume once the write completes. The
+                # queue stays marked as scheduled so that pushes from other
+                # threads don't start a competing drain
+                waiter.add_done_callback(self._on_write_done)
+                return
+
+    def _batch_written(self):
+        # Called on the event loop thread once a batch has been written, to
+        # call the flush callbacks that were waiting for it
+        with self._lock:
+            self._batches_written += 1
+            written = self._batches_written
+            callbacks = self._flush_callbacks
+            ready = [callback for batch, callback in callbacks if batch <= written]
+            if ready:
+                self._flush_callbacks = [c for c in callbacks if c[0] > written]
+        for callback in ready:
+            callback()
+
+    def _render(self, msg):
+        # Called on the event loop thread, in the order that messages are
+        # sent, so key IDs are assigned and arrays are remembered in the
+        # same order as the client sees them
+        arrays = self._arrays
+        if isinstance(msg, Snapshot):
+            if arrays is not None:
+                for key, value in msg.values.items():
+                    if patchable(value):
+                        arrays[key] = value
+                    else:
+                        # the client no longer has the old array
+                        arrays.pop(key, None)
+            return msg.data
+        elif not isinstance(msg, Update):
+            return msg
+
+        typed = self.typed_arrays
+        key_id = None
+        ids = self._ids
+        if ids is not None:
+            key_id = ids.get(msg.key)
+            if key_id is None:
+                ids[msg.key] = len(ids)
+
+        if arrays is not None:
+            if not patchable(msg.value):
+                arrays.pop(msg.key, None)
+            else:
+                base = arrays.get(msg.key)
+                arrays[msg.key] = msg.value
+                if base is not None and not msg.isNew:
+                    patch = msg.patch(base, key_id, typed)
+                    if patch is not None:
+                        return patch
+
+        return msg.render(key_id, typed)
+
+    def _on_write_done(self, f):
+        self.write_time.add(time.perf_counter() - self._write_start)
+        if f.cancelled() or f.exception() is not None:
+            self.close()
+        else:
+            self._batch_written()
+        self._drain()
+
+    def _call_soon_threadsafe(self, callback):
+        """Schedule ``callback`` to run on the event loop thread"""
+        raise NotImplementedError
+
+    def _call_later(self, delay, callback):
+        """Schedule ``callback`` to run on the event loop after ``delay`` seconds"""
+        raise NotImplementedError
+
+    def _write(self, msg):
+        """
+        Write an encoded message to the socket. Called on the event loop
+        thread.
+
+        :returns: None if the socket can accept more data immediately,
+                  otherwise a future that completes when it can
+        """
+        raise NotImplementedError
@@ -0,0 +1,374 @@
+import threading
+import time
+import uuid
+
+import cbor2
+
+from networktables import NetworkTables
+
+from ._cbor import Snapshot, Update, typed_value
+from .nt_client import CONNECTION_KEY
+from .stats import Histogram, KeyRates
+
+import logging
+
+logger = logging.getLogger("net2js")
+
+__all__ = ["NTHub", "get_hub"]
+
+
+class NTHub(object):
+    """
+    Process-wide NetworkTables listener shared by all websocket clients.
+
+    The hub registers a single global listener with NetworkTables, encodes
+    each change exactly once, and hands the same encoded bytes to every
+    attached client. It also keeps a cache of the current value of every
+    key, which is used to bring newly attached clients up to date.
+
+    Every change is given a sequence number. Together with a session token
+    that identifies the contents of the cache, this allows a client that
+    reconnects to be sent only the entries that changed while it was away.
+
+    The hub also records how long the NetworkTables listener takes to handle
+    each change and how often each key changes, which are reported with the
+    statistics of each client by :meth:`stats`.
+
+    Instead of NetworkTables, the hub can be fed by a :attr:`source`, such
+    as a :class:`.Replay`. A source has ``start(hub)`` and ``stop(hub)``
+    methods that are called instead of adding and removing the
+    NetworkTables listeners, and a ``put(values)`` method that is given the
+    values written by clients. It calls :meth:`update`,
+    :meth:`set_connected` and :meth:`reset` to change what clients see.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._values = {}
+        self._seqs = {}
+        self._seq = 0
+        self._session = uuid.uuid4().hex
+        self._connected = False
+        self._address = None
+        self._is_open = False
+        self._key_rates = KeyRates()
+
+        #: Time taken to handle each change in the NetworkTables listener
+        self.listener_time = Histogram()
+        #: Where values come from instead of NetworkTables, if anything.
+        #: Must be set before the hub is opened, which happens when the
+        #: handlers are created or the first client is attached.
+        self.source = None
+        #: :class:`.Recorder` that every change is written to, if any
+        self.recorder = None
+
+    def attach(self, client):
+        """
+        Attach a client to the hub. The client is immediately sent the
+        current robot connection state and the current value of all keys
+        it is subscribed to, followed by every subsequent change.
+
+        If the client is resuming a session from this hub, it is only sent
+        the values that changed since the last sequence number it saw.
+
+        :param client: The :class:`.NTClient` to send encoded messages to
+        """
+        if not self._is_open:
+            self.open()
+
+        with self._lock:
+            self._clients.add(client)
+            client.push(CONNECTION_KEY, self._encode_connection())
+
+            if client.resume is None:
+                self._send_values(client, client.wants)
+                return
+
+            token, since = client.resume
+            if token == self._session and 0 <= since <= self._seq:
+                seqs = self._seqs
+                wants = lambda key: seqs[key] > since and client.wants(key)
+                self._send_values(client, wants, {"t": token, "p": True})
+            else:
+                self._send_values(client, client.wants, {"t": self._session})
+
+    def detach(self, client):
+        """Stop sending updates to a client previously passed to :meth:`attach`"""
+        with self._lock:
+            self._clients.discard(client)
+
+    def subscribe(self, client, prefixes):
+        """
+        Add key prefixes to a client's subscriptions. The client is sent the
+        current value of any keys that it was not already subscribed to.
+
+        A client that was receiving all keys only receives keys matching
+        ``prefixes`` afterwards.
+        """
+        with self._lock:
+            old = client.prefixes
+            if old is None:
+                # already has everything, just stop sending the rest
+                client.prefixes = tuple(prefixes)
+                return
+            new = tuple(p for p in prefixes if p not in old)
+            client.prefixes = old + new
+            self._send_values(
+                client, lambda key: key.startswith(new) and not key.startswith(old)
+            )
+
+    def unsubscribe(self, client, prefixes):
+        """
+        Remove key prefixes from a client's subscriptions. A client that is
+        receiving all keys isn't subscribed to any prefix, so this is
+        ignored; it would otherwise stop receiving anything at all.
+        """
+        with self._lock:
+            old = client.prefixes
+            if old is None:
+                logger.warning("Ignoring unsubscribe from a client receiving all keys")
+                return
+            client.prefixes = tuple(p for p in old if p not in prefixes)
+
+    def snapshot(self, keys=None, prefixes=None, unless=None):
+        """
+        Returns the current values of some keys, along with a version that
+        changes whenever one of them changes. The hub is opened if it isn't
+        already, so the first snapshot may be empty.
+
+        :param keys: Only include these keys
+        :param prefixes: Only include keys that start with one of these
+                         prefixes. Every key is included if neither
+                         ``keys`` nor ``prefixes`` is given.
+        :param unless: If the version is still this, the values aren't
+                       copied, and None is returned in their place
+        :returns: a tuple of (version, dictionary of keys to values)
+        """
+        if not self._is_open:
+            self.open()
+
+        with self._lock:
+            seqs = self._seqs
+            if keys is not None:
+                selected = [key for key in keys if key in seqs]
+            elif prefixes is not None:
+                prefixes = tuple(prefixes)
+                selected = [key for key in seqs if key.startswith(prefixes)]
+            else:
+                selected = None
+
+            if selected is None:
+                seq = self._seq
+            else:
+                seq = max((seqs[key] for key in selected), default=0)
+            version = "%s-%d" % (self._session, seq)
+            if version == unless:
+                return version, None
+
+            values = self._values
+            if selected is None:
+                return version, dict(values)
+            return version, {key: values[key] for key in selected}
+
+    def stats(self, top=20):
+        """
+        Returns a dictionary of statistics about the hub and its clients
+
+        :param top: Number of the most frequently updated keys to include
+        """
+        with self._lock:
+            clients = list(self._clients)
+            rates = self._key_rates.rates(time.perf_counter())
+            stats = {
+                "robot_connected": self._connected,
+                "keys": len(self._values),
+                "seq": self._seq,
+                "listener": self.listener_time.to_dict(),
+            }
+
+        hottest = sorted(rates.items(), key=lambda item: item[1], reverse=True)
+        stats["updates_per_sec"] = round(sum(rates.values()), 1)
+        stats["hottest"] = [
+            {"key": key, "per_sec": round(rate, 1)} for key, rate in hottest[:top]
+        ]
+        stats["clients"] = [client.stats() for client in clients]
+
+        # latency of all the clients combined, to alert on
+        rtt = Histogram()
+        staleness = Histogram()
+        for client in clients:
+            if client.latency:
+                rtt.merge(client.rtt_time)
+                staleness.merge(client.staleness_time)
+        stats["latency"] = {"rtt": rtt.to_dict(), "staleness": staleness.to_dict()}
+        return stats
+
+    def process_update(self, update, client=None):
+        """
+        Process an incoming update from a remote client
+
+        :param client: The :class:`.NTClient` the update came from, used for
+                       subscription requests
+        """
+        data = cbor2.loads(update)
+        if "s" in data:
+            if client is not None:
+                self.subscribe(client, data["s"])
+        elif "u" in data:
+            if client is not None:
+                self.unsubscribe(client, data["u"])
+        elif "e" in data:
+            if client is not None and client.latency:
+                client.echo(*data["e"])
+        elif "a" in data:
+            if self.source is not None:
+                logger.warning("Ignoring request to connect to %s", data["a"])
+                return
+            self.close()
+            self._nt_connected(False, None)
+            # every client starts over with the new robot's table
+            self.reset({})
+            NetworkTables.shutdown()
+            NetworkTables.initialize(data["a"])
+            self.open()
+        elif "w" in data:
+            if self.source is not None:
+                self.source.put(data["w"])
+                return
+            # set all of the values before flushing, so that the robot
+            # receives them together
+            for key, value in data["w"].items():
+                NetworkTables.getEntry(key).setValue(value)
+            NetworkTables.flush()
+        elif self.source is not None:
+            self.source.put({data["k"]: data["v"]})
+        else:
+            NetworkTables.getEntry(data["k"]).setValue(data["v"])
+
+    def _send_values(self, client, wants, session=None):
+        # Sends the current value of all keys matching ``wants`` as a single
+        # snapshot message. ``session`` is added to the message for resumable
+        # clients. Must be called with the lock held
+        values = {key: value for key, value in self._values.items() if wants(key)}
+        if values or session:
+            if client.typed_arrays:
+                msg = {"s": {key: typed_value(value) for key, value in values.items()}}
+            else:
+                msg = {"s": values}
+            if session:
+                msg.update(session)
+            # each snapshot is distinct, it must not replace another one
+            snapshot = Snapshot(cbor2.dumps(msg), values)
+            client.push(snapshot, snapshot, self._seq)
+
+    def _broadcast(self, key, msg):
+        # must be called with the lock held
+        for client in self._clients:
+            client.push(key, msg)
+
+    def _encode_connection(self):
+        return cbor2.dumps({"r": self._connected, "a": self._address})
+
+    def update(self, key, value, isNew):
+        """
+        Send a changed value to the clients that are subscribed to it. This
+        is the NetworkTables global listener, and is called by the
+        :attr:`source` if there is one. May be called from any thread.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._values[key] = value
+            self._seqs[key] = seq
+            self._key_rates.add(key, start)
+            if self.recorder is not None:
+                self.recorder.add(key, value, start)
+
+            # only encode the update if someone is subscribed to it
+            update = None
+            for client in self._clients:
+                if client.wants(key):
+                    if update is None:
+                        update = Update(key, value, isNew)
+                    client.push(key, update, seq)
+
+            self.listener_time.add(time.perf_counter() - start)
+
+    _nt_on_change = update
+
+    def set_connected(self, connected, address):
+        """Send the robot connection state to the clients"""
+        with self._lock:
+            self._connected = connected
+            self._address = address
+            self._broadcast(CONNECTION_KEY, self._encode_connection())
+
+    def reset(self, values):
+        """
+        Replace every value in the table, such as when a replay jumps to
+        another time. Clients are sent the new table, and clients that can
+        resume are told to discard the values they have.
+
+        :param values: A dictionary of keys to values
+        """
+        with self._lock:
+            self._seq += 1
+            self._values = dict(values)
+            self._seqs = dict.fromkeys(self._values, self._seq)
+            self._session = uuid.uuid4().hex
+            connection = self._encode_connection()
+            for client in self._clients:
+                # anything pending is older than the new table
+                client.reset()
+                client.push(CONNECTION_KEY, connection)
+                if client.resume is None:
+                    self._send_values(client, client.wants)
+                else:
+                    self._send_values(client, client.wants, {"t": self._session})
+
+    def _nt_connected(self, connected, info):
+        """NetworkTables connection listener callback"""
+        self.set_connected(connected, NetworkTables.getRemoteAddress())
+
+    def open(self):
+        """
+        Add NetworkTables listeners, if they haven't been added already.
+        This is called automatically when the handlers are created and when
+        the first client is attached.
+        """
+        if self._is_open:
+            return
+        self._is_open = True
+        if self.source is not None:
+            self.source.start(self)
+            return
+        NetworkTables.addGlobalListener(self._nt_on_change, immediateNotify=True)
+        NetworkTables.addConnectionListener(self._nt_connected, immediateNotify=True)
+
+    def close(self):
+        """
+        Clean up NetworkTables listeners
+        """
+        self._is_open = False
+        if self.source is not None:
+            self.source.stop(self)
+            return
+        NetworkTables.removeGlobalListener(self._nt_on_change)
+        NetworkTables.removeConnectionListener(self._nt_connected)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """
+    Returns the process-wide :class:`NTHub` instance, creating it if needed.
+    """
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = NTHub()
+        return _hub
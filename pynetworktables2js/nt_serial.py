@@ -1,59 +1,79 @@
+import warnings
+
 import cbor2
 
-from networktables import NetworkTables
+from ._cbor import Snapshot, Update
+from .nt_client import NTClient
+from .nt_hub import get_hub
 
 __all__ = ["NTSerial"]
 
 
+class _SerialClient(NTClient):
+    # Hands each message to the callback as soon as the hub pushes it,
+    # instead of queueing it for an event loop. Snapshots are split into an
+    # update for each key, which is what NTSerial has always sent
+
+    def __init__(self, update_callback):
+        super(_SerialClient, self).__init__()
+        self.update_callback = update_callback
+
+    def push(self, key, msg, seq=None):
+        if self.closed:
+            self.dropped += 1
+            return
+        if isinstance(msg, Snapshot):
+            for k, value in msg.values.items():
+                self.update_callback(cbor2.dumps({"k": k, "v": value, "n": True}))
+                self.sent += 1
+            return
+        if isinstance(msg, Update):
+            msg = msg.render()
+        self.update_callback(msg)
+        self.sent += 1
+
+
 class NTSerial(object):
     """
     A utility class for synchronizing NetworkTables over a serial connection.
+
+    .. warning:: Deprecated. This is a thin wrapper that attaches to the
+                 shared :class:`.NTHub`; new code should attach an
+                 :class:`.NTClient` to :func:`.get_hub` instead.
     """
 
     def __init__(self, update_callback):
         """
         :param update_callback: A callable with signature ```callable(update)``` for processing outgoing updates
-        formatted as strings.
+        formatted as strings. It is called with the hub's lock held, so it
+        must not call back into the hub.
         """
+        warnings.warn(
+            "NTSerial is deprecated, attach an NTClient to the NTHub instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         self.update_callback = update_callback
+        self._client = None
         self.open()
 
     def process_update(self, update):
         """Process an incoming update from a remote NetworkTables"""
-        data = cbor2.loads(update)
-        if "a" in data:
-            self.close()
-            self._nt_connected(False, None)
-            NetworkTables.shutdown()
-            NetworkTables.initialize(data["a"])
-            self.open()
-        else:
-            NetworkTables.getEntry(data["k"]).setValue(data["v"])
-
-    def _send_update(self, data):
-        """Send a NetworkTables update via the stored send_update callback"""
-        if isinstance(data, dict):
-            data = cbor2.dumps(data)
-        self.update_callback(data)
-
-    def _nt_on_change(self, key, value, isNew):
-        """NetworkTables global listener callback"""
-        self._send_update({"k": key, "v": value, "n": isNew})
-
-    # NetworkTables connection listener callbacks
-    def _nt_connected(self, connected, info):
-        self._send_update({"r": connected, "a": NetworkTables.getRemoteAddress()})
+        get_hub().process_update(update, self._client)
 
     def open(self):
         """
-        Add NetworkTables listeners
+        Start receiving updates from the hub
         """
-        NetworkTables.addGlobalListener(self._nt_on_change, immediateNotify=True)
-        NetworkTables.addConnectionListener(self._nt_connected, immediateNotify=True)
+        if self._client is None:
+            self._client = _SerialClient(self.update_callback)
+            get_hub().attach(self._client)
 
     def close(self):
         """
-        Clean up NetworkTables listeners
+        Stop receiving updates from the hub
         """
-        NetworkTables.removeGlobalListener(self._nt_on_change)
-        NetworkTables.removeConnectionListener(self._nt_connected)
+        if self._client is not None:
+            get_hub().detach(self._client)
+            self._client.close()
+            self._client = None
@@ -0,0 +1,457 @@
+import io
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import cbor2
+
+import logging
+
+logger = logging.getLogger("net2js")
+
+__all__ = ["LogReader", "Recorder", "Replay"]
+
+# A log starts with a header holding MAGIC and the wall clock time that the
+# recording started, followed by chunks. Each chunk is a header followed by
+# a zlib compressed payload of CBOR arrays, one for each update:
+#
+#     [microseconds since the chunk started, key or key index, value]
+#
+# A key is written in full the first time it appears in a chunk and is
+# assigned the next index, so each chunk can be decoded on its own.
+# Keyframe chunks hold the value of every key at the time they were
+# written, which lets a reader seek without decoding the whole log. Chunks
+# are only ever appended, and a reader ignores a partially written chunk
+# at the end of the file, so a log can be read while it is being recorded.
+
+MAGIC = b"NT2JSLOG\x01"
+
+_HEADER = struct.Struct(">9sd")
+
+# magic, flags, payload length, number of updates, start and end times in
+# seconds since the recording started
+_CHUNK = struct.Struct(">4sBIIdd")
+_CHUNK_MAGIC = b"NTCK"
+
+#: Flag set on keyframe chunks
+KEYFRAME = 1
+
+#: Information about a chunk found by :class:`LogReader`
+Chunk = namedtuple("Chunk", "offset flags length count start end")
+
+
+class Recorder(object):
+    """
+    Appends NetworkTables updates to a log file. Updates are buffered in
+    memory and handed to a writer thread a chunk at a time, when the chunk
+    is ``chunk_interval`` seconds long or when :meth:`flush` is called. The
+    writer thread encodes, compresses and writes the chunks, so recording
+    an update never waits for the file. Set :attr:`.NTHub.recorder` to
+    record every update that the hub receives.
+    """
+
+    def __init__(self, path, chunk_interval=1.0, keyframe_interval=10.0):
+        """
+        :param path: File to create; an existing file is not overwritten
+        :param chunk_interval: Maximum number of seconds of updates that
+                               are buffered before being written
+        :param keyframe_interval: Seconds between keyframes. Seeking decodes
+                                  at most this much of the log.
+        """
+        self.path = path
+        self.chunk_interval = chunk_interval
+        self.keyframe_interval = keyframe_interval
+        self._file = open(path, "xb")
+        self._file.write(_HEADER.pack(MAGIC, time.time()))
+        self._lock = threading.Lock()
+        self._closed = False
+        self._start = time.perf_counter()
+        self._values = {}
+        self._last_keyframe = 0.0
+        self._new_chunk(0.0)
+
+        #: Number of updates recorded
+        self.updates = 0
+        #: Number of chunks written
+        self.chunks = 0
+        #: Number of bytes written
+        self.bytes = _HEADER.size
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="nt2js recorder", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, key, value, now=None):
+        """
+        Record an update. May be called from any thread.
+
+        :param now: The time of the update, from :func:`time.perf_counter`
+        """
+        if now is None:
+            now = time.perf_counter()
+        with self._lock:
+            if self._closed:
+                return
+            t = now - self._start
+            if t - self._chunk_start >= self.chunk_interval:
+                self._flush(t)
+
+            keys = self._keys
+            index = keys.get(key)
+            if index is None:
+                keys[key] = len(keys)
+                index = key
+            offset = int((t - self._chunk_start) * 1000000)
+            self._records.append((offset, index, value))
+            self._chunk_end = t
+            self._values[key] = value
+            self.updates += 1
+
+    def flush(self):
+        """Write the updates that are buffered. May be called from any thread."""
+        with self._lock:
+            if not self._closed:
+                self._flush(time.perf_counter() - self._start)
+
+    def close(self):
+        """Write the updates that are buffered and close the file"""
+        with self._lock:
+            if self._closed:
+                return
+            self._flush(time.perf_counter() - self._start)
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _new_chunk(self, t):
+        self._keys = {}
+        self._records = []
+        self._chunk_start = t
+        self._chunk_end = t
+
+    def _flush(self, t):
+        # must be called with the lock held. Hands the buffered updates, and
+        # a copy of the table if a keyframe is due, to the writer thread
+        keyframe = None
+        if self._values and t - self._last_keyframe >= self.keyframe_interval:
+            keyframe = dict(self._values)
+            self._last_keyframe = t
+        if self._records or keyframe is not None:
+            self._queue.put(
+                (self._records, self._chunk_start, self._chunk_end, keyframe, t)
+            )
+        self._new_chunk(t)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.chunk_interval)
+            except queue.Empty:
+                # updates stopped, write the chunk once it is old enough
+                with self._lock:
+                    t = time.perf_counter() - self._start
+                    if (
+                        not self._closed
+                        and t - self._chunk_start >= self.chunk_interval
+                    ):
+                        self._flush(t)
+                continue
+            if item is None:
+                break
+            records, start, end, keyframe, t = item
+            try:
+                if records:
+                    self._write(0, [cbor2.dumps(r) for r in records], start, end)
+                if keyframe is not None:
+                    records = [cbor2.dumps([0, k, v]) for k, v in keyframe.items()]
+                    self._write(KEYFRAME, records, t, t)
+                self._file.flush()
+            except OSError:
+                logger.exception("Error writing to %s", self.path)
+        self._file.close()
+
+    def _write(self, flags, records, start, end):
+        # called on the writer thread
+        payload = zlib.compress(b"".join(records))
+        header = _CHUNK.pack(
+            _CHUNK_MAGIC, flags, len(payload), len(records), start, end
+        )
+        self._file.write(header + payload)
+        self.chunks += 1
+        self.bytes += len(header) + len(payload)
+
+
+class LogReader(object):
+    """
+    Reads a log written by :class:`Recorder`. Only the chunk headers are
+    read when the log is opened; updates are decoded as they are needed.
+    """
+
+    def __init__(self, path):
+        """
+        :raises ValueError: if ``path`` isn't a log
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        header = self._file.read(_HEADER.size)
+        if len(header) < _HEADER.size or not header.startswith(MAGIC):
+            self._file.close()
+            raise ValueError("%s is not a pynetworktables2js log" % path)
+
+        #: Wall clock time that the recording started
+        self.started = _HEADER.unpack(header)[1]
+        #: :class:`Chunk` for each chunk in the log, in order
+        self.chunks = []
+        self._end = _HEADER.size
+        self.refresh()
+
+    @property
+    def duration(self):
+        """Seconds from the start of the recording to the last update"""
+        return self.chunks[-1].end if self.chunks else 0.0
+
+    def refresh(self):
+        """
+        Finds chunks that were written since the log was opened or last
+        refreshed, in case it is still being recorded.
+
+        :returns: the number of new chunks
+        """
+        f = self._file
+        size = os.fstat(f.fileno()).st_size
+        found = 0
+        while self._end + _CHUNK.size <= size:
+            f.seek(self._end)
+            magic, flags, length, count, start, end = _CHUNK.unpack(f.read(_CHUNK.size))
+            if magic != _CHUNK_MAGIC:
+                raise ValueError("%s is corrupt at offset %d" % (self.path, self._end))
+            if self._end + _CHUNK.size + length > size:
+                # still being written
+                break
+            self.chunks.append(Chunk(self._end, flags, length, count, start, end))
+            self._end += _CHUNK.size + length
+            found += 1
+        return found
+
+    def read(self, chunk):
+        """Returns a list of the ``(time, key, value)`` updates in a chunk"""
+        self._file.seek(chunk.offset + _CHUNK.size)
+        payload = zlib.decompress(self._file.read(chunk.length))
+        decoder = cbor2.CBORDecoder(io.BytesIO(payload))
+        keys = []
+        updates = []
+        for _ in range(chunk.count):
+            offset, key, value = decoder.decode()
+            if isinstance(key, int):
+                key = keys[key]
+            else:
+                keys.append(key)
+            updates.append((chunk.start + offset / 1000000.0, key, value))
+        return updates
+
+    def values_at(self, t):
+        """
+        Returns a dictionary of the value of every key just before time
+        ``t``, which is the state of the table that the updates from
+        :meth:`updates_from` apply to
+        """
+        chunks = self.chunks
+        values = {}
+        first = 0
+        for i in range(len(chunks) - 1, -1, -1):
+            chunk = chunks[i]
+            if chunk.flags & KEYFRAME and chunk.start <= t:
+                values = {key: value for _, key, value in self.read(chunk)}
+                first = i + 1
+                break
+
+        for chunk in chunks[first:]:
+            if chunk.start > t:
+                break
+            if chunk.flags & KEYFRAME:
+                continue
+            for when, key, value in self.read(chunk):
+                if when >= t:
+                    break
+                values[key] = value
+        return values
+
+    def updates_from(self, t):
+        """
+        Iterates over the ``(time, key, value)`` updates at or after time
+        ``t``. Chunks found by :meth:`refresh` while iterating are included.
+        """
+        chunks = self.chunks
+        i = 0
+        while i < len(chunks):
+            chunk = chunks[i]
+            i += 1
+            if chunk.flags & KEYFRAME or chunk.end < t:
+                continue
+            for update in self.read(chunk):
+                if update[0] >= t:
+                    yield update
+
+    def close(self):
+        self._file.close()
+
+
+class Replay(object):
+    """
+    Feeds the hub from a log written by :class:`Recorder` instead of from
+    NetworkTables, by setting :attr:`.NTHub.source`. Clients see the robot
+    as connected, with the log's path as its address.
+
+    The updates are sent to the hub at the speed they were recorded, or
+    faster. Playback starts when the first client connects, and can be
+    paused, sped up, or moved to another time while it runs. Seeking sends
+    each client the whole table as it was at the new time.
+
+    Clients can't change values while replaying; their writes are ignored.
+    """
+
+    def __init__(self, path, speed=1.0, start=0.0, loop=False):
+        """
+        :param path: The log to replay
+        :param speed: Play back this many times faster than recorded. 0
+                      sends the updates as fast as possible.
+        :param start: Seconds into the log to start at
+        :param loop: Start over from the beginning at the end of the log
+        :raises ValueError: if ``path`` isn't a log, or an argument is invalid
+        """
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._seek = None
+        self._position = 0.0
+        self._hub = None
+        self._thread = None
+        self._stopped = False
+
+        self.path = path
+        self.loop = loop
+        self.speed = 1.0
+        self.paused = False
+        self.set_speed(speed)
+        self.seek(start)
+        self.reader = LogReader(path)
+
+        #: Number of updates sent to the hub
+        self.updates = 0
+
+    @property
+    def position(self):
+        """Time in the log of the last update sent, in seconds"""
+        return self._position
+
+    def seek(self, position):
+        """Continue playing from ``position`` seconds into the log"""
+        if position < 0:
+            raise ValueError("position must not be negative")
+        with self._lock:
+            self._seek = position
+        self._wake.set()
+
+    def set_speed(self, speed):
+        """Play back ``speed`` times faster than recorded, 0 for no delay"""
+        if speed < 0:
+            raise ValueError("speed must not be negative")
+        self.speed = speed
+        self._wake.set()
+
+    def pause(self, paused=True):
+        self.paused = paused
+        self._wake.set()
+
+    def status(self):
+        """Returns a dictionary describing the replay"""
+        return {
+            "path": self.path,
+            "position": round(self._position, 3),
+            "duration": round(self.reader.duration, 3),
+            "speed": self.speed,
+            "paused": self.paused,
+            "loop": self.loop,
+            "updates": self.updates,
+        }
+
+    def start(self, hub):
+        """Called by the hub when the first client is attached"""
+        self._hub = hub
+        self._stopped = False
+        hub.set_connected(True, self.path)
+        self._thread = threading.Thread(
+            target=self._run, name="nt2js replay", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, hub):
+        self._stopped = True
+        self._wake.set()
+        hub.set_connected(False, None)
+
+    def put(self, values):
+        """Called by the hub with values written by clients"""
+        logger.debug("Ignoring writes to %s while replaying", ", ".join(values))
+
+    def _run(self):
+        hub = self._hub
+        reader = self.reader
+        updates = iter(())
+        known = set()
+        update = None
+
+        while not self._stopped:
+            self._wake.clear()
+            with self._lock:
+                seek, self._seek = self._seek, None
+            if seek is not None:
+                reader.refresh()
+                values = reader.values_at(seek)
+                hub.reset(values)
+                known = set(values)
+                updates = reader.updates_from(seek)
+                update = None
+                self._position = seek
+
+            if self.paused:
+                self._wake.wait()
+                continue
+
+            # play until something changes; times are measured from here
+            speed = self.speed
+            started = time.monotonic()
+            origin = self._position
+
+            while not self._wake.is_set():
+                if update is None:
+                    update = next(updates, None)
+                if update is None:
+                    if reader.refresh():
+                        # the log is still being recorded
+                        position = self._position
+                        updates = reader.updates_from(position)
+                        updates = (u for u in updates if u[0] > position)
+                    elif self.loop:
+                        self.seek(0.0)
+                    else:
+                        self._wake.wait(1.0)
+                        break
+                    continue
+
+                when, key, value = update
+                if speed:
+                    delay = started + (when - origin) / speed - time.monotonic()
+                    if delay > 0 and self._wake.wait(delay):
+                        break
+
+                hub.update(key, value, key not in known)
+                known.add(key)
+                self._position = when
+                self.updates += 1
+                update = None
@@ -0,0 +1,118 @@
+__all__ = ["Histogram", "KeyRates"]
+
+
+class Histogram(object):
+    """
+    Histogram of durations with power of two buckets, cheap enough to update
+    for every message. Bucket ``i`` counts durations shorter than ``2**i``
+    microseconds, so percentiles are accurate to within a factor of two.
+
+    Each histogram should only be added to from one thread at a time; it
+    may be read from any thread.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = int(seconds * 1000000).bit_length()
+        self.counts[min(bucket, self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the contents of another histogram to this one"""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Returns an upper bound of the ``p`` th percentile in seconds, or
+        None if nothing has been added
+        """
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min((1 << i) / 1000000.0, self.max)
+        return self.max
+
+    def to_dict(self):
+        """Returns a summary in milliseconds"""
+
+        def ms(seconds):
+            return round(seconds * 1000, 3) if seconds is not None else None
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max),
+        }
+
+
+class KeyRates(object):
+    """
+    Counts the updates of each key in fixed windows of time. Rates are
+    reported for the last complete window, so they are up to two windows
+    old.
+
+    Not thread safe; callers must serialize access.
+    """
+
+    def __init__(self, window=5.0):
+        """
+        :param window: Length of a window in seconds
+        """
+        self.window = window
+        self._counts = {}
+        self._last = {}
+        self._last_length = window
+        self._start = None
+
+    def add(self, key, now):
+        """
+        Count an update of ``key``
+
+        :param now: The current time, from :func:`time.perf_counter`
+        """
+        if self._start is None:
+            self._start = now
+        elif now - self._start >= self.window:
+            self._roll(now)
+        counts = self._counts
+        counts[key] = counts.get(key, 0) + 1
+
+    def rates(self, now):
+        """Returns a dictionary of keys to updates per second"""
+        if self._start is not None and now - self._start >= self.window:
+            self._roll(now)
+        length = self._last_length
+        return {key: count / length for key, count in self._last.items()}
+
+    def _roll(self, now):
+        if now - self._start >= 2 * self.window:
+            # nothing was counted in the previous window
+            self._last = {}
+        else:
+            self._last = self._counts
+        self._last_length = now - self._start
+        self._counts = {}
+        self._start = now
@@ -1,16 +1,109 @@
 from os.path import abspath, dirname, join
+import time
 
+from tornado import gen
+from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
-from tornado.web import StaticFileHandler
+from tornado.iostream import StreamClosedError
+from tornado.locks import Semaphore
+from tornado.web import HTTPError, RequestHandler, StaticFileHandler
 from tornado.websocket import WebSocketHandler, WebSocketClosedError
 
-from .nt_serial import NTSerial
+from .assets import Assets
+from .camera import CONTENT_TYPE, CameraViewer, get_relay, split_query
+from .nt_client import CompressionStats, NTClient, client_options
+from .nt_hub import get_hub
+from .recording import Replay
+from .values import ValueCache
 
 import logging
 
 logger = logging.getLogger("net2js")
 
-__all__ = ["get_handlers", "NetworkTablesWebSocket", "NonCachingStaticFileHandler"]
+__all__ = [
+    "get_handlers",
+    "AssetHandler",
+    "CameraRelayHandler",
+    "CameraStatsHandler",
+    "NetworkTablesWebSocket",
+    "NonCachingStaticFileHandler",
+    "ReplayHandler",
+    "RevalidatingStaticFileHandler",
+    "StatsHandler",
+    "ValuesHandler",
+]
+
+
+class _MeasuredCompressor(object):
+    """Wraps tornado's permessage-deflate compressor to record statistics"""
+
+    def __init__(self, compressor, stats):
+        self.compressor = compressor
+        self.stats = stats
+
+    def compress(self, data):
+        start = time.perf_counter()
+        compressed = self.compressor.compress(data)
+        self.stats.add(len(data), len(compressed), time.perf_counter() - start)
+        return compressed
+
+
+def _measure_compression(conn, min_size):
+    # tornado has no API for compression statistics or for sending a message
+    # uncompressed, so this wraps its private compressor. If a different
+    # tornado doesn't have one, messages are sent normally without statistics
+    compressor = getattr(conn, "_compressor", None)
+    if not callable(getattr(compressor, "compress", None)):
+        if compressor is not None:
+            logger.debug("Can't measure websocket compression with this tornado")
+        return None
+    stats = CompressionStats(min_size)
+    conn._compressor = _MeasuredCompressor(compressor, stats)
+    return stats
+
+
+class _TornadoClient(NTClient):
+    """NTClient that writes to a tornado websocket"""
+
+    def __init__(self, handler, **options):
+        super(_TornadoClient, self).__init__(**options)
+        self.handler = handler
+        self.ioloop = IOLoop.current()
+
+    def _call_soon_threadsafe(self, callback):
+        self.ioloop.add_callback(callback)
+
+    def _call_later(self, delay, callback):
+        self.ioloop.call_later(delay, callback)
+
+    def _write(self, msg):
+        # permessage-deflate allows any message to be sent uncompressed, but
+        # tornado compresses everything once it's negotiated, so hide the
+        # compressor from it for small messages
+        conn = self.handler.ws_connection
+        compressor = None
+        if (
+            conn is not None
+            and self.compression is not None
+            and len(msg) < self.compression.min_size
+        ):
+            compressor, conn._compressor = conn._compressor, None
+            self.compression.skipped += 1
+
+        try:
+            f = self.handler.write_message(msg, binary=True)
+        except WebSocketClosedError:
+            logger.warning("websocket closed when sending message")
+            self.close()
+            return None
+        finally:
+            if compressor is not None:
+                conn._compressor = compressor
+
+        # only wait if tornado had to buffer the message
+        conn = self.handler.ws_connection
+        if conn is not None and conn.stream.writing():
+            return f
 
 
 class NetworkTablesWebSocket(WebSocketHandler):
@@ -19,12 +112,58 @@ class NetworkTablesWebSocket(WebSocketHandler):
     and a webpage via a websocket
     """
 
-    ntserial = None
+    hub = None
+    client = None
+    _setup_slot = False
+
+    def initialize(
+        self, flush_interval=0, compress=False, compress_min_size=0, setups=None
+    ):
+        """
+        :param flush_interval: Minimum time in seconds between frames sent to
+                               the webpage; updates are coalesced in between
+        :param compress: Use permessage-deflate if the browser supports it
+        :param compress_min_size: Frames smaller than this many bytes are
+                                  sent uncompressed
+        :param setups: A :class:`tornado.locks.Semaphore` shared by all
+                       websockets that limits how many can be set up at once
+        """
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.setups = setups
+
+    async def prepare(self):
+        # Setting up a websocket includes sending it the current state of
+        # NetworkTables, so when many pages connect at once (such as when the
+        # server restarts) make the excess ones wait before the handshake
+        if self.setups is not None:
+            await self.setups.acquire()
+            self._setup_slot = True
+
+    def _end_setup(self):
+        if self._setup_slot:
+            self._setup_slot = False
+            self.setups.release()
+
+    def get_compression_options(self):
+        return {} if self.compress else None
 
     def open(self):
         logger.info("NetworkTables websocket opened")
-        self.ioloop = IOLoop.current()
-        self.ntserial = NTSerial(self.send_msg_threadsafe)
+        self.client = _TornadoClient(
+            self,
+            flush_interval=self.flush_interval,
+            **client_options(self.get_arguments)
+        )
+
+        self.client.compression = _measure_compression(
+            self.ws_connection, self.compress_min_size
+        )
+
+        self.hub = get_hub()
+        self.hub.attach(self.client)
+        self.client.add_flush_callback(self._end_setup)
 
     def check_origin(self, origin):
         """
@@ -33,22 +172,31 @@ class NetworkTablesWebSocket(WebSocketHandler):
         return True
 
     def on_message(self, message):
-        if self.ntserial is not None:
-            self.ntserial.process_update(message)
+        if self.hub is not None:
+            self.hub.process_update(message, self.client)
 
-    def send_msg(self, msg):
-        try:
-            self.write_message(msg, binary=True)
-        except WebSocketClosedError:
-            logger.warning("websocket closed when sending message")
-
-    def send_msg_threadsafe(self, data):
-        self.ioloop.add_callback(self.send_msg, data)
+    def on_finish(self):
+        # Tornado finishes the request after every handshake, successful or
+        # not, before open() is called. Only a failed handshake leaves no
+        # connection to release the setup slot later
+        if self.get_status() != 101:
+            self._end_setup()
 
     def on_close(self):
-        logger.info("NetworkTables websocket closed")
-        if self.ntserial is not None:
-            self.ntserial.close()
+        self._end_setup()
+        if self.hub is not None:
+            self.hub.detach(self.client)
+            self.client.close()
+            logger.info(
+                "NetworkTables websocket closed (sent %d, overwritten %d, dropped %d)",
+                self.client.sent,
+                self.client.overwritten,
+                self.client.dropped,
+            )
+            if self.client.compression is not None:
+                logger.info("NetworkTables websocket %s", self.client.compression)
+        else:
+            logger.info("NetworkTables websocket closed")
 
 
 class NonCachingStaticFileHandler(StaticFileHandler):
@@ -68,12 +216,322 @@ class NonCachingStaticFileHandler(StaticFileHandler):
         )
 
 
-def get_handlers():
+class RevalidatingStaticFileHandler(StaticFileHandler):
+    """
+    This static file handler lets the browser cache files, but makes it
+    check that they haven't changed before each use. Unchanged files cost
+    a request, but aren't sent again.
+
+    If it is given the :class:`.Assets` served by :class:`AssetHandler`,
+    HTML pages refer to the nt2js javascript by its hashed names (see
+    :meth:`.Assets.rewrite`), so the browser never asks for it again.
+    """
+
+    def initialize(self, path, default_filename=None, assets=None):
+        super(RevalidatingStaticFileHandler, self).initialize(path, default_filename)
+        self.assets = assets
+        self._rewritten = None
+
+    def set_extra_headers(self, path):
+        self.set_header("Cache-Control", "no-cache")
+
+    def _rewrites(self):
+        return self.assets is not None and self.absolute_path.endswith(
+            (".html", ".htm")
+        )
+
+    def _get_rewritten(self):
+        if self._rewritten is None:
+            html = b"".join(
+                super(RevalidatingStaticFileHandler, self).get_content(
+                    self.absolute_path
+                )
+            )
+            self._rewritten = self.assets.rewrite(html)
+        return self._rewritten
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        # get_content is overridden for instances, hash the file on disk
+        return StaticFileHandler.get_content_version(abspath)
+
+    def compute_etag(self):
+        # a rewritten page changes when the assets do
+        etag = super(RevalidatingStaticFileHandler, self).compute_etag()
+        if etag is not None and self._rewrites():
+            etag = '"%s-%s"' % (etag.strip('"'), self.assets.digest)
+        return etag
+
+    def get_content_size(self):
+        if self._rewrites():
+            return len(self._get_rewritten())
+        return super(RevalidatingStaticFileHandler, self).get_content_size()
+
+    def get_content(self, abspath, start=None, end=None):
+        if self._rewrites():
+            return self._get_rewritten()[start:end]
+        return super(RevalidatingStaticFileHandler, self).get_content(
+            abspath, start, end
+        )
+
+
+class AssetHandler(RequestHandler):
+    """
+    Serves the nt2js javascript from memory, minified and precompressed.
+    Files requested by their hashed name are cached by the browser
+    indefinitely, and files requested by their plain name are revalidated.
+    """
+
+    def initialize(self, assets):
+        self.assets = assets
+
+    def get(self, name):
+        asset, hashed = self.assets.get(name)
+        if asset is None:
+            raise HTTPError(404)
+
+        status, headers, body = asset.respond(
+            hashed,
+            self.request.headers.get("Accept-Encoding", ""),
+            self.request.headers.get("If-None-Match", ""),
+        )
+        self.set_status(status)
+        for header, value in headers.items():
+            self.set_header(header, value)
+        if body:
+            self.write(body)
+
+
+class _TornadoViewer(CameraViewer):
+    """CameraViewer that writes to a tornado response"""
+
+    def __init__(self, handler):
+        super(_TornadoViewer, self).__init__()
+        self.handler = handler
+        self.ioloop = IOLoop.current()
+        self.done = Future()
+
+    def _call_soon_threadsafe(self, callback):
+        self.ioloop.add_callback(callback)
+
+    def _write(self, data):
+        try:
+            self.handler.write(data)
+            return self.handler.flush()
+        except StreamClosedError:
+            self.close()
+            return None
+
+    def _on_close(self):
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+class CameraRelayHandler(RequestHandler):
+    """
+    Relays an MJPEG stream from a camera on the robot. The URL is the
+    camera's port followed by the path of its stream, so
+    ``/networktables/camera/1181/?action=stream`` relays
+    ``http://<robot>:1181/?action=stream``.
+
+    However many browsers view a camera, only one connection is made to it.
+    Each browser is sent the latest frame whenever it is ready for one, so
+    slow browsers skip frames instead of falling behind.
+
+    The ``fps``, ``scale`` and ``quality`` query arguments reduce the frame
+    rate, resolution and JPEG quality of the frames sent to the browser
+    (see :class:`.Profile`). They are not passed on to the camera.
+    """
+
+    def initialize(self, timeout=5.0):
+        """
+        :param timeout: Seconds to wait for the camera before giving up
+        """
+        self.timeout = timeout
+        self.viewer = None
+
+    async def get(self, port, path):
+        try:
+            profile, query = split_query(self.request.query)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if query:
+            path += "?" + query
+
+        relay = get_relay()
+        url = relay.robot_url(int(port), path)
+        if url is None:
+            raise HTTPError(503, "robot is not connected")
+
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.set_header(
+            "Cache-Control", "no-store, no-cache, must-revalidate, max-age=0"
+        )
+
+        self.viewer = viewer = _TornadoViewer(self)
+        stream = relay.attach(url, viewer, self.timeout, profile)
+        try:
+            try:
+                await gen.with_timeout(
+                    IOLoop.current().time() + self.timeout, viewer.done
+                )
+            except gen.TimeoutError:
+                if not viewer.sent:
+                    viewer.close()
+                    raise HTTPError(504, "camera is not responding")
+                await viewer.done
+        finally:
+            relay.detach(stream, viewer)
+            viewer.close()
+            logger.info(
+                "Camera viewer disconnected from %s (sent %d, dropped %d)",
+                url,
+                viewer.sent,
+                viewer.dropped,
+            )
+
+    def on_connection_close(self):
+        if self.viewer is not None:
+            self.viewer.close()
+
+
+class CameraStatsHandler(RequestHandler):
+    """Reports the frame rate and byte counters of each relayed camera as JSON"""
+
+    def get(self):
+        self.set_header(
+            "Cache-Control", "no-store, no-cache, must-revalidate, max-age=0"
+        )
+        self.write({"cameras": get_relay().stats()})
+
+
+class StatsHandler(RequestHandler):
+    """
+    Reports statistics about the server as JSON, for finding out where time
+    is spent when dashboards fall behind. This includes each websocket's
+    queue depth, traffic, and the time taken by each stage of sending it a
+    frame, the time taken by the NetworkTables listener, the most frequently
+    updated keys, and the relayed cameras. The ``top`` query argument sets
+    how many keys are included.
+    """
+
+    def get(self):
+        try:
+            top = int(self.get_argument("top", "20"))
+        except ValueError:
+            raise HTTPError(400, "top must be an integer")
+
+        self.set_header(
+            "Cache-Control", "no-store, no-cache, must-revalidate, max-age=0"
+        )
+        self.write({"hub": get_hub().stats(top), "cameras": get_relay().stats()})
+
+
+class ValuesHandler(RequestHandler):
+    """
+    Returns the current values of NetworkTables keys as JSON or CBOR, for
+    scripts that poll values instead of opening a websocket. See
+    :meth:`.ValueCache.respond` for the query arguments. Responses have an
+    ETag, so polls of values that haven't changed are answered with a 304.
+    """
+
+    def initialize(self, cache):
+        self.cache = cache
+
+    def get(self):
+        try:
+            status, headers, body = self.cache.respond(
+                self.get_arguments,
+                self.request.headers.get("Accept", ""),
+                self.request.headers.get("If-None-Match", ""),
+            )
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        self.set_status(status)
+        for header, value in headers.items():
+            self.set_header(header, value)
+        if body:
+            self.write(body)
+
+
+class ReplayHandler(RequestHandler):
+    """
+    Controls the replay of a recorded log (see :class:`.Replay`). GET
+    returns the state of the replay as JSON. POST changes it with the
+    optional ``seek`` (seconds into the log), ``speed`` and ``paused``
+    (``1`` or ``0``) arguments, and returns the new state. Responds with 404
+    if the server isn't replaying a log.
+    """
+
+    def prepare(self):
+        self.replay = get_hub().source
+        if not isinstance(self.replay, Replay):
+            raise HTTPError(404)
+        self.set_header(
+            "Cache-Control", "no-store, no-cache, must-revalidate, max-age=0"
+        )
+
+    def get(self):
+        self.write(self.replay.status())
+
+    def post(self):
+        seek = self.get_argument("seek", None)
+        speed = self.get_argument("speed", None)
+        paused = self.get_argument("paused", None)
+        try:
+            if speed is not None:
+                self.replay.set_speed(float(speed))
+            if paused is not None:
+                self.replay.pause(paused == "1")
+            if seek is not None:
+                self.replay.seek(float(seek))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.write(self.replay.status())
+
+
+def get_handlers(
+    flush_interval=0,
+    compress=False,
+    compress_min_size=128,
+    max_setups=4,
+    production=False,
+    camera_timeout=5.0,
+    assets=None,
+):
     """
     Returns a list that can be concatenated to the list of handlers
     passed to the ``tornado.web.Application`` object. This list contains
-    handlers for the NetworkTables websocket and the necessary javascript
-    to use it.
+    handlers for the NetworkTables websocket, the necessary javascript
+    to use it, the current values for scripts that poll them, the camera
+    relay, server statistics, and replay control.
+
+    :param flush_interval: Minimum time in seconds between websocket frames
+                           sent to each client. Updates that arrive within
+                           the interval are coalesced into a single frame,
+                           which bounds CPU and bandwidth used for keys that
+                           change very frequently. 0 sends updates as soon
+                           as possible.
+    :param compress: Compress websocket frames with permessage-deflate when
+                     the browser supports it. This trades CPU time on the
+                     server for bandwidth, which is worthwhile over slow
+                     links such as the field radio.
+    :param compress_min_size: Frames smaller than this many bytes are sent
+                              uncompressed, since compressing them saves
+                              little
+    :param max_setups: Maximum number of websockets that may be in the process
+                       of connecting and receiving the initial state of
+                       NetworkTables at once; others wait their turn. 0 means
+                       no limit.
+    :param production: Serve the nt2js javascript minified, precompressed,
+                       and with caching enabled (see :class:`AssetHandler`),
+                       instead of reading it from disk on each request
+    :param camera_timeout: Seconds to wait for a relayed camera before giving
+                           up (see :class:`CameraRelayHandler`)
+    :param assets: The :class:`.Assets` to serve in production. Pass the same
+                   instance to :class:`RevalidatingStaticFileHandler` so
+                   that your pages use the hashed names.
 
     Example usage::
 
@@ -88,9 +546,35 @@ def get_handlers():
             ])
     """
 
-    js_path_opts = {"path": abspath(join(dirname(__file__), "js"))}
+    ws_opts = {
+        "flush_interval": flush_interval,
+        "compress": compress,
+        "compress_min_size": compress_min_size,
+        "setups": Semaphore(max_setups) if max_setups else None,
+    }
+
+    if production:
+        if assets is None:
+            assets = Assets()
+        js_handler = (AssetHandler, {"assets": assets})
+    else:
+        js_path = abspath(join(dirname(__file__), "js"))
+        js_handler = (NonCachingStaticFileHandler, {"path": js_path})
+
+    # NetworkTables sends the current values asynchronously once the hub is
+    # listening, so start now rather than on the first request for values
+    get_hub().open()
 
     return [
-        ("/networktables/ws", NetworkTablesWebSocket),
-        ("/networktables/(.*)", NonCachingStaticFileHandler, js_path_opts),
+        ("/networktables/ws", NetworkTablesWebSocket, ws_opts),
+        ("/networktables/values", ValuesHandler, {"cache": ValueCache()}),
+        ("/networktables/stats", StatsHandler),
+        ("/networktables/replay", ReplayHandler),
+        ("/networktables/camera/stats", CameraStatsHandler),
+        (
+            r"/networktables/camera/(\d+)/(.*)",
+            CameraRelayHandler,
+            {"timeout": camera_timeout},
+        ),
+        ("/networktables/(.*)",) + js_handler,
     ]
@@ -0,0 +1,119 @@
+"""
+    Answers HTTP requests for the current values in NetworkTables, for
+    scripts that only want to poll a few values now and then instead of
+    keeping a websocket open. Values are read from the hub's cache, and the
+    ETag of a response only changes when one of the values in it changes,
+    so polling values that haven't changed is answered with a 304.
+"""
+
+import base64
+import json
+import threading
+from collections import OrderedDict
+
+import cbor2
+
+from .assets import CACHE_REVALIDATE, parse_etags
+from .nt_hub import get_hub
+
+__all__ = ["ValueCache"]
+
+#: Content type of each format that values can be returned in
+CONTENT_TYPES = {
+    "json": "application/json",
+    "cbor": "application/cbor",
+}
+
+
+def _json_default(value):
+    # raw values are sent as base64
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+def encode(values, fmt):
+    """Returns a dictionary of keys to values encoded as ``fmt``"""
+    if fmt == "cbor":
+        return cbor2.dumps(values)
+    return json.dumps(values, separators=(",", ":"), default=_json_default).encode(
+        "utf-8"
+    )
+
+
+class ValueCache(object):
+    """
+    Encodes responses to requests for values, and keeps the most recently
+    used ones so that polls of values that haven't changed are answered
+    without encoding them again.
+
+    :param size: Number of responses to keep
+    """
+
+    def __init__(self, size=32):
+        self.size = size
+        self._lock = threading.Lock()
+        self._bodies = OrderedDict()
+
+    def respond(self, getall, accept="", if_none_match=""):
+        """
+        Returns the status, headers, and body of a response to a GET request
+        for values. The body is a map of keys to values.
+
+        The ``key`` query argument selects a key, and ``prefix`` selects the
+        keys in a table and its subtables; either may be given more than
+        once. Without them, every key is returned. Keys that don't exist are
+        left out. The values are encoded as CBOR if the ``format`` argument
+        is ``cbor``, or if there is no ``format`` argument and the Accept
+        header allows ``application/cbor``; otherwise they are JSON.
+
+        :param getall: A callable that returns a list of the values given
+                       for a query argument
+        :param accept: The request's Accept header
+        :param if_none_match: The request's If-None-Match header
+        :raises ValueError: if the query arguments are invalid
+        """
+        keys = tuple(getall("key")) or None
+        prefixes = tuple(getall("prefix")) or None
+        if keys and prefixes:
+            raise ValueError("key and prefix can't be used together")
+
+        fmt = getall("format")
+        if fmt:
+            fmt = fmt[-1]
+            if fmt not in CONTENT_TYPES:
+                raise ValueError("format must be json or cbor")
+        else:
+            fmt = "cbor" if CONTENT_TYPES["cbor"] in accept else "json"
+
+        query = (keys, prefixes, fmt)
+        with self._lock:
+            cached = self._bodies.get(query)
+
+        version, values = get_hub().snapshot(
+            keys, prefixes, unless=cached[0] if cached else None
+        )
+        if values is None:
+            body = cached[1]
+        else:
+            body = encode(values, fmt)
+
+        with self._lock:
+            self._bodies[query] = (version, body)
+            self._bodies.move_to_end(query)
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+
+        etag = '"%s-%s"' % (version, fmt)
+        headers = {
+            "Cache-Control": CACHE_REVALIDATE,
+            "Content-Type": CONTENT_TYPES[fmt],
+            "ETag": etag,
+            "Vary": "Accept",
+        }
+
+        if if_none_match and (
+            etag in parse_etags(if_none_match) or if_none_match.strip() == "*"
+        ):
+            return 304, headers, b""
+        return 200, headers, body
@@ -57,6 +57,7 @@ setup(
     include_package_data=True,
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={"production": ["rjsmin", "brotli"]},
     entry_points={
         "console_scripts": ["pynetworktables2js = pynetworktables2js.__main__:main"]
     },
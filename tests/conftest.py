@@ -0,0 +1,56 @@
+import cbor2
+
+from pynetworktables2js._cbor import Snapshot, Update
+from pynetworktables2js.nt_client import NTClient
+
+
+class FakeClient(NTClient):
+    # Queues messages like a real client, but the event loop is run by hand
+    # with run_callbacks and written frames are kept in ``written``
+
+    def __init__(self, **kwargs):
+        super(FakeClient, self).__init__(**kwargs)
+        self.callbacks = []
+        self.written = []
+        self.waiter = None
+
+    def _call_soon_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def _write(self, msg):
+        self.written.append(cbor2.loads(msg))
+        return self.waiter
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for cb in callbacks:
+            cb()
+
+
+class RecordingClient(NTClient):
+    # Keeps every message the hub pushes in ``msgs`` instead of queueing it
+
+    def __init__(self, **kwargs):
+        super(RecordingClient, self).__init__(**kwargs)
+        self.msgs = []
+        self.seq = None
+        self.resets = 0
+
+    def push(self, key, msg, seq=None):
+        self.msgs.append(msg)
+        if seq is not None:
+            self.seq = seq
+
+    def reset(self):
+        self.resets += 1
+
+    def decoded(self):
+        return [cbor2.loads(self.encoded(m)) for m in self.msgs]
+
+    @staticmethod
+    def encoded(msg):
+        if isinstance(msg, Update):
+            return msg.render()
+        elif isinstance(msg, Snapshot):
+            return msg.data
+        return msg
@@ -0,0 +1,85 @@
+import gzip
+
+import pytest
+
+from pynetworktables2js import assets
+from pynetworktables2js.assets import (
+    CACHE_IMMUTABLE,
+    CACHE_REVALIDATE,
+    Assets,
+    parse_etags,
+)
+
+
+@pytest.fixture(params=[False, True])
+def js(request, monkeypatch):
+    # the optional packages may or may not be installed
+    if not request.param:
+        monkeypatch.setattr(assets, "rjsmin", None)
+        monkeypatch.setattr(assets, "brotli", None)
+    return Assets()
+
+
+def test_names(js):
+    asset, hashed = js.get("networktables.js")
+    assert not hashed
+    assert js.get(asset.hashed_name) == (asset, True)
+    assert js.url("networktables.js") == "/networktables/" + asset.hashed_name
+    assert asset.content_type.endswith("javascript; charset=utf-8")
+
+    for name in ("utils.js", "camera.js", "jquery_ext.js"):
+        assert js.get(name)[0] is not None
+    assert js.get("nope.js") == (None, False)
+
+
+def test_respond(js):
+    asset, _ = js.get("networktables.js")
+
+    status, headers, body = asset.respond(False, "gzip, deflate")
+    assert status == 200
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Cache-Control"] == CACHE_REVALIDATE
+    assert b"NetworkTables" in gzip.decompress(body)
+
+    status, headers, plain = asset.respond(True, "gzip;q=0")
+    assert status == 200
+    assert "Content-Encoding" not in headers
+    assert headers["Cache-Control"] == CACHE_IMMUTABLE
+    assert headers["ETag"] == '"%s"' % asset.digest
+    assert gzip.decompress(body) == plain
+
+    if assets.brotli is not None:
+        status, headers, _ = asset.respond(False, "gzip, br")
+        assert headers["Content-Encoding"] == "br"
+
+
+def test_not_modified(js):
+    asset, _ = js.get("utils.js")
+    etag = asset.respond(False, "gzip")[1]["ETag"]
+
+    assert asset.respond(False, "gzip", 'W/"x", ' + etag)[0] == 304
+    assert asset.respond(False, "gzip", "*")[0] == 304
+
+    # each coding is a different representation
+    assert asset.respond(False, "", etag)[0] == 200
+
+
+def test_parse_etags():
+    assert parse_etags('"a", W/"b" ,"c"') == {'"a"', '"b"', '"c"'}
+
+
+def test_rewrite(js):
+    html = (
+        b'<script src="/networktables/networktables.js" data-nt-worker></script>'
+        b"<script src='/networktables/utils.js?v=1'></script>"
+        b'<a href="/networktables/networktables.json">'
+    )
+    assert js.rewrite(html) == (
+        b'<script src="%s" data-nt-worker></script>'
+        b"<script src='%s?v=1'></script>"
+        b'<a href="/networktables/networktables.json">'
+        % (
+            js.url("networktables.js").encode(),
+            js.url("utils.js").encode(),
+        )
+    )
@@ -0,0 +1,213 @@
+import io
+
+from pynetworktables2js import camera
+from pynetworktables2js.camera import (
+    CameraRelay,
+    CameraStream,
+    CameraViewer,
+    MjpegParser,
+    Profile,
+    part_header,
+    split_query,
+)
+
+import pytest
+
+
+class Viewer(CameraViewer):
+    def __init__(self, wait=False):
+        super(Viewer, self).__init__()
+        self.callbacks = []
+        self.written = []
+        self.wait = wait
+        self.waiter = None
+
+    def _call_soon_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def _write(self, data):
+        self.written.append(data)
+        if self.wait:
+            self.waiter = Waiter()
+            return self.waiter
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class Waiter(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def cancelled(self):
+        return False
+
+    def exception(self):
+        return None
+
+    def finish(self):
+        for callback in self.callbacks:
+            callback(self)
+
+
+def mjpeg(frames, length=True):
+    data = b""
+    for frame in frames:
+        data += b"--boundarydonotcross\r\nContent-Type: image/jpeg\r\n"
+        if length:
+            data += b"Content-Length: %d\r\n" % len(frame)
+        data += b"\r\n" + frame + b"\r\n"
+    return data
+
+
+@pytest.mark.parametrize("length", [True, False])
+def test_parser(length):
+    frames = [b"\xff\xd8one\xff\xd9", b"\xff\xd8two\r\n\xff\xd9", b"\xff\xd8three"]
+    data = mjpeg(frames, length)
+
+    parser = MjpegParser("multipart/x-mixed-replace;boundary=boundarydonotcross")
+    assert parser.feed(data) == (frames if length else frames[:2])
+
+    # one byte at a time
+    parser = MjpegParser('multipart/x-mixed-replace; boundary="--boundarydonotcross"')
+    parsed = []
+    for i in range(len(data)):
+        parsed += parser.feed(data[i : i + 1])
+    assert parsed == (frames if length else frames[:2])
+
+    with pytest.raises(ValueError):
+        MjpegParser("image/jpeg")
+
+
+def test_viewer_drops_frames():
+    viewer = Viewer(wait=True)
+    viewer.send(b"a")
+    viewer.run()
+    assert viewer.written == [part_header(1) + b"a\r\n"]
+
+    # frames that arrive while writing replace each other
+    viewer.send(b"b")
+    viewer.send(b"cc")
+    assert viewer.callbacks == []
+    viewer.waiter.finish()
+    assert viewer.written[1] == part_header(2) + b"cc\r\n"
+    assert (viewer.sent, viewer.dropped) == (2, 1)
+
+    viewer.waiter.finish()
+    viewer.close()
+    viewer.send(b"d")
+    assert viewer.callbacks == [] and len(viewer.written) == 2
+
+
+def test_stream_fanout(monkeypatch):
+    stream = CameraStream("http://127.0.0.1:1/")
+    v1, v2 = Viewer(), Viewer()
+
+    # don't connect to anything
+    monkeypatch.setattr(stream, "_thread", object())
+    stream.attach(v1)
+    stream._publish(b"a")
+    stream.attach(v2)
+    v1.run(), v2.run()
+
+    # a new viewer starts with the latest frame
+    assert v1.written == v2.written == [part_header(1) + b"a\r\n"]
+
+    stream.detach(v1)
+    stream._publish(b"b")
+    assert v1.callbacks == [] and len(v2.callbacks) == 1
+
+    stats = stream.stats()
+    assert stats["frames"] == 2
+    assert len(stats["profiles"]) == 1
+    assert len(stats["profiles"][0]["viewers"]) == 1
+
+
+def test_relay_forgets_unwatched_streams(monkeypatch):
+    # don't connect to anything
+    monkeypatch.setattr(CameraStream, "_run", lambda self: None)
+    relay = CameraRelay()
+    v1, v2 = Viewer(), Viewer()
+
+    stream = relay.attach("http://127.0.0.1:1/a", v1)
+    assert relay.attach("http://127.0.0.1:1/a", v2, profile=Profile(fps=5)) is stream
+    relay.detach(stream, v1)
+    assert len(relay.stats()) == 1
+
+    relay.detach(stream, v2)
+    assert relay.stats() == []
+
+    # a new viewer gets a new stream
+    assert relay.attach("http://127.0.0.1:1/a", v1) is not stream
+
+    assert split_query("action=stream") == (Profile(), "action=stream")
+    assert split_query("action=stream&fps=10&scale=0.5") == (
+        Profile(fps=10, scale=0.5),
+        "action=stream",
+    )
+    assert split_query("scale=1") == (Profile(), "")
+
+    for query in ("fps=0", "scale=2", "quality=101", "fps=x"):
+        with pytest.raises(ValueError):
+            split_query(query)
+
+
+def test_profile_fps(monkeypatch):
+    stream = CameraStream("http://127.0.0.1:1/")
+    monkeypatch.setattr(stream, "_thread", object())
+    full, slow = Viewer(), Viewer()
+    stream.attach(full)
+    stream.attach(slow, Profile(fps=10))
+
+    # a 30 fps camera
+    now = [0]
+    monkeypatch.setattr(camera.time, "monotonic", lambda: now[0])
+    for i in range(30):
+        now[0] = i / 30.0
+        stream._publish(b"%d" % i)
+        full.run(), slow.run()
+
+    assert len(full.written) == 30
+    assert len(slow.written) == 10
+    assert stream.stats()["profiles"][1]["skipped"] == 20
+
+
+def test_profile_reencode(monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(out, "JPEG")
+
+    calls = []
+    reencode = camera.reencode
+
+    def counting_reencode(*args):
+        calls.append(args[1:])
+        return reencode(*args)
+
+    monkeypatch.setattr(camera, "reencode", counting_reencode)
+
+    # encode on this thread
+    class Executor(object):
+        def submit(self, f, *args):
+            f(*args)
+
+    monkeypatch.setattr(camera, "_get_executor", Executor)
+
+    stream = CameraStream("http://127.0.0.1:1/")
+    monkeypatch.setattr(stream, "_thread", object())
+    viewers = [Viewer() for _ in range(3)]
+    for viewer in viewers:
+        stream.attach(viewer, Profile(scale=0.5, quality=50))
+    stream._publish(out.getvalue())
+
+    # encoded once for all the viewers
+    assert calls == [(0.5, 50)]
+    for viewer in viewers:
+        viewer.run()
+        frame = viewer.written[0].split(b"\r\n\r\n", 1)[1][:-2]
+        assert Image.open(io.BytesIO(frame)).size == (32, 24)
@@ -0,0 +1,65 @@
+import struct
+
+import cbor2
+
+from pynetworktables2js._cbor import (
+    Update,
+    array_header,
+    diff,
+    header,
+    typed_value,
+)
+
+
+def test_header():
+    for n in (0, 1, 23, 24, 255, 256, 65535, 65536, 2**32):
+        assert header(0, n) == cbor2.dumps(n)
+    assert array_header(3) + b"\x01\x02\x03" == cbor2.dumps([1, 2, 3])
+
+
+def test_update():
+    update = Update("/SmartDashboard/foo", [1.0, 2.0], False)
+    assert cbor2.loads(update.render()) == {
+        "k": "/SmartDashboard/foo",
+        "v": [1.0, 2.0],
+        "n": False,
+    }
+    assert cbor2.loads(update.render(300)) == {
+        "i": 300,
+        "v": [1.0, 2.0],
+        "n": False,
+    }
+
+
+def test_typed_arrays():
+    update = Update("/a", (1.5, -2.0, 3.25), True)
+    tag = cbor2.loads(update.render(typed=True))["v"]
+    assert tag.tag == 86
+    assert struct.unpack("<3d", tag.value) == (1.5, -2.0, 3.25)
+
+    # untyped clients still get a plain array
+    assert cbor2.loads(update.render())["v"] == [1.5, -2.0, 3.25]
+
+    # only non-empty arrays of floats are converted
+    for value in ((), (True, False), ("a",), 1.0, "abc"):
+        assert typed_value(value) is value
+
+
+def test_patch():
+    base = tuple(float(i) for i in range(40))
+    value = base[:3] + (-1.0,) + base[4:39] + (-2.0,)
+    update = Update("/a", value, False)
+
+    assert diff(base, value) == ([3, 39], [-1.0, -2.0])
+    assert cbor2.loads(update.patch(base, 2)) == {
+        "i": 2,
+        "d": [[3, 39], [-1.0, -2.0], 40],
+        "n": False,
+    }
+    tag = cbor2.loads(update.patch(base, typed=True))["d"][1]
+    assert struct.unpack("<2d", tag.value) == (-1.0, -2.0)
+
+    # too many changes, too short, or a different length
+    assert Update("/a", tuple(-x for x in base), False).patch(base) is None
+    assert diff(base[:10], value[:10]) is None
+    assert diff(base, value[:-1]) is None
@@ -0,0 +1,64 @@
+import asyncio
+from unittest import mock
+
+from tornado.websocket import _PerMessageDeflateCompressor
+from aiohttp._websocket.writer import WebSocketWriter
+
+from pynetworktables2js import aiohttp_handlers, tornado_handlers
+
+
+class FakeWebSocket(object):
+    def __init__(self, writer, compress=True):
+        self.compress = compress
+        self._writer = writer
+        self.closed = False
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+class FakeConnection(object):
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+
+def test_measured():
+    # the private attributes exist in the versions that are installed
+    conn = FakeConnection(_PerMessageDeflateCompressor(False, None))
+    stats = tornado_handlers._measure_compression(conn, 10)
+    conn._compressor.compress(b"x" * 100)
+    assert stats.messages == 1 and stats.bytes_in == 100
+
+    writer = WebSocketWriter(mock.Mock(), mock.Mock(), compress=15)
+    stats = aiohttp_handlers._measure_compression(FakeWebSocket(writer), 10)
+    assert stats is not None and stats.min_size == 10
+
+
+def test_fallback():
+    # without them, messages are sent normally and there are no statistics
+    assert tornado_handlers._measure_compression(FakeConnection(None), 10) is None
+    assert tornado_handlers._measure_compression(object(), 10) is None
+    assert aiohttp_handlers._measure_compression(FakeWebSocket(object()), 10) is None
+
+    class Handler(object):
+        ws_connection = mock.Mock(spec=["stream"])
+        ws_connection.stream.writing.return_value = False
+
+        def write_message(self, msg, binary):
+            self.msg = msg
+
+    handler = Handler()
+    with mock.patch.object(tornado_handlers.IOLoop, "current"):
+        client = tornado_handlers._TornadoClient(handler)
+    client._write(b"x")
+    assert handler.msg == b"x"
+
+    async def send():
+        ws = FakeWebSocket(object())
+        client = aiohttp_handlers._AiohttpClient(ws, compress_min_size=10)
+        assert client.compression is None
+        await client._write(b"x")
+        return ws.sent
+
+    assert asyncio.run(send()) == [b"x"]
@@ -0,0 +1,296 @@
+from concurrent.futures import Future
+
+import cbor2
+
+from pynetworktables2js._cbor import Snapshot, Update
+from pynetworktables2js import nt_client
+
+from conftest import FakeClient
+
+
+def test_latest_value_wins():
+    client = FakeClient()
+    client.push("/a", cbor2.dumps(1))
+    client.push("/b", cbor2.dumps(2))
+    client.push("/a", cbor2.dumps(3))
+
+    # only one wakeup is scheduled
+    assert len(client.callbacks) == 1
+    assert client.queue_depth == 2
+
+    client.run_callbacks()
+    assert client.written == [[3, 2]]
+    assert client.overwritten == 1
+    assert client.sent == 2
+    assert client.frames == 1
+    assert client.queue_depth == 0
+
+
+def test_backpressure():
+    client = FakeClient()
+    client.waiter = Future()
+    client.push("/a", cbor2.dumps(1))
+    client.run_callbacks()
+    assert client.written == [[1]]
+
+    # socket is backed up, so nothing is scheduled
+    client.push("/b", cbor2.dumps(2))
+    client.push("/b", cbor2.dumps(3))
+    client.push("/c", cbor2.dumps(4))
+    assert client.callbacks == []
+    assert client.overwritten == 1
+
+    client.waiter, waiter = None, client.waiter
+    waiter.set_result(None)
+    assert client.written == [[1], [3, 4]]
+
+
+def test_close_drops_pending():
+    client = FakeClient()
+    client.push("/a", cbor2.dumps(1))
+    client.close()
+    client.push("/b", cbor2.dumps(2))
+    client.run_callbacks()
+
+    assert client.written == []
+    assert client.dropped == 2
+
+
+def test_flush_interval():
+    client = FakeClient()
+    client.flush_interval = 10
+    later = []
+    client._call_later = lambda delay, cb: later.append(delay)
+
+    client.push("/a", cbor2.dumps(1))
+    client.run_callbacks()
+    assert client.written == [[1]]
+
+    # the next frame waits for the interval, and updates coalesce meanwhile
+    client.push("/a", cbor2.dumps(2))
+    client.push("/a", cbor2.dumps(3))
+    assert len(later) == 1 and 0 < later[0] <= 10
+    assert client.callbacks == []
+    assert client.queue_depth == 1
+
+
+def test_key_ids():
+    client = FakeClient(use_ids=True)
+    client.push("/a", Update("/a", 1.0, True))
+    client.push("/b", Update("/b", 2.0, True))
+    client.run_callbacks()
+    client.push("/b", Update("/b", 3.0, False))
+    client.push("/c", Update("/c", 4.0, True))
+    client.run_callbacks()
+
+    assert client.written == [
+        [{"k": "/a", "v": 1.0, "n": True}, {"k": "/b", "v": 2.0, "n": True}],
+        [{"i": 1, "v": 3.0, "n": False}, {"k": "/c", "v": 4.0, "n": True}],
+    ]
+
+
+def test_key_ids_coalesced_first_update():
+    # an ID is only assigned once the full key has actually been sent
+    client = FakeClient(use_ids=True)
+    client.push("/a", Update("/a", 1.0, True))
+    client.push("/a", Update("/a", 2.0, False))
+    client.run_callbacks()
+
+    assert client.written == [[{"k": "/a", "v": 2.0, "n": False}]]
+
+
+def test_resume_seq():
+    client = FakeClient(resume=("", 0))
+    client.push("/a", Update("/a", 1.0, True), 5)
+    client.push("/b", Update("/b", 2.0, True), 6)
+    client.run_callbacks()
+    client.push(None, cbor2.dumps({"r": True, "a": "x"}))
+    client.run_callbacks()
+
+    assert client.written == [
+        [
+            {"k": "/a", "v": 1.0, "n": True},
+            {"k": "/b", "v": 2.0, "n": True},
+            {"q": 6},
+        ],
+        [{"r": True, "a": "x"}],
+    ]
+
+
+def test_resume_seq_first_frame():
+    # the first frame has a sequence number even if the hub's is still 0,
+    # so the client forgets the one from its previous session
+    client = FakeClient(resume=("old", 12))
+    snapshot = Snapshot(cbor2.dumps({"s": {}, "t": "new"}), {})
+    client.push(snapshot, snapshot, 0)
+    client.run_callbacks()
+
+    assert client.written == [[{"s": {}, "t": "new"}, {"q": 0}]]
+
+
+def test_patches():
+    client = FakeClient(use_ids=True, patches=True)
+    base = tuple(float(i) for i in range(40))
+    value = base[:5] + (0.5,) + base[6:]
+
+    client.push("/a", Update("/a", base, True))
+    client.run_callbacks()
+    client.push("/a", Update("/a", value, False))
+    client.run_callbacks()
+    assert client.written[1] == [{"i": 0, "d": [[5], [0.5], 40], "n": False}]
+
+    # a snapshot replaces the value that patches are made against
+    snapshot = Snapshot(cbor2.dumps({"s": {"/a": base}}), {"/a": base})
+    client.push(snapshot, snapshot)
+    client.push("/a", Update("/a", value, False))
+    client.run_callbacks()
+    assert client.written[2][1] == {"i": 0, "d": [[5], [0.5], 40], "n": False}
+
+    # new entries are always sent in full
+    client.push("/a", Update("/a", base, True))
+    client.run_callbacks()
+    assert client.written[3] == [{"i": 0, "v": list(base), "n": True}]
+
+
+def test_flush_callback():
+    client = FakeClient()
+    flushed = []
+
+    # nothing pending
+    client.add_flush_callback(lambda: flushed.append(1))
+    assert flushed == [1]
+
+    client.waiter = Future()
+    client.push("/a", cbor2.dumps(1))
+    client.add_flush_callback(lambda: flushed.append(2))
+    client.run_callbacks()
+    assert flushed == [1]
+
+    # called once the write completes
+    client.waiter, waiter = None, client.waiter
+    waiter.set_result(None)
+    assert flushed == [1, 2]
+
+    # closing calls any remaining callbacks
+    client.push("/a", cbor2.dumps(2))
+    client.add_flush_callback(lambda: flushed.append(3))
+    client.close()
+    assert flushed == [1, 2, 3]
+
+
+def test_flush_callback_continuous_updates():
+    # with a flush interval and keys that change faster than it, the queue
+    # is never empty, but the callback only waits for what was pending
+    client = FakeClient()
+    client.flush_interval = 10
+    later = []
+    client._call_later = lambda delay, cb: later.append(cb)
+    flushed = []
+
+    client.push(None, cbor2.dumps("connected"))
+    client.add_flush_callback(lambda: flushed.append(1))
+    client.push("/a", cbor2.dumps(1))
+    client.run_callbacks()
+    assert client.written == [["connected", 1]]
+    assert flushed == [1]
+
+    client.push("/a", cbor2.dumps(2))
+    client.add_flush_callback(lambda: flushed.append(2))
+    for i in range(3, 10):
+        client.push("/a", cbor2.dumps(i))
+    assert flushed == [1]
+    client._last_flush = 0
+    later.pop()()
+    assert client.written[-1] == [9]
+    assert flushed == [1, 2]
+
+    # a client that is backed up still calls it once the batch is written
+    client.waiter = Future()
+    client.push("/a", cbor2.dumps(10))
+    client.add_flush_callback(lambda: flushed.append(3))
+    client._last_flush = 0
+    later.pop()()
+    client.push("/a", cbor2.dumps(11))
+    client.add_flush_callback(lambda: flushed.append(4))
+    assert flushed == [1, 2]
+    client.waiter, waiter = None, client.waiter
+    client.flush_interval = 0
+    waiter.set_result(None)
+    assert client.written[-2:] == [[10], [11]]
+    assert flushed == [1, 2, 3, 4]
+
+
+def test_patches_after_shrink():
+    # a value that can't be patched replaces the base, so the next large
+    # array is sent in full rather than patched against the old one
+    client = FakeClient(patches=True)
+    base = tuple(float(i) for i in range(40))
+    value = base[:3] + (99.0,) + base[4:]
+
+    for small in (base[:10], "x"):
+        client.push("/a", Update("/a", base, False))
+        client.run_callbacks()
+        client.push("/a", Update("/a", small, False))
+        client.run_callbacks()
+        client.push("/a", Update("/a", value, False))
+        client.run_callbacks()
+        assert client.written[-1] == [{"k": "/a", "v": list(value), "n": False}]
+
+    snapshot = Snapshot(cbor2.dumps({"s": {"/a": base[:10]}}), {"/a": base[:10]})
+    client.push(snapshot, snapshot)
+    client.run_callbacks()
+    client.push("/a", Update("/a", base, False))
+    client.run_callbacks()
+    assert client.written[-1] == [{"k": "/a", "v": list(base), "n": False}]
+
+
+def test_patches_after_reset():
+    # the client may have dropped its values, so nothing is patched against
+    # an array sent before the reset
+    client = FakeClient(patches=True)
+    base = tuple(float(i) for i in range(40))
+    value = base[:3] + (99.0,) + base[4:]
+
+    client.push("/a", Update("/a", base, False))
+    client.run_callbacks()
+    client.reset()
+    client.push("/a", Update("/a", value, False))
+    client.run_callbacks()
+    assert client.written[-1] == [{"k": "/a", "v": list(value), "n": False}]
+
+
+def test_stats():
+    client = FakeClient()
+    client.push("/a", cbor2.dumps(1))
+    client.run_callbacks()
+
+    stats = client.stats()
+    assert stats["sent"] == stats["frames"] == 1
+    assert stats["bytes"] == 2
+    assert stats["rtt"] is None
+    for stage in ("handoff", "encode", "write", "queue"):
+        assert stats[stage]["count"] == 1
+
+
+def test_latency(monkeypatch):
+    now = [10.0]
+    monkeypatch.setattr(nt_client.time, "perf_counter", lambda: now[0])
+
+    client = FakeClient(latency=True)
+    client.push("/a", cbor2.dumps(1))
+    now[0] = 10.25
+    client.run_callbacks()
+
+    # the frame is stamped with the time it was sent and the queue delay
+    assert client.written == [[1, {"l": [10250.0, 250.0]}]]
+
+    # the client held the stamp for 20ms and the round trip took 100ms
+    now[0] = 10.37
+    client.echo(10250.0, 20.0, 5.0, 80.0)
+    client.run_callbacks()
+    assert client.written[1][0] == {"e": 5.0}
+
+    stats = client.stats()
+    assert stats["rtt"]["count"] == 1
+    assert abs(stats["rtt"]["max_ms"] - 100) < 0.001
+    assert stats["staleness"]["max_ms"] == 80
@@ -0,0 +1,211 @@
+import cbor2
+import pytest
+
+from pynetworktables2js import nt_hub
+from pynetworktables2js.nt_client import NTClient
+from pynetworktables2js.nt_hub import NTHub
+
+from conftest import RecordingClient
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    # don't register real NetworkTables listeners
+    monkeypatch.setattr(NTHub, "open", lambda self: None)
+    return NTHub()
+
+
+def test_fanout_encodes_once(hub, monkeypatch):
+    c1, c2 = RecordingClient(), RecordingClient()
+    hub.attach(c1)
+    hub.attach(c2)
+    del c1.msgs[:], c2.msgs[:]
+
+    calls = []
+    dumps = cbor2.dumps
+
+    def counting_dumps(obj):
+        calls.append(obj)
+        return dumps(obj)
+
+    monkeypatch.setattr(nt_hub.cbor2, "dumps", counting_dumps)
+
+    hub._nt_on_change("/SmartDashboard/foo", 1.0, True)
+
+    # the same update is given to both clients, and encoded once
+    assert c1.msgs[0] is c2.msgs[0]
+    assert c1.decoded() == c2.decoded()
+    assert len(calls) == 2  # the key and the value
+    assert c1.decoded() == [{"k": "/SmartDashboard/foo", "v": 1.0, "n": True}]
+
+
+def test_attach_sends_current_state(hub):
+    hub._nt_on_change("/a", 1.0, True)
+    hub._nt_on_change("/b", "x", True)
+    hub._nt_on_change("/a", 2.0, False)
+
+    client = RecordingClient()
+    hub.attach(client)
+    msgs = client.decoded()
+
+    assert msgs == [{"r": False, "a": None}, {"s": {"/a": 2.0, "/b": "x"}}]
+
+
+def test_detach(hub):
+    client = RecordingClient()
+    hub.attach(client)
+    hub.detach(client)
+    del client.msgs[:]
+
+    hub._nt_on_change("/a", 1.0, True)
+    assert client.msgs == []
+
+
+def test_subscriptions(hub):
+    hub._nt_on_change("/SmartDashboard/a", 1.0, True)
+    hub._nt_on_change("/LiveWindow/b", 2.0, True)
+
+    client = RecordingClient(prefixes=["/SmartDashboard/"])
+    hub.attach(client)
+    hub._nt_on_change("/LiveWindow/b", 3.0, False)
+    hub._nt_on_change("/SmartDashboard/a", 4.0, False)
+
+    msgs = client.decoded()[1:]
+    assert msgs == [
+        {"s": {"/SmartDashboard/a": 1.0}},
+        {"k": "/SmartDashboard/a", "v": 4.0, "n": False},
+    ]
+
+    # subscribing sends the current value of newly matching keys
+    del client.msgs[:]
+    hub.process_update(cbor2.dumps({"s": ["/LiveWindow/"]}), client)
+    assert client.decoded() == [{"s": {"/LiveWindow/b": 3.0}}]
+
+    del client.msgs[:]
+    hub.process_update(cbor2.dumps({"u": ["/SmartDashboard/"]}), client)
+    hub._nt_on_change("/SmartDashboard/a", 5.0, False)
+    assert client.msgs == []
+
+
+def test_subscribe_narrows_all(hub):
+    client = RecordingClient()
+    hub.attach(client)
+    hub.subscribe(client, ["/a"])
+    del client.msgs[:]
+
+    hub._nt_on_change("/b", 1.0, True)
+    assert client.msgs == []
+
+
+def test_unsubscribe_all(hub):
+    # there is nothing to unsubscribe from while receiving everything
+    client = RecordingClient()
+    hub.attach(client)
+    hub.process_update(cbor2.dumps({"u": ["/a"]}), client)
+    del client.msgs[:]
+
+    hub._nt_on_change("/a", 1.0, True)
+    hub._nt_on_change("/b", 2.0, True)
+    assert client.prefixes is None
+    assert len(client.msgs) == 2
+
+
+def test_connect_resets_clients(hub, monkeypatch):
+    # a request to connect to another robot starts every client over
+    calls = []
+    monkeypatch.setattr(NTHub, "close", lambda self: calls.append("close"))
+    monkeypatch.setattr(
+        nt_hub.NetworkTables, "shutdown", lambda: calls.append("shutdown")
+    )
+    monkeypatch.setattr(nt_hub.NetworkTables, "initialize", calls.append)
+    monkeypatch.setattr(nt_hub.NetworkTables, "getRemoteAddress", lambda: None)
+
+    hub._nt_on_change("/a", 1.0, True)
+    c1, c2 = RecordingClient(resume=("", 0)), RecordingClient(resume=("", 0))
+    hub.attach(c1)
+    hub.attach(c2)
+    token = c1.decoded()[1]["t"]
+    del c1.msgs[:], c2.msgs[:]
+
+    hub.process_update(cbor2.dumps({"a": "10.0.0.2"}), c1)
+    assert calls == ["close", "shutdown", "10.0.0.2"]
+    assert hub.snapshot()[1] == {}
+    for client in (c1, c2):
+        assert client.resets == 1
+        snapshot = client.decoded()[-1]
+        assert snapshot["s"] == {} and snapshot["t"] != token and "p" not in snapshot
+
+
+def test_resume(hub):
+    hub._nt_on_change("/a", 1.0, True)
+    hub._nt_on_change("/b", 2.0, True)
+
+    # a new session gets everything and the session token
+    client = RecordingClient(resume=("", 0))
+    hub.attach(client)
+    snapshot = client.decoded()[1]
+    token = snapshot["t"]
+    assert snapshot == {"s": {"/a": 1.0, "/b": 2.0}, "t": token}
+    assert client.seq == 2
+    hub.detach(client)
+
+    hub._nt_on_change("/b", 3.0, False)
+    hub._nt_on_change("/c", 4.0, True)
+
+    # resuming only sends what changed since
+    client = RecordingClient(resume=(token, 2))
+    hub.attach(client)
+    assert client.decoded()[1] == {"s": {"/b": 3.0, "/c": 4.0}, "t": token, "p": True}
+    assert client.seq == 4
+
+    # an unknown session starts over
+    client = RecordingClient(resume=("nope", 2))
+    hub.attach(client)
+    snapshot = client.decoded()[1]
+    assert "p" not in snapshot
+    assert snapshot["s"] == {"/a": 1.0, "/b": 3.0, "/c": 4.0}
+
+
+def test_batched_write(hub, monkeypatch):
+    calls = []
+
+    class Entry(object):
+        def __init__(self, key):
+            self.key = key
+
+        def setValue(self, value):
+            calls.append((self.key, value))
+
+    monkeypatch.setattr(nt_hub.NetworkTables, "getEntry", Entry)
+    monkeypatch.setattr(nt_hub.NetworkTables, "flush", lambda: calls.append("flush"))
+
+    hub.process_update(cbor2.dumps({"w": {"/a": 1.0, "/b": [True, False]}}))
+    assert calls == [("/a", 1.0), ("/b", [True, False]), "flush"]
+
+
+def test_stats(hub, monkeypatch):
+    class Time(object):
+        now = 0
+
+        def perf_counter(self):
+            self.now += 1
+            return self.now
+
+    monkeypatch.setattr(nt_hub, "time", Time())
+
+    class Quiet(NTClient):
+        def _call_soon_threadsafe(self, callback):
+            pass
+
+    hub.attach(Quiet())
+    for key in ("/a", "/a", "/b"):
+        hub._nt_on_change(key, 1.0, False)
+
+    # three updates at 1, 3 and 5, and the window ends at 7
+    stats = hub.stats(top=1)
+    assert stats["keys"] == 2
+    assert stats["listener"]["count"] == 3
+    assert stats["hottest"] == [{"key": "/a", "per_sec": 0.3}]
+    assert stats["updates_per_sec"] == 0.5
+    assert len(stats["clients"]) == 1
+    assert stats["latency"]["rtt"]["count"] == 0
@@ -0,0 +1,34 @@
+import cbor2
+import pytest
+
+from pynetworktables2js import nt_serial
+from pynetworktables2js.nt_hub import NTHub
+from pynetworktables2js.nt_serial import NTSerial
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    # don't register real NetworkTables listeners
+    monkeypatch.setattr(NTHub, "open", lambda self: None)
+    hub = NTHub()
+    monkeypatch.setattr(nt_serial, "get_hub", lambda: hub)
+    return hub
+
+
+def test_serial(hub):
+    hub.update("/a", 1.0, True)
+    sent = []
+    with pytest.deprecated_call():
+        serial = NTSerial(lambda update: sent.append(cbor2.loads(update)))
+
+    # the current values are sent as separate updates, as they always were
+    hub.update("/b", "x", True)
+    assert sent == [
+        {"r": False, "a": None},
+        {"k": "/a", "v": 1.0, "n": True},
+        {"k": "/b", "v": "x", "n": True},
+    ]
+
+    serial.close()
+    hub.update("/a", 2.0, False)
+    assert len(sent) == 3
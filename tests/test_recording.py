@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from pynetworktables2js import recording
+from pynetworktables2js.nt_hub import NTHub
+from pynetworktables2js.recording import KEYFRAME, LogReader, Recorder, Replay
+
+from conftest import RecordingClient
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(recording.time, "perf_counter", lambda: now[0])
+    return now
+
+
+def record(path, clock, updates, **kwargs):
+    recorder = Recorder(str(path), **kwargs)
+    for t, key, value in updates:
+        clock[0] = 100.0 + t
+        recorder.add(key, value)
+    recorder.close()
+
+
+def test_round_trip(tmp_path, clock):
+    path = tmp_path / "match.nt2js"
+    updates = [
+        (0.0, "/a", 1.0),
+        (0.5, "/b", "x"),
+        (1.5, "/a", 2.0),
+        (2.0, "/c", [1.0, 2.0]),
+        (2.25, "/a", 3.0),
+    ]
+    record(path, clock, updates, keyframe_interval=1.0)
+
+    reader = LogReader(str(path))
+    keyframes = [c for c in reader.chunks if c.flags & KEYFRAME]
+    assert len(keyframes) == 1
+    assert reader.duration == 2.25
+    assert list(reader.updates_from(0)) == updates
+    assert list(reader.updates_from(1.5)) == updates[2:]
+
+    # the value of each key before the time
+    assert reader.values_at(0) == {}
+    assert reader.values_at(0.2) == {"/a": 1.0}
+    assert reader.values_at(1.5) == {"/a": 1.0, "/b": "x"}
+    assert reader.values_at(2.1) == {"/a": 2.0, "/b": "x", "/c": [1.0, 2.0]}
+    assert reader.values_at(9) == {"/a": 3.0, "/b": "x", "/c": [1.0, 2.0]}
+
+    # an existing log is never overwritten
+    with pytest.raises(FileExistsError):
+        Recorder(str(path))
+
+
+def test_partial_chunk(tmp_path, clock):
+    path = tmp_path / "match.nt2js"
+    record(path, clock, [(0.0, "/a", 1.0), (1.5, "/a", 2.0)])
+
+    # a recording that is still being written
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    reader = LogReader(str(path))
+    assert list(reader.updates_from(0)) == [(0.0, "/a", 1.0)]
+
+    path.write_bytes(data)
+    assert reader.refresh() == 1
+    assert reader.duration == 1.5
+
+    (tmp_path / "other").write_bytes(b"hello")
+    with pytest.raises(ValueError):
+        LogReader(str(tmp_path / "other"))
+
+
+def test_writer_thread(tmp_path, monkeypatch):
+    # the thread adding updates never compresses or writes chunks
+    threads = []
+    compress = recording.zlib.compress
+    monkeypatch.setattr(
+        recording.zlib,
+        "compress",
+        lambda data: threads.append(threading.current_thread()) or compress(data),
+    )
+
+    path = tmp_path / "match.nt2js"
+    recorder = Recorder(str(path), chunk_interval=0.05)
+    recorder.add("/a", 1.0)
+    time.sleep(0.06)
+    recorder.add("/a", 2.0)
+
+    # a chunk is written once it is old enough, even without more updates
+    reader = LogReader(str(path))
+    wait_for(lambda: reader.refresh() and reader.duration > 0)
+    recorder.close()
+    assert threads and threading.current_thread() not in threads
+    reader.refresh()
+    assert [u[2] for u in reader.updates_from(0)] == [1.0, 2.0]
+    reader.close()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_replay(tmp_path, clock):
+    path = tmp_path / "match.nt2js"
+    record(path, clock, [(0.0, "/a", 1.0), (1.5, "/b", 2.0), (3.0, "/a", 3.0)])
+
+    replay = Replay(str(path), speed=0)
+    hub = NTHub()
+    hub.source = replay
+    client = RecordingClient(resume=("", -1))
+    # attaching starts the replay, which would otherwise be able to finish
+    # before the client is added
+    replay.pause()
+    hub.attach(client)
+    replay.pause(False)
+    try:
+        wait_for(lambda: replay.updates == 3)
+        assert {"r": True, "a": str(path)} in client.decoded()
+        assert client.decoded()[-3:] == [
+            {"k": "/a", "v": 1.0, "n": True},
+            {"k": "/b", "v": 2.0, "n": True},
+            {"k": "/a", "v": 3.0, "n": False},
+        ]
+
+        # seeking sends the table as it was, and starts a new session
+        del client.msgs[:]
+        replay.seek(2.0)
+        wait_for(lambda: replay.updates == 4)
+        snapshot = next(m for m in client.decoded() if "s" in m)
+        assert snapshot["s"] == {"/a": 1.0, "/b": 2.0}
+        assert "t" in snapshot and "p" not in snapshot
+        assert client.decoded()[-1] == {"k": "/a", "v": 3.0, "n": False}
+        assert replay.status()["position"] == 3.0
+    finally:
+        hub.close()
+
+    with pytest.raises(ValueError):
+        replay.set_speed(-1)
@@ -0,0 +1,37 @@
+from pynetworktables2js.stats import Histogram, KeyRates
+
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(50) is None
+
+    for _ in range(90):
+        h.add(0.0001)  # 100us
+    for _ in range(10):
+        h.add(0.010)
+
+    # within a factor of two
+    assert 0.0001 <= h.percentile(50) < 0.0002
+    assert 0.010 == h.percentile(99)
+    assert h.to_dict()["count"] == 100
+    assert h.to_dict()["max_ms"] == 10.0
+
+    other = Histogram()
+    other.add(1.0)
+    h.merge(other)
+    assert h.count == 101
+    assert h.percentile(100) == 1.0
+
+
+def test_key_rates():
+    rates = KeyRates(window=1.0)
+    for i in range(10):
+        rates.add("/a", i / 10.0)
+    rates.add("/b", 0.5)
+
+    # the first window isn't complete yet
+    assert rates.rates(0.9) == {}
+    assert rates.rates(1.0) == {"/a": 10.0, "/b": 1.0}
+
+    # nothing was counted since
+    assert rates.rates(3.5) == {}
@@ -0,0 +1,103 @@
+import json
+
+import cbor2
+import pytest
+
+from pynetworktables2js import values
+from pynetworktables2js.nt_hub import NTHub
+from pynetworktables2js.values import ValueCache
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    # don't register real NetworkTables listeners
+    monkeypatch.setattr(NTHub, "open", lambda self: None)
+    hub = NTHub()
+    monkeypatch.setattr(values, "get_hub", lambda: hub)
+    hub.update("/SmartDashboard/a", 1.0, True)
+    hub.update("/SmartDashboard/b", "x", True)
+    hub.update("/LiveWindow/c", [1.0, 2.0], True)
+    return hub
+
+
+def query(**args):
+    return lambda name: args.get(name, [])
+
+
+def test_values(hub):
+    cache = ValueCache()
+
+    status, headers, body = cache.respond(query())
+    assert status == 200
+    assert headers["Content-Type"] == "application/json"
+    assert json.loads(body) == {
+        "/SmartDashboard/a": 1.0,
+        "/SmartDashboard/b": "x",
+        "/LiveWindow/c": [1.0, 2.0],
+    }
+
+    _, _, body = cache.respond(query(key=["/SmartDashboard/a", "/missing"]))
+    assert json.loads(body) == {"/SmartDashboard/a": 1.0}
+
+    _, headers, body = cache.respond(
+        query(prefix=["/LiveWindow/"]), accept="application/cbor"
+    )
+    assert headers["Content-Type"] == "application/cbor"
+    assert cbor2.loads(body) == {"/LiveWindow/c": [1.0, 2.0]}
+
+    _, headers, body = cache.respond(query(format=["cbor"]))
+    assert len(cbor2.loads(body)) == 3
+
+    for args in ({"format": ["xml"]}, {"key": ["/a"], "prefix": ["/"]}):
+        with pytest.raises(ValueError):
+            cache.respond(query(**args))
+
+
+def test_etag(hub, monkeypatch):
+    cache = ValueCache()
+    encoded = []
+    encode = values.encode
+    monkeypatch.setattr(
+        values, "encode", lambda *args: encoded.append(args) or encode(*args)
+    )
+
+    status, headers, _ = cache.respond(query(prefix=["/SmartDashboard/"]))
+    etag = headers["ETag"]
+    assert len(encoded) == 1
+
+    status, _, body = cache.respond(query(prefix=["/SmartDashboard/"]), "", etag)
+    assert (status, body) == (304, b"")
+
+    # changes to other keys don't change the ETag or encode again
+    hub.update("/LiveWindow/c", [3.0], False)
+    status, headers, _ = cache.respond(query(prefix=["/SmartDashboard/"]))
+    assert status == 200 and headers["ETag"] == etag
+    assert len(encoded) == 1
+
+    # but changes to the selected keys do
+    hub.update("/SmartDashboard/b", "y", False)
+    status, headers, body = cache.respond(query(prefix=["/SmartDashboard/"]), "", etag)
+    assert status == 200 and headers["ETag"] != etag
+    assert json.loads(body)["/SmartDashboard/b"] == "y"
+
+    # the format is part of the ETag
+    _, cbor_headers, _ = cache.respond(
+        query(prefix=["/SmartDashboard/"], format=["cbor"])
+    )
+    assert cbor_headers["ETag"] != headers["ETag"]
+
+
+def test_handlers_open_hub(monkeypatch):
+    # the hub starts listening before the first request, so that it has
+    # the current values by then
+    from pynetworktables2js import aiohttp_handlers, tornado_handlers
+
+    opened = []
+    monkeypatch.setattr(NTHub, "open", lambda self: opened.append(self))
+    hub = NTHub()
+    for module in (aiohttp_handlers, tornado_handlers):
+        monkeypatch.setattr(module, "get_hub", lambda: hub)
+
+    aiohttp_handlers.networktables_values_handler()
+    tornado_handlers.get_handlers()
+    assert opened == [hub, hub]